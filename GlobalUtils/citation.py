@@ -10,15 +10,37 @@ from openai import OpenAI, AsyncOpenAI
 import uuid
 import os
 import asyncio
-import pytesseract
+from contextlib import contextmanager
 
 from GlobalUtils.ocr import whisper_pdf_text_extraction
-from unstract.llmwhisperer import LLMWhispererClientV2
+from GlobalUtils.document import Document, get_document
+from GlobalUtils.line_layout import get_line_layout
+from GlobalUtils.orientation import get_page_rotations
+from GlobalUtils.page_raster_cache import PageRasterCache, get_page_raster_cache
 
 
 class CitationLines(BaseModel):
     lines: list[int]
 
+@contextmanager
+def open_pdf_source(pdf_source: str | bytes | Document):
+    """Open a PDF source (path, bytes, or shared Document) as a fitz document. A Document's already-open fitz document
+    is used (under its lock) rather than re-opening the file."""
+    if isinstance(pdf_source, Document):
+        with pdf_source.lock:
+            yield pdf_source.fitz_doc
+        return
+    if isinstance(pdf_source, bytes):
+        doc = fitz.open(stream=pdf_source)
+    elif isinstance(pdf_source, str):
+        doc = fitz.open(pdf_source)
+    else:
+        raise ValueError('pdf_source must be str path, bytes or Document')
+    try:
+        yield doc
+    finally:
+        doc.close()
+
 def render_line_highlights(
         text: str,
         highlight_lines: list[int],
@@ -27,209 +49,193 @@ def render_line_highlights(
         zoom: float = 2.0,
         line_height: int = 16,
         text_height: int = 8,
-        page_height: int | None = None
+        window_lines: int | None = None
 ):
-    doc = fitz.open()  # new empty PDF
-    if page_height is not None:
-        page = doc.new_page(height=page_height)  # new page
-    else:
-        page = doc.new_page()  # new page
-    y = 0
-    for line_ind, line in enumerate(text.splitlines()):
-        highlight_rect = fitz.Rect(0, y, page.rect.width, y + line_height)
-        text_rect = fitz.Rect(50, y + 2, 550, y + line_height)
-        while page.insert_textbox(text_rect, line, fontsize=text_height) < 0.:
-            text_rect.y1 += line_height
-            highlight_rect.y1 += line_height
-        if line_ind in highlight_lines:
-            annot = page.add_highlight_annot(highlight_rect)
-            annot.set_colors(stroke=highlight_color)
-            annot.set_opacity(highlight_opacity)
-            annot.update()
-        y = highlight_rect.y1  # increment y position for next line
-    if y > page.rect.height:
-        return render_line_highlights(text, highlight_lines, highlight_color, highlight_opacity, zoom, line_height, text_height, page_height=y+20)
-    mat = fitz.Matrix(zoom, zoom)
-    pix_bytes = page.get_pixmap(matrix = mat).tobytes('png')
-    img = Image.open(io.BytesIO(pix_bytes))
-    return img.convert('RGB')
+    """
+    Render text lines with some of them highlighted, e.g. a WD page without a usable original to draw on.
+
+    Args:
+        text: The text to render, one line per line
+        highlight_lines: Indices of the lines to highlight
+        zoom: Rendering resolution multiplier
+        line_height: Height of an (unwrapped) line, in points
+        text_height: Font size
+        window_lines: If given, only render this many lines of context around the highlighted lines
+
+    Returns:
+        PIL Image (RGB)
+    """
+    layout = get_line_layout(text, fontsize=text_height, line_height=line_height)  # laid out once per text
+    return layout.render(
+        highlight_lines,
+        window_lines=window_lines,
+        highlight_color=highlight_color,
+        highlight_opacity=highlight_opacity,
+        zoom=zoom
+    )
+
+def prepare_line_highlights(text: str, line_height: int = 16, text_height: int = 8):
+    """Lay out a text ahead of time (e.g. at ingest), so the first render_line_highlights call for it with the same
+    sizes only has to draw."""
+    get_line_layout(text, fontsize=text_height, line_height=line_height)
+
+def get_highlight_rect(line_metadata: list[int], target_width: int, target_height: int) -> tuple[int, int, int, int]:
+    """Scale an LLMWhisperer line metadata entry ([page, base_y, height, page_height]) to a full-width (x0, y0, x1, y1)
+    rectangle on a page image of the given size - as LLMWhispererClientV2.get_highlight_rect does, without the
+    client."""
+    base_y, height, page_height = line_metadata[1], line_metadata[2], line_metadata[3]
+    y0 = int((base_y - height) * target_height / page_height)
+    y1 = int(base_y * target_height / page_height)
+    return 0, y0, target_width, y1
+
+def get_render_matrix(zoom: float, rotation: int = 0) -> fitz.Matrix:
+    """The matrix pages are rendered with. get_pixmap already applies the page's own /Rotate, so only the detected
+    content rotation (see GlobalUtils.orientation) is added on top."""
+    return fitz.Matrix(zoom, zoom).prerotate(rotation)
+
+def get_content_rotation(pdf_source: str | bytes | Document, page: int) -> int:
+    """Get a page's detected content rotation, from the document's page orientation map."""
+    if isinstance(pdf_source, Document):
+        return get_page_rotations(pdf_source).get(page, 0)
+    print('Rotation detection needs a Document source - rendering without it.')
+    return 0
+
+def get_bbox_pixel_rects(pdf_page: fitz.Page, bboxes: list[list[float]], zoom: float = 2.0, rotation: int = 0, padding: float = 0.) -> list[list[float]]:
+    """Map bboxes in unrotated page coordinates (as from get_text('dict')) to pixel rectangles on the page's render -
+    through the page's /Rotate, then the render matrix, relative to the rendered image's top left corner."""
+    render_mat = get_render_matrix(zoom, rotation)
+    to_pixels = pdf_page.rotation_matrix * render_mat
+    origin = (pdf_page.rect * render_mat).irect.tl
+    rects = []
+    for x0, y0, x1, y1 in bboxes:
+        rect = fitz.Rect(x0 - padding, y0 - padding, x1 + padding, y1 + padding) * to_pixels
+        rects.append([rect.x0 - origin.x, rect.y0 - origin.y, rect.x1 - origin.x, rect.y1 - origin.y])
+    return rects
+
+def render_page_raster(
+        pdf_source: str | bytes | Document,
+        page: int,
+        zoom: float = 2.0,
+        detect_rotation: bool = False,
+        raster_cache: PageRasterCache | None = None
+) -> Image.Image:
+    """
+    Get the (un-highlighted) image of a PDF page, from the page raster cache if it's been rendered before.
+
+    Args:
+        pdf_source: Path to PDF file, PDF bytes, or shared Document (bytes are rendered every time)
+        page: Page number (0-indexed)
+        zoom: Rendering resolution multiplier
+        detect_rotation: Whether to correct the page's rotation, using the document's page orientation map (detected
+            once per document - see GlobalUtils.orientation - if ingest hasn't already)
+        raster_cache: Page raster cache (default: the process-wide in-memory cache)
+
+    Returns:
+        PIL Image (RGB) of the page - shared with the cache, so copy it before drawing on it
+    """
+    if isinstance(pdf_source, str):
+        pdf_source = get_document(pdf_source)
+    if raster_cache is None:
+        raster_cache = get_page_raster_cache()
+    rotation = get_content_rotation(pdf_source, page) if detect_rotation else 0
+    with open_pdf_source(pdf_source) as doc:
+        if page < 0 or page >= len(doc):
+            raise ValueError(f"Page {page} out of range. PDF has {len(doc)} pages.")
+
+        pdf_page = doc[page]
+
+        def render() -> Image.Image:
+            pix = pdf_page.get_pixmap(matrix=get_render_matrix(zoom, rotation), alpha=False)
+            # straight from the samples buffer - no PNG round trip
+            return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+        if not isinstance(pdf_source, Document):
+            return render()
+        return raster_cache.get_or_render(pdf_source.get_digest(), page, zoom, rotation, render)
+
+def draw_highlights(
+        img: Image.Image,
+        rects: list,
+        highlight_color: tuple[float, float, float] = (1, 1, 0),
+        highlight_opacity: float = 0.3
+) -> Image.Image:
+    """Composite semi-transparent highlight rectangles (x0, y0, x1, y1 in image pixels) onto a copy of an image."""
+    overlay = Image.new('RGBA', img.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(overlay)
+    # Convert RGB 0-1 to 0-255
+    color_255 = tuple(int(c * 255) for c in highlight_color)
+    alpha = int(highlight_opacity * 255)
+    fill_color = (*color_255, alpha)
+    for rect in rects:
+        draw.rectangle(rect, fill=fill_color, width=3)
+
+    # Composite the overlay onto the original image
+    highlighted = Image.alpha_composite(img.convert('RGBA'), overlay)
+    return highlighted.convert('RGB')  # Convert back to RGB for st.image
 
 def render_pdf_page_metadata_highlights(
-        pdf_source: str | bytes,
+        pdf_source: str | bytes | Document,
         page: int,
         line_metadatas: list[list[int]],
         detect_rotation: bool = False,
         highlight_color: tuple[float, float, float] = (1, 1, 0),  # RGB 0-1, default yellow
         highlight_opacity: float = 0.3,
-        zoom: float = 2.0  # Higher = better quality, 2.0 is good default
+        zoom: float = 2.0,  # Higher = better quality, 2.0 is good default
+        raster_cache: PageRasterCache | None = None
 ) -> Image.Image:
     """
-    Render a PDF page with a highlighted bounding box.
+    Render a PDF page with LLMWhisperer lines highlighted.
 
     Args:
-        pdf_source: Path to PDF file, or PDF bytes
+        pdf_source: Path to PDF file, PDF bytes, or shared Document
         page: Page number (0-indexed)
-        bbox: Bounding box as [x0, y0, x1, y1] in PDF coordinates
+        line_metadatas: LLMWhisperer line metadata entries for the lines to highlight
         highlight_color: RGB tuple with values 0-1
         highlight_opacity: Transparency of highlight (0-1)
         zoom: Rendering resolution multiplier
+        raster_cache: Page raster cache (default: the process-wide in-memory cache)
 
     Returns:
         PIL Image with highlighted region
     """
-    if isinstance(pdf_source, bytes):
-        doc = fitz.open(stream=pdf_source)
-    elif isinstance(pdf_source, str):
-        doc = fitz.open(pdf_source)
-    else:
-        raise ValueError('pdf_source must be str path or bytes')
-
-    if page < 0 or page >= len(doc):
-        raise ValueError(f"Page {page} out of range. PDF has {len(doc)} pages.")
-
-    pdf_page = doc[page]
-
-    # Render page at higher resolution
-    render_mat = fitz.Matrix(zoom, zoom).prerotate(pdf_page.rotation)
-
-    if detect_rotation:
-        print('Detecting rotation via OSD...')
-        try:
-            osd_mat = fitz.Matrix(1.5, 1.5).prerotate(pdf_page.rotation)
-            small_pix = pdf_page.get_pixmap(matrix=osd_mat)
-            small_img = Image.frombytes("RGB", [small_pix.width, small_pix.height], small_pix.samples)
-            osd = pytesseract.image_to_osd(small_img)
-            for line in osd.split('\n'):
-                if 'Rotate:' in line:
-                    detected_rotation = int(line.split(':')[1].strip())
-                    render_mat = render_mat.prerotate(detected_rotation)
-                    print(f'Detected rotation: {detected_rotation} degrees')
-                    break
-        except pytesseract.TesseractError as e:
-            print(f'Error during OSD rotation detection: {e}')
-            pass
-
-    pix = pdf_page.get_pixmap(matrix=render_mat)
-
-
-
-    # Convert to PIL Image
-    img_data = pix.tobytes("png")
-    img = Image.open(io.BytesIO(img_data))
-
-    # Create a semi-transparent overlay
-    overlay = Image.new('RGBA', img.size, (255, 255, 255, 0))
-    draw = ImageDraw.Draw(overlay)
-
-    # Draw highlight rectangles
-    llm_whisperer_client = LLMWhispererClientV2()
-    for line_data in line_metadatas:
-        scaled_bbox = llm_whisperer_client.get_highlight_rect(line_data, target_width = img.width, target_height = img.height)
-        scaled_bbox = scaled_bbox[1:]  # remove page number
-        # Convert RGB 0-1 to 0-255
-        color_255 = tuple(int(c * 255) for c in highlight_color)
-        alpha = int(highlight_opacity * 255)
-        fill_color = (*color_255, alpha)
-
-        # Draw filled rectangle
-        draw.rectangle(scaled_bbox, fill=fill_color, width=3)
-
-    # Composite the overlay onto the original image
-    img = img.convert('RGBA')
-    img = Image.alpha_composite(img, overlay)
-
-    doc.close()
-
-    return img.convert('RGB')  # Convert back to RGB for st.image
+    img = render_page_raster(pdf_source, page, zoom=zoom, detect_rotation=detect_rotation, raster_cache=raster_cache)
+    rects = [get_highlight_rect(line_data, target_width=img.width, target_height=img.height) for line_data in line_metadatas]
+    return draw_highlights(img, rects, highlight_color=highlight_color, highlight_opacity=highlight_opacity)
 
 def render_pdf_page_with_highlights(
-        pdf_source: str | bytes,
+        pdf_source: str | bytes | Document,
         page: int,
         bboxes: list[list[float]],
         detect_rotation: bool = False,
         highlight_color: tuple[float, float, float] = (1, 1, 0),  # RGB 0-1, default yellow
         highlight_opacity: float = 0.3,
-        zoom: float = 2.0  # Higher = better quality, 2.0 is good default
+        zoom: float = 2.0,  # Higher = better quality, 2.0 is good default
+        raster_cache: PageRasterCache | None = None,
+        padding: float = 0.
 ) -> Image.Image:
     """
-    Render a PDF page with a highlighted bounding box.
+    Render a PDF page with highlighted bounding boxes.
 
     Args:
-        pdf_source: Path to PDF file, or PDF bytes
+        pdf_source: Path to PDF file, PDF bytes, or shared Document
         page: Page number (0-indexed)
-        bbox: Bounding box as [x0, y0, x1, y1] in PDF coordinates
+        bboxes: Bounding boxes as [x0, y0, x1, y1] in unrotated page coordinates (as from get_text('dict'))
         highlight_color: RGB tuple with values 0-1
         highlight_opacity: Transparency of highlight (0-1)
         zoom: Rendering resolution multiplier
+        raster_cache: Page raster cache (default: the process-wide in-memory cache)
+        padding: Margin added around each bbox, in PDF points
 
     Returns:
         PIL Image with highlighted region
     """
-    if isinstance(pdf_source, bytes):
-        doc = fitz.open(stream=pdf_source)
-    elif isinstance(pdf_source, str):
-        doc = fitz.open(pdf_source)
-    else:
-        raise ValueError('pdf_source must be str path or bytes')
-
-    if page < 0 or page >= len(doc):
-        raise ValueError(f"Page {page} out of range. PDF has {len(doc)} pages.")
-
-    pdf_page = doc[page]
-
-    # Render page at higher resolution
-    render_mat = fitz.Matrix(zoom, zoom).prerotate(pdf_page.rotation)
-
-    if detect_rotation:
-        print('Detecting rotation via OSD...')
-        try:
-            osd_mat = fitz.Matrix(1.5, 1.5).prerotate(pdf_page.rotation)
-            small_pix = pdf_page.get_pixmap(matrix=osd_mat)
-            small_img = Image.frombytes("RGB", [small_pix.width, small_pix.height], small_pix.samples)
-            osd = pytesseract.image_to_osd(small_img)
-            for line in osd.split('\n'):
-                if 'Rotate:' in line:
-                    detected_rotation = int(line.split(':')[1].strip())
-                    render_mat = render_mat.prerotate(detected_rotation)
-                    print(f'Detected rotation: {detected_rotation} degrees')
-                    break
-        except pytesseract.TesseractError as e:
-            print(f'Error during OSD rotation detection: {e}')
-            pass
-
-    pix = pdf_page.get_pixmap(matrix=render_mat)
-
-
-
-    # Convert to PIL Image
-    img_data = pix.tobytes("png")
-    img = Image.open(io.BytesIO(img_data))
-
-    # Create a semi-transparent overlay
-    overlay = Image.new('RGBA', img.size, (255, 255, 255, 0))
-    draw = ImageDraw.Draw(overlay)
-
-    # Draw highlight rectangles
-    for bbox in bboxes:
-        x0, y0, x1, y1 = bbox
-        scaled_bbox = [x0 * zoom, y0 * zoom, x1 * zoom, y1 * zoom]
-
-
-        # Convert RGB 0-1 to 0-255
-        color_255 = tuple(int(c * 255) for c in highlight_color)
-        alpha = int(highlight_opacity * 255)
-        fill_color = (*color_255, alpha)
-
-        # Draw filled rectangle
-        draw.rectangle(scaled_bbox, fill=fill_color, width=3)
-
-    # Composite the overlay onto the original image
-    img = img.convert('RGBA')
-    img = Image.alpha_composite(img, overlay)
-
-    doc.close()
-
-    return img.convert('RGB')  # Convert back to RGB for st.image
+    if isinstance(pdf_source, str):
+        pdf_source = get_document(pdf_source)
+    img = render_page_raster(pdf_source, page, zoom=zoom, detect_rotation=detect_rotation, raster_cache=raster_cache)
+    rotation = get_content_rotation(pdf_source, page) if detect_rotation else 0
+    with open_pdf_source(pdf_source) as doc:
+        rects = get_bbox_pixel_rects(doc[page], bboxes, zoom=zoom, rotation=rotation, padding=padding)
+    return draw_highlights(img, rects, highlight_color=highlight_color, highlight_opacity=highlight_opacity)
 
 def find_best_fuzzy_lines(text: str, query: str, max_l_dist: int | None = None):
     """
@@ -331,26 +337,20 @@ async def find_citation_bboxes_normed(
 
 def render_pdf_line_metadatas_to_images(
         whisper_line_metadatas: list[list[int]],
-        pdf_source: str | bytes,
-        detect_rotation: bool = False
+        pdf_source: str | bytes | Document,
+        detect_rotation: bool = False,
+        raster_cache: PageRasterCache | None = None
 ):
     """
     Generate images for each page in source document, with  citation bounding boxes highlighted.
 
     Args:
         citation_bboxes: List of dicts with 'page' and 'bbox' keys in normalized coordinates (0-1)
-        pdf_source: Path to PDF file, or PDF bytes
+        pdf_source: Path to PDF file, PDF bytes, or shared Document
+        raster_cache: Page raster cache (default: the process-wide in-memory cache)
     Returns:
         images, page_numbers - List of PIL Images with highlighted regions, page number for each image
     """
-    if isinstance(pdf_source, bytes):
-        fitz_doc = fitz.Document(stream=pdf_source)
-    elif isinstance(pdf_source, str):
-        fitz_doc = fitz.Document(pdf_source)
-    else:
-        raise ValueError('pdf_source must be str path or bytes')
-    fitz_doc.close()
-
     page_bboxes = {}
 
     for citation_line_data in whisper_line_metadatas:
@@ -365,7 +365,8 @@ def render_pdf_line_metadatas_to_images(
             pdf_source=pdf_source,
             page=page,
             line_metadatas=line_metadatas,
-            detect_rotation = detect_rotation
+            detect_rotation = detect_rotation,
+            raster_cache = raster_cache
         )
         images.append(img)
         page_numbers.append(page)
@@ -373,26 +374,22 @@ def render_pdf_line_metadatas_to_images(
 
 def render_pdf_bboxes_to_images(
         citation_bboxes: list[dict],
-        pdf_source: str | bytes,
-        detect_rotation: bool = False
+        pdf_source: str | bytes | Document,
+        detect_rotation: bool = False,
+        raster_cache: PageRasterCache | None = None
 ):
     """
     Generate images for each page in source document, with  citation bounding boxes highlighted.
 
     Args:
         citation_bboxes: List of dicts with 'page' and 'bbox' keys in normalized coordinates (0-1)
-        pdf_source: Path to PDF file, or PDF bytes
+        pdf_source: Path to PDF file, PDF bytes, or shared Document
+        raster_cache: Page raster cache (default: the process-wide in-memory cache)
     Returns:
         images, page_numbers - List of PIL Images with highlighted regions, page number for each image
     """
-    if isinstance(pdf_source, bytes):
-        fitz_doc = fitz.Document(stream=pdf_source)
-    elif isinstance(pdf_source, str):
-        fitz_doc = fitz.Document(pdf_source)
-    else:
-        raise ValueError('pdf_source must be str path or bytes')
-    pages_dims = [fitz_doc[i].rect for i in range(len(fitz_doc))]
-    fitz_doc.close()
+    with open_pdf_source(pdf_source) as fitz_doc:
+        pages_dims = [fitz_doc[i].rect for i in range(len(fitz_doc))]
 
     page_bboxes = {}
     for citation in citation_bboxes:
@@ -414,7 +411,8 @@ def render_pdf_bboxes_to_images(
             pdf_source=pdf_source,
             page=page,
             bboxes=bboxes,
-            detect_rotation = detect_rotation
+            detect_rotation = detect_rotation,
+            raster_cache = raster_cache
         )
         images.append(img)
         page_numbers.append(page)
@@ -422,7 +420,7 @@ def render_pdf_bboxes_to_images(
 
 
 async def get_unstract_citation_images(
-        pdf_source: str | bytes,
+        pdf_source: str | bytes | Document,
         unstract_response_json: dict,
         citation_query: str,
         citation_prompt: str,
@@ -433,7 +431,7 @@ async def get_unstract_citation_images(
     Generate images for each citation bounding box.
 
     Args:
-        pdf_source: Path to PDF file, or PDF bytes
+        pdf_source: Path to PDF file, PDF bytes, or shared Document
         unstract_response_json: JSON response from Unstract OCR
         citation_query: Citation text to search for
         citation_prompt: LLM prompt for finding citation lines
@@ -0,0 +1,205 @@
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, features
+
+from GlobalUtils.disk_store import DiskLRUStore
+
+CITATION_CACHE_VERSION = 2
+# lossless - citations are text, and lossless WebP is both smaller and faster to decode than PNG for page rasters
+IMAGE_FORMAT = 'WEBP' if features.check('webp') else 'PNG'
+IMAGE_SAVE_KWARGS = {'WEBP': {'lossless': True, 'method': 4}, 'PNG': {'compress_level': 1}}
+
+
+def get_citation_key(payroll_digest: str, payroll_citation_line_hexes: list[str], db_wages_digest: str, db_wages_citation_line_hexes: list[str]) -> str:
+    """Key a citation by what it shows - the documents and the cited lines - so identical citations (the same rows
+    opened from another session, or cited by both models) share an entry."""
+    payroll_lines = sorted({int(line_hex, 16) for line_hex in payroll_citation_line_hexes})
+    db_wages_lines = sorted({int(line_hex, 16) for line_hex in db_wages_citation_line_hexes})
+    key_str = json.dumps([CITATION_CACHE_VERSION, payroll_digest, payroll_lines, db_wages_digest, db_wages_lines])
+    return hashlib.sha256(key_str.encode('utf-8')).hexdigest()
+
+
+def encode_citation(citation: tuple) -> bytes:
+    """Encode ((db_wages_images, db_wages_page_numbers), (payroll_images, payroll_page_numbers)) as a JSON header
+    line followed by the encoded images."""
+    (db_wages_images, db_wages_page_numbers), (payroll_images, payroll_page_numbers) = citation
+    image_bytes = []
+    for img in [*db_wages_images, *payroll_images]:
+        buffer = io.BytesIO()
+        img.save(buffer, format=IMAGE_FORMAT, **IMAGE_SAVE_KWARGS[IMAGE_FORMAT])
+        image_bytes.append(buffer.getvalue())
+    header = {
+        'db_wages_page_numbers': db_wages_page_numbers,
+        'payroll_page_numbers': payroll_page_numbers,
+        'image_lengths': [len(data) for data in image_bytes],
+    }
+    return json.dumps(header).encode('utf-8') + b'\n' + b''.join(image_bytes)
+
+
+def decode_citation(data: bytes) -> tuple:
+    header_bytes, body = data.split(b'\n', 1)
+    header = json.loads(header_bytes)
+    images = []
+    offset = 0
+    for length in header['image_lengths']:
+        with Image.open(io.BytesIO(body[offset:offset + length])) as img:
+            images.append(img.convert('RGB'))
+        offset += length
+    n_db_wages = len(header['db_wages_page_numbers'])
+    return (images[:n_db_wages], header['db_wages_page_numbers']), (images[n_db_wages:], header['payroll_page_numbers'])
+
+
+class CitationImageCache:
+    """Byte-budgeted LRU cache of encoded citation images, shared by every session in the process.
+
+    Citations are kept encoded (lossless WebP or PNG) in memory, up to `max_memory_bytes` overall and
+    `max_session_bytes` per session. Entries are shared: each session using one is charged for it, and a session over
+    its budget gives up its least recently used entries first - they only leave memory once no session holds them. If
+    `cache_dir` is given, every citation is also written to disk (up to `max_disk_bytes`), so entries evicted from
+    memory are re-read rather than re-rendered."""
+    def __init__(
+            self,
+            cache_dir: Optional[str] = None,
+            max_memory_bytes: int = 128 * 1024 * 1024,
+            max_session_bytes: int = 32 * 1024 * 1024,
+            max_disk_bytes: int = 1024 * 1024 * 1024
+    ):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_memory_bytes = max_memory_bytes
+        self.max_session_bytes = max_session_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # key -> encoded citation
+        self._memory_bytes = 0
+        self._sessions: dict[str, OrderedDict] = {}  # session id -> {key: size}, least recently used first
+        self._session_bytes: dict[str, int] = {}  # session id -> total size of its entries
+        self._holders: dict[str, set] = {}  # key -> ids of the sessions charged for it
+        self._lock = threading.Lock()
+        self._disk = DiskLRUStore(cache_dir, '.citation', max_disk_bytes, label='citation') if cache_dir is not None else None
+
+    def _charge(self, session_id: str, key: str, size: int):
+        session_keys = self._sessions.setdefault(session_id, OrderedDict())
+        if key not in session_keys:
+            session_keys[key] = size
+            self._session_bytes[session_id] = self._session_bytes.get(session_id, 0) + size
+            self._holders.setdefault(key, set()).add(session_id)
+        session_keys.move_to_end(key)
+
+    def _uncharge(self, session_id: str, key: str):
+        size = self._sessions[session_id].pop(key)
+        self._session_bytes[session_id] -= size
+        holders = self._holders[key]
+        holders.discard(session_id)
+        if not holders:
+            del self._holders[key]
+
+    def _remove_from_memory(self, key: str):
+        data = self._memory.pop(key, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+        for session_id in list(self._holders.get(key, ())):
+            self._uncharge(session_id, key)
+
+    def _memory_put(self, key: str, data: bytes, session_id: str):
+        """Add an entry to memory and charge it to the session, evicting to keep within both budgets."""
+        if len(data) > min(self.max_memory_bytes, self.max_session_bytes):
+            return
+        with self._lock:
+            if key not in self._memory:
+                self._memory[key] = data
+                self._memory_bytes += len(data)
+            self._memory.move_to_end(key)
+            self._charge(session_id, key, len(data))
+            session_keys = self._sessions[session_id]
+            while self._session_bytes[session_id] > self.max_session_bytes:
+                evicted_key = next(iter(session_keys))
+                self._uncharge(session_id, evicted_key)
+                if evicted_key not in self._holders:  # other sessions still using it keep it in memory
+                    self._remove_from_memory(evicted_key)
+            while self._memory_bytes > self.max_memory_bytes:
+                evicted_key = next(iter(self._memory))
+                self._remove_from_memory(evicted_key)
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        return self._disk.read(key) if self._disk is not None else None
+
+    def _disk_put(self, key: str, data: bytes):
+        if self._disk is not None:
+            self._disk.write(key, data)
+
+    def get(self, key: str, session_id: str) -> Optional[tuple]:
+        """Get a cached citation (decoded), or None if it isn't cached."""
+        with self._lock:
+            data = self._memory.get(key)
+        if data is None:
+            data = self._disk_get(key)
+            if data is None:
+                return None
+        try:
+            citation = decode_citation(data)
+        except (OSError, ValueError) as e:
+            print(f'Ignoring unreadable cached citation {key}: {e}')
+            with self._lock:
+                self._remove_from_memory(key)
+            return None
+        self._memory_put(key, data, session_id)
+        return citation
+
+    def put(self, key: str, citation: tuple, session_id: str):
+        data = encode_citation(citation)
+        self._disk_put(key, data)
+        self._memory_put(key, data, session_id)
+
+    def contains(self, key: str) -> bool:
+        """Whether a citation is cached (in memory or on disk), without reading it."""
+        with self._lock:
+            if key in self._memory:
+                return True
+        return self._disk is not None and self._disk.contains(key)
+
+    def get_session_bytes(self, session_id: str) -> int:
+        """How much of the memory cache a session's entries take up."""
+        with self._lock:
+            return self._session_bytes.get(session_id, 0)
+
+    def release_session(self, session_id: str):
+        """Drop a session's claim on its entries, e.g. when its results are cleared. Entries stay cached until
+        evicted."""
+        with self._lock:
+            for key in list(self._sessions.get(session_id, ())):
+                self._uncharge(session_id, key)
+            self._sessions.pop(session_id, None)
+            self._session_bytes.pop(session_id, None)
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+
+_citation_caches: dict[Optional[Path], CitationImageCache] = {}
+_citation_caches_lock = threading.Lock()
+
+
+def get_citation_cache(
+        cache_dir: Optional[str] = None,
+        max_memory_bytes: int = 128 * 1024 * 1024,
+        max_session_bytes: int = 32 * 1024 * 1024,
+        max_disk_bytes: int = 1024 * 1024 * 1024
+) -> CitationImageCache:
+    """Get the (process-wide) citation image cache for a directory (or the memory-only cache, if `cache_dir` is None).
+    The size limits apply when the cache is first created."""
+    key = Path(cache_dir).resolve() if cache_dir is not None else None
+    with _citation_caches_lock:
+        if key not in _citation_caches:
+            _citation_caches[key] = CitationImageCache(
+                cache_dir,
+                max_memory_bytes=max_memory_bytes,
+                max_session_bytes=max_session_bytes,
+                max_disk_bytes=max_disk_bytes
+            )
+        return _citation_caches[key]
@@ -0,0 +1,67 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from GlobalUtils.citation_cache import CitationImageCache
+
+
+class CitationPrefetcher:
+    """Renders a session's citation images in the background, so opening a citation is usually a cache hit.
+
+    Jobs run in submission (i.e. display) order on a small thread pool - threads rather than processes, so renders
+    share the open Documents and the page raster cache. Rendered citations go straight into the shared citation cache,
+    charged to the session, so prefetched images count against the same memory budgets as opened ones. Jobs that start
+    once the session's budget is used up, or whose citation is already cached, are skipped."""
+    def __init__(self, citation_cache: CitationImageCache, session_id: str, max_workers: int = 2):
+        self.citation_cache = citation_cache
+        self.session_id = session_id
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='citation-prefetch')
+        self._futures: dict[str, Future] = {}  # citation key -> render job, until it finishes
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, key: str, render: Callable[[], Any]):
+        """Queue a citation (by its citation cache key) to be rendered, unless it already is."""
+        with self._lock:
+            if self._closed or key in self._futures:
+                return
+            future = self._executor.submit(self._render, key, render)
+            self._futures[key] = future
+        future.add_done_callback(lambda done_future: self._forget(key, done_future))
+
+    def _forget(self, key: str, future: Future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def _render(self, key: str, render: Callable[[], Any]) -> bool:
+        if self._closed or self.citation_cache.contains(key):
+            return False
+        if self.citation_cache.get_session_bytes(self.session_id) >= self.citation_cache.max_session_bytes:
+            return False
+        start_time = time.perf_counter()
+        try:
+            citation = render()
+            self.citation_cache.put(key, citation, self.session_id)
+        except Exception as e:  # left for the dialog to render (and report) on demand
+            print(f'Error prefetching citation {key}: {type(e).__name__}: {e}')
+            return False
+        print(f'Prefetched citation {key} in {time.perf_counter() - start_time:.2f}s')
+        return True
+
+    def wait(self, key: str) -> bool:
+        """Wait for a citation if it's being rendered, returning whether it was rendered into the cache. A job that
+        hasn't started yet is cancelled instead - rendering it directly beats waiting in the queue."""
+        with self._lock:
+            future = self._futures.get(key)
+        if future is None or future.cancel():
+            return False
+        return future.result()
+
+    def close(self):
+        """Cancel outstanding jobs."""
+        with self._lock:
+            self._closed = True
+            self._futures.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+from typing import Optional
+
+import anthropic
+import httpx
+import openai
+from anthropic import AsyncAnthropic
+from openai import AsyncOpenAI
+
+# retries are left to the per-provider limiters in GlobalUtils.rate_limiting, which share backoff across callers
+SDK_MAX_RETRIES = 0
+# keep-alive connections are reused across payrolls, batches and sessions - HTTP/2 multiplexes requests over them
+# where the server supports it
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=40, keepalive_expiry=120.)
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_clients = {}  # (kind, api key) -> client
+_clients_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Get the process-wide background event loop, starting its thread on first use.
+
+    Every async client in the registry is bound to this loop - run anything that uses them with `run_async`."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='async-clients-loop', daemon=True)
+            thread.start()
+            _loop = loop
+        return _loop
+
+
+def run_async(coroutine, timeout: Optional[float] = None):
+    """Run a coroutine on the background event loop, blocking until it's done."""
+    loop = get_event_loop()
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        raise RuntimeError('run_async called from the background event loop - await the coroutine instead.')
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result(timeout=timeout)
+
+
+def _get_client(key: tuple, factory):
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the shared httpx client for plain HTTP APIs (e.g. Unstract)."""
+    return _get_client(
+        ('httpx',),
+        lambda: httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=httpx.Timeout(60., connect=10.))
+    )
+
+
+def get_openai_client(api_key: str) -> AsyncOpenAI:
+    """Get the shared OpenAI client for an API key."""
+    return _get_client(
+        ('openai', api_key),
+        lambda: AsyncOpenAI(api_key=api_key, max_retries=SDK_MAX_RETRIES, http_client=openai.DefaultAsyncHttpxClient(http2=True, limits=HTTP_LIMITS))
+    )
+
+
+def get_anthropic_client(api_key: str) -> AsyncAnthropic:
+    """Get the shared Anthropic client for an API key."""
+    return _get_client(
+        ('anthropic', api_key),
+        lambda: AsyncAnthropic(api_key=api_key, max_retries=SDK_MAX_RETRIES, http_client=anthropic.DefaultAsyncHttpxClient(http2=True, limits=HTTP_LIMITS))
+    )
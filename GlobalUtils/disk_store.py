@@ -0,0 +1,99 @@
+import gzip
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+# an eviction sweep frees space down to this fraction of max_bytes, so the writes after it don't each sweep again
+EVICT_TO_FRACTION = 0.9
+
+
+class DiskLRUStore:
+    """Directory of files (one per key, named `{key}{suffix}`) capped at `max_bytes`.
+
+    Writes are atomic, so concurrent readers - in this process or another - never see a partial file. Reads refresh a
+    file's mtime, and once the directory grows past `max_bytes` the least recently used files are evicted. The
+    directory's size is tracked as files are written (from one scan on the first write), so it's only scanned again
+    when an eviction sweep is due. The on-disk tier of the OCR, run, page raster and citation caches."""
+    def __init__(self, cache_dir: str, suffix: str, max_bytes: int, label: str = 'entry'):
+        self.cache_dir = Path(cache_dir)
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.label = label  # what the files hold, for log messages
+        self._evict_lock = threading.Lock()
+        self._total_bytes = None  # estimated size of the directory, once scanned - other processes' writes aren't seen
+
+    def get_path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}{self.suffix}'
+
+    def read(self, key: str) -> Optional[bytes]:
+        """Read a file, or return None if there isn't one."""
+        path = self.get_path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:  # never written, or evicted by another process
+            return None
+        return data
+
+    def write(self, key: str, data: bytes):
+        path = self.get_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp_path.write_bytes(data)
+        try:
+            replaced_bytes = path.stat().st_size
+        except FileNotFoundError:
+            replaced_bytes = 0
+        os.replace(tmp_path, path)
+        with self._evict_lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(data) - replaced_bytes
+            sweep = self._total_bytes is None or self._total_bytes > self.max_bytes
+        if sweep:
+            self.evict(keep=path)
+
+    def read_json(self, key: str) -> Optional[Any]:
+        """Read a gzipped JSON file, or return None if there isn't a readable one."""
+        data = self.read(key)
+        if data is None:
+            return None
+        try:
+            return json.loads(gzip.decompress(data))
+        except (OSError, EOFError, ValueError) as e:
+            print(f'Ignoring unreadable {self.label} {self.get_path(key)}: {e}')
+            return None
+
+    def write_json(self, key: str, value: Any):
+        self.write(key, gzip.compress(json.dumps(value).encode('utf-8')))
+
+    def contains(self, key: str) -> bool:
+        return self.get_path(key).exists()
+
+    def evict(self, keep: Optional[Path] = None):
+        """If the directory is over max_bytes, delete the least recently used files (other than `keep`) until it's
+        back under EVICT_TO_FRACTION of it."""
+        with self._evict_lock:
+            entries = []
+            for path in self.cache_dir.glob(f'*{self.suffix}'):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:  # evicted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes = sum(size for mtime, size, path in entries)
+            target_bytes = self.max_bytes if total_bytes <= self.max_bytes else self.max_bytes * EVICT_TO_FRACTION
+            for mtime, size, path in sorted(entries):
+                if total_bytes <= target_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+                print(f'Evicted {self.label} {path.name} (last used {time.ctime(mtime)})')
+            self._total_bytes = total_bytes
@@ -0,0 +1,109 @@
+import base64
+import hashlib
+import mmap
+import os
+import threading
+import weakref
+from pathlib import Path
+
+import fitz
+
+
+class Document:
+    """Handle on a PDF file, so it's read, hashed and encoded once however many times it's used.
+
+    The file is memory-mapped on first access, and its SHA-256 digest, base64 encoding, page count and open fitz
+    document are computed lazily and memoized. fitz documents aren't thread-safe - hold `lock` while using
+    `fitz_doc`."""
+    def __init__(self, path: str):
+        self.path = str(path)
+        self.lock = threading.RLock()
+        self._file = None
+        self._mmap = None
+        self._digest = None
+        self._base64 = None
+        self._fitz_doc = None
+        self.page_rotations = None  # page index -> content rotation in degrees, see GlobalUtils.orientation
+
+    @property
+    def data(self) -> memoryview:
+        """The file's bytes (memory-mapped, read-only)."""
+        with self.lock:
+            if self._mmap is None:
+                self._file = open(self.path, 'rb')
+                if os.fstat(self._file.fileno()).st_size == 0:  # empty files can't be mapped
+                    self._mmap = b''
+                else:
+                    self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            return memoryview(self._mmap)
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def get_digest(self) -> str:
+        """Get the file's SHA-256 hex digest (computed once). Call via asyncio.to_thread from async code."""
+        if self._digest is None:
+            digest = hashlib.sha256(self.data).hexdigest()
+            with self.lock:
+                self._digest = digest
+        return self._digest
+
+    @property
+    def digest(self) -> str:
+        return self.get_digest()
+
+    @property
+    def base64(self) -> str:
+        """The file's base64 encoding, e.g. for Claude document blocks (computed once)."""
+        if self._base64 is None:
+            encoded = base64.b64encode(self.data).decode('utf-8')
+            with self.lock:
+                self._base64 = encoded
+        return self._base64
+
+    @property
+    def fitz_doc(self) -> fitz.Document:
+        """The open fitz document - hold `lock` while using it."""
+        with self.lock:
+            if self._fitz_doc is None:
+                self._fitz_doc = fitz.open(self.path)
+            return self._fitz_doc
+
+    @property
+    def page_count(self) -> int:
+        with self.lock:
+            return len(self.fitz_doc)
+
+    def close(self):
+        with self.lock:
+            if self._fitz_doc is not None:
+                self._fitz_doc.close()
+                self._fitz_doc = None
+            if isinstance(self._mmap, mmap.mmap):
+                try:
+                    self._mmap.close()
+                except BufferError:  # a memoryview is still in use - it's closed when collected
+                    pass
+            self._mmap = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_documents = weakref.WeakValueDictionary()  # (resolved path, mtime, size) -> Document
+_documents_lock = threading.Lock()
+
+
+def get_document(path: str) -> Document:
+    """Get the shared Document for a file. Everything using the same (unchanged) file in this process gets the same
+    handle, for as long as any of them holds on to it."""
+    resolved_path = Path(path).resolve()
+    stat = resolved_path.stat()
+    key = (str(resolved_path), stat.st_mtime_ns, stat.st_size)
+    with _documents_lock:
+        document = _documents.get(key)
+        if document is None:
+            document = Document(str(path))
+            _documents[key] = document
+        return document
@@ -0,0 +1,228 @@
+import argparse
+import csv
+import gzip
+import io
+import re
+import tempfile
+import threading
+import urllib.request
+import zipfile
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_MILES = 3958.8
+STATE_ABBREVIATIONS = {
+    'alabama': 'AL', 'alaska': 'AK', 'arizona': 'AZ', 'arkansas': 'AR', 'california': 'CA', 'colorado': 'CO',
+    'connecticut': 'CT', 'delaware': 'DE', 'district of columbia': 'DC', 'florida': 'FL', 'georgia': 'GA',
+    'hawaii': 'HI', 'idaho': 'ID', 'illinois': 'IL', 'indiana': 'IN', 'iowa': 'IA', 'kansas': 'KS', 'kentucky': 'KY',
+    'louisiana': 'LA', 'maine': 'ME', 'maryland': 'MD', 'massachusetts': 'MA', 'michigan': 'MI', 'minnesota': 'MN',
+    'mississippi': 'MS', 'missouri': 'MO', 'montana': 'MT', 'nebraska': 'NE', 'nevada': 'NV', 'new hampshire': 'NH',
+    'new jersey': 'NJ', 'new mexico': 'NM', 'new york': 'NY', 'north carolina': 'NC', 'north dakota': 'ND',
+    'ohio': 'OH', 'oklahoma': 'OK', 'oregon': 'OR', 'pennsylvania': 'PA', 'puerto rico': 'PR', 'rhode island': 'RI',
+    'south carolina': 'SC', 'south dakota': 'SD', 'tennessee': 'TN', 'texas': 'TX', 'utah': 'UT', 'vermont': 'VT',
+    'virginia': 'VA', 'washington': 'WA', 'west virginia': 'WV', 'wisconsin': 'WI', 'wyoming': 'WY',
+}
+# suffixes Census place names carry ("Denver city", "Aurora CDP") that nobody uses in a query
+PLACE_SUFFIX_PATTERN = re.compile(r'\s+(city|town|village|borough|cdp|municipality|city and borough|consolidated government.*|unified government.*|metro government.*|\(balance\))$')
+COUNTRY_SUFFIX_PATTERN = re.compile(r',\s*(usa|us|united states|united states of america)$')
+CENSUS_GAZETTEER_YEAR = 2023
+CENSUS_GAZETTEER_URL = 'https://www2.census.gov/geo/docs/maps-data/data/gazetteer/{year}_Gazetteer/{year}_Gaz_{file_kind}_national.zip'
+
+
+def haversine_miles(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in miles. Arguments broadcast, so one point can be measured against many at once."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
+
+
+def to_unit_vectors(lats, lons) -> np.ndarray:
+    """Points on the unit sphere - straight-line (chord) distance between them orders the same as great-circle
+    distance, so they can go in a KD-tree."""
+    lats, lons = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lons, dtype=np.float64))
+    return np.stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)], axis=-1)
+
+
+def normalize_name(name: str) -> str:
+    name = PLACE_SUFFIX_PATTERN.sub('', name.casefold().strip())
+    name = re.sub(r'\b(saint|st)\.?\s+', 'st. ', name)
+    return re.sub(r'\s+', ' ', name)
+
+
+def parse_query(query: str) -> Optional[tuple[str, str]]:
+    """Split a query like "Adams County, CO", "Denver, Colorado, USA" into (normalized name, state abbreviation)."""
+    query = COUNTRY_SUFFIX_PATTERN.sub('', query.casefold().strip().rstrip('.'))
+    parts = [part.strip() for part in query.split(',')]
+    if len(parts) != 2:
+        return None
+    name, state = parts
+    state = STATE_ABBREVIATIONS.get(state, state.upper())
+    if state not in STATE_ABBREVIATIONS.values():
+        return None
+    return normalize_name(name), state
+
+
+class Gazetteer:
+    """US county and place centroids behind a KD-tree, for answering "where is X" and "what's near here" locally.
+
+    Each entry has a `kind` ('county' or 'place'), display name, state (USPS abbreviation) and internal point."""
+    def __init__(self, kinds: Iterable[str], names: Iterable[str], states: Iterable[str], lats: Iterable[float], lons: Iterable[float]):
+        self.kinds = np.asarray(list(kinds))
+        self.names = np.asarray(list(names))
+        self.states = np.asarray(list(states))
+        self.lats = np.asarray(list(lats), dtype=np.float64)
+        self.lons = np.asarray(list(lons), dtype=np.float64)
+        self.tree = cKDTree(to_unit_vectors(self.lats, self.lons))
+        self._kind_trees = {}  # kind -> (KD-tree, entry indices)
+        self._name_index = {}  # (normalized name, state) -> entry indices
+        for ind, (name, state) in enumerate(zip(self.names, self.states)):
+            self._name_index.setdefault((normalize_name(name), state), []).append(ind)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def get_entry(self, ind: int) -> dict:
+        return {
+            'kind': str(self.kinds[ind]),
+            'name': str(self.names[ind]),
+            'state': str(self.states[ind]),
+            'latitude': float(self.lats[ind]),
+            'longitude': float(self.lons[ind]),
+        }
+
+    def lookup(self, query: str) -> Optional[dict]:
+        """Find the entry a query like "Adams County, CO" names, or None if it's not exactly one entry (counties win
+        over places of the same name)."""
+        parsed = parse_query(query)
+        if parsed is None:
+            return None
+        indices = self._name_index.get(parsed, [])
+        if len(indices) > 1:
+            indices = [ind for ind in indices if self.kinds[ind] == 'county'] or indices
+        if len(indices) != 1:
+            return None
+        return self.get_entry(indices[0])
+
+    def _get_tree(self, kind: Optional[str]) -> tuple[cKDTree, np.ndarray]:
+        if kind is None:
+            return self.tree, np.arange(len(self))
+        if kind not in self._kind_trees:
+            indices = np.flatnonzero(self.kinds == kind)
+            self._kind_trees[kind] = (cKDTree(to_unit_vectors(self.lats[indices], self.lons[indices])), indices)
+        return self._kind_trees[kind]
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1, kind: Optional[str] = None) -> list[dict]:
+        """The k entries (optionally only of one kind) nearest a point, nearest first, with their distance in miles."""
+        tree, indices = self._get_tree(kind)
+        k = min(k, len(indices))
+        if k == 0:
+            return []
+        _, tree_indices = tree.query(to_unit_vectors(latitude, longitude), k=k)
+        entry_indices = indices[np.atleast_1d(tree_indices)]
+        distances = haversine_miles(latitude, longitude, self.lats[entry_indices], self.lons[entry_indices])
+        return [
+            {**self.get_entry(ind), 'distance_miles': float(distance)}
+            for ind, distance in zip(entry_indices, distances)
+        ]
+
+
+def read_census_gazetteer(path: str, kind: str) -> list[tuple[str, str, str, float, float]]:
+    """Read a Census Bureau Gazetteer file (e.g. 2023_Gaz_counties_national.txt, 2023_Gaz_place_national.txt - plain or
+    zipped) into (kind, name, state, lat, lon) rows."""
+    path = Path(path)
+    if path.suffix == '.zip':
+        with zipfile.ZipFile(path) as zf:
+            text = zf.read(zf.namelist()[0]).decode('latin-1')
+    else:
+        text = path.read_text(encoding='latin-1')
+    reader = csv.DictReader(io.StringIO(text), delimiter='\t')
+    reader.fieldnames = [field.strip() for field in reader.fieldnames]
+    return [
+        (kind, row['NAME'].strip(), row['USPS'].strip(), float(row['INTPTLAT']), float(row['INTPTLONG']))
+        for row in reader
+    ]
+
+
+def write_gazetteer(rows: list[tuple[str, str, str, float, float]], output_path: str):
+    with gzip.open(output_path, 'wt', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['kind', 'name', 'state', 'latitude', 'longitude'])
+        writer.writerows(rows)
+
+
+def download_census_gazetteer(file_kind: str, output_dir: str, year: int = CENSUS_GAZETTEER_YEAR) -> str:
+    """Download a national Census Bureau Gazetteer file ('counties' or 'place'), returning its path."""
+    url = CENSUS_GAZETTEER_URL.format(year=year, file_kind=file_kind)
+    output_path = Path(output_dir) / url.rsplit('/', 1)[-1]
+    print(f'Downloading {url}')
+    with urllib.request.urlopen(url, timeout=60) as response:
+        output_path.write_bytes(response.read())
+    return str(output_path)
+
+
+def build_gazetteer(output_path: str, counties_path: Optional[str] = None, places_path: Optional[str] = None, year: int = CENSUS_GAZETTEER_YEAR) -> int:
+    """Build the gazetteer file from Census Bureau Gazetteer files, downloading any that aren't given. Returns the
+    number of entries written."""
+    with tempfile.TemporaryDirectory() as download_dir:
+        if counties_path is None:
+            counties_path = download_census_gazetteer('counties', download_dir, year=year)
+        if places_path is None:
+            places_path = download_census_gazetteer('place', download_dir, year=year)
+        gazetteer_rows = read_census_gazetteer(counties_path, 'county') + read_census_gazetteer(places_path, 'place')
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    write_gazetteer(gazetteer_rows, output_path)
+    return len(gazetteer_rows)
+
+
+def load_gazetteer(path: str) -> Gazetteer:
+    """Load a gazetteer written by `write_gazetteer` (a gzipped TSV of kind, name, state, latitude, longitude)."""
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f, delimiter='\t'))
+    return Gazetteer(
+        kinds=[row['kind'] for row in rows],
+        names=[row['name'] for row in rows],
+        states=[row['state'] for row in rows],
+        lats=[float(row['latitude']) for row in rows],
+        lons=[float(row['longitude']) for row in rows],
+    )
+
+
+_gazetteers: dict[Path, Gazetteer] = {}
+_gazetteers_lock = threading.Lock()
+
+
+_missing_gazetteers: set[Path] = set()  # paths already warned about, so it happens once
+
+
+def get_gazetteer(path: Optional[str]) -> Optional[Gazetteer]:
+    """Get the (process-wide) gazetteer at `path`. If there isn't one there, a warning is printed (once) and None
+    returned, so location lookups fall back to Google. It's never built here - building downloads the Census Bureau
+    files, which belongs in a deploy step (`python -m GlobalUtils.gazetteer`), not in app startup."""
+    if path is None:
+        return None
+    resolved_path = Path(path).resolve()
+    with _gazetteers_lock:
+        if resolved_path in _gazetteers:
+            return _gazetteers[resolved_path]
+        if resolved_path in _missing_gazetteers:
+            return None
+        if not resolved_path.exists():
+            print(f'WARNING: no gazetteer at {path} - county/place lookups will all go to Google. Build it with `python -m GlobalUtils.gazetteer --output {path}` and commit it.')
+            _missing_gazetteers.add(resolved_path)
+            return None
+        _gazetteers[resolved_path] = load_gazetteer(str(resolved_path))
+        return _gazetteers[resolved_path]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the bundled gazetteer from Census Bureau Gazetteer files.')
+    parser.add_argument('--counties', help='e.g. 2023_Gaz_counties_national.zip - downloaded if not given')
+    parser.add_argument('--places', help='e.g. 2023_Gaz_place_national.zip - downloaded if not given')
+    parser.add_argument('--year', type=int, default=CENSUS_GAZETTEER_YEAR, help='year of the Gazetteer files to download')
+    parser.add_argument('--output', default='assets/us_gazetteer.tsv.gz')
+    args = parser.parse_args()
+    n_entries = build_gazetteer(args.output, counties_path=args.counties, places_path=args.places, year=args.year)
+    print(f'Wrote {n_entries} entries to {args.output}')
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import googlemaps
+
+from GlobalUtils.gazetteer import Gazetteer
+from GlobalUtils.rate_limiting import get_rate_limiter
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a geocoding query so trivially different spellings share a cache entry, e.g.
+    " Adams county,CO. " -> "adams county, co"."""
+    query = query.casefold().strip().rstrip('.')
+    query = re.sub(r'\s*,\s*', ', ', query)
+    return re.sub(r'\s+', ' ', query)
+
+
+class Geocoder:
+    """Interface for geocoding services: `geocode` returns a list of Google Geocoding API-style results."""
+    async def geocode(self, query: str) -> list[dict]:
+        raise NotImplementedError
+
+
+class GoogleGeocoder(Geocoder):
+    """Google Maps geocoding. The googlemaps client is synchronous, so calls run on a small dedicated thread pool (never
+    on the event loop), paced by the shared 'google' rate limiter."""
+    def __init__(self, api_key: str, max_workers: int = 8):
+        self.client = googlemaps.Client(key=api_key)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='geocode')
+        self.limiter = get_rate_limiter('google')
+
+    async def geocode(self, query: str) -> list[dict]:
+        await self.limiter.acquire()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.client.geocode, query)
+
+
+class OfflineGeocoder(Geocoder):
+    """Local stand-in for a geocoding service, for exercising the location stage without network access.
+
+    Answers from a fixed table of normalized query -> results, e.g. built from a JSON file of recorded responses or
+    replayed from a GeocodeCache. Unknown queries return no results, like a geocoder that found nothing."""
+    def __init__(self, results: dict[str, list[dict]]):
+        self.results = {normalize_query(query): query_results for query, query_results in results.items()}
+
+    @classmethod
+    def from_json(cls, json_path: str) -> 'OfflineGeocoder':
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_cache(cls, cache: 'GeocodeCache') -> 'OfflineGeocoder':
+        return cls(cache.get_all())
+
+    async def geocode(self, query: str) -> list[dict]:
+        return self.results.get(normalize_query(query), [])
+
+
+class GazetteerGeocoder(Geocoder):
+    """Answers queries naming a US county or place ("Adams County, CO") from the bundled gazetteer, passing anything
+    else on to `fallback`."""
+    def __init__(self, gazetteer: Gazetteer, fallback: Geocoder):
+        self.gazetteer = gazetteer
+        self.fallback = fallback
+
+    async def geocode(self, query: str) -> list[dict]:
+        entry = self.gazetteer.lookup(query)
+        if entry is None:
+            return await self.fallback.geocode(query)
+        return [{
+            'formatted_address': f"{entry['name']}, {entry['state']}, USA",
+            'geometry': {'location': {'lat': entry['latitude'], 'lng': entry['longitude']}, 'location_type': 'APPROXIMATE'},
+            'types': ['administrative_area_level_2' if entry['kind'] == 'county' else 'locality', 'political'],
+        }]
+
+
+class GeocodeCache:
+    """SQLite-backed cache of geocoding results, keyed by normalized query. Entries older than `ttl` seconds are
+    treated as missing (and refreshed on the next lookup)."""
+    def __init__(self, db_path: str, ttl: float = 90 * 24 * 3600.):
+        self.db_path = Path(db_path)
+        self.ttl = ttl
+        self._local = threading.local()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS geocodes ('
+                'query TEXT PRIMARY KEY, results TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection to the database."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, query: str) -> Optional[list[dict]]:
+        row = self._connect().execute(
+            'SELECT results, created_at FROM geocodes WHERE query = ?', (normalize_query(query),)
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def put(self, query: str, results: list[dict]):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO geocodes (query, results, created_at) VALUES (?, ?, ?)',
+                (normalize_query(query), json.dumps(results), time.time())
+            )
+
+    def get_all(self) -> dict[str, list[dict]]:
+        """Every cached result, regardless of age."""
+        rows = self._connect().execute('SELECT query, results FROM geocodes').fetchall()
+        return {query: json.loads(results) for query, results in rows}
+
+
+class CachedGeocoder(Geocoder):
+    """Wraps a geocoder with a GeocodeCache. Concurrent lookups of the same (normalized) query share one request."""
+    def __init__(self, geocoder: Geocoder, cache: GeocodeCache):
+        self.geocoder = geocoder
+        self.cache = cache
+        self._in_flight = weakref.WeakKeyDictionary()  # event loop -> {normalized query: asyncio.Task}
+
+    async def _geocode(self, query: str) -> list[dict]:
+        results = await asyncio.to_thread(self.cache.get, query)
+        if results is None:
+            results = await self.geocoder.geocode(query)
+            await asyncio.to_thread(self.cache.put, query, results)
+        return results
+
+    async def geocode(self, query: str) -> list[dict]:
+        in_flight = self._in_flight.setdefault(asyncio.get_running_loop(), {})
+        key = normalize_query(query)
+        task = in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._geocode(query))
+            in_flight[key] = task
+            task.add_done_callback(lambda done_task: in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+
+_geocoders: dict[tuple, Geocoder] = {}
+_geocoders_lock = threading.Lock()
+
+
+def get_geocoder(
+        google_api_key: Optional[str] = None,
+        cache_path: Optional[str] = None,
+        ttl: float = 90 * 24 * 3600.,
+        offline: bool = False,
+        offline_results_path: Optional[str] = None,
+        gazetteer: Optional[Gazetteer] = None
+) -> Geocoder:
+    """Get the (process-wide) geocoder: Google geocoding behind a persistent cache at `cache_path` (if given), with
+    counties and places answered from `gazetteer` (if given) first.
+
+    With `offline` set, nothing is sent to Google - queries are answered from `offline_results_path` (a JSON file of
+    query -> results) if given, otherwise by replaying the cache."""
+    key = (google_api_key, cache_path, ttl, offline, offline_results_path, id(gazetteer))
+    with _geocoders_lock:
+        if key not in _geocoders:
+            cache = GeocodeCache(cache_path, ttl=ttl) if cache_path is not None else None
+            if offline:
+                if offline_results_path is not None:
+                    geocoder = OfflineGeocoder.from_json(offline_results_path)
+                else:
+                    geocoder = OfflineGeocoder.from_cache(cache) if cache is not None else OfflineGeocoder({})
+            else:
+                geocoder = GoogleGeocoder(google_api_key)
+                if cache is not None:
+                    geocoder = CachedGeocoder(geocoder, cache)
+            if gazetteer is not None:
+                geocoder = GazetteerGeocoder(gazetteer, geocoder)
+            _geocoders[key] = geocoder
+        return _geocoders[key]
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Callable, Coroutine, Optional
+
+from GlobalUtils.clients import get_event_loop
+
+
+class Job:
+    """A coroutine running in the background, with a callable reporting its progress."""
+    def __init__(self, job_id: str, name: str, future: Future, progress: Optional[Callable[[], Any]], metadata: dict):
+        self.job_id = job_id
+        self.name = name
+        self.future = future
+        self._progress = progress
+        self.metadata = metadata
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def status(self) -> str:
+        """'running', 'done', 'failed' or 'cancelled'."""
+        if not self.future.done():
+            return 'running'
+        if self.future.cancelled():
+            return 'cancelled'
+        return 'failed' if self.future.exception() is not None else 'done'
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    def progress(self) -> Any:
+        return self._progress() if self._progress is not None else None
+
+    def result(self) -> Any:
+        """The coroutine's result - raises its exception if it failed."""
+        return self.future.result()
+
+
+class JobRunner:
+    """Runs coroutines on the background event loop (see GlobalUtils.clients) without blocking the caller, e.g. a
+    Streamlit script thread, which polls them by job ID instead.
+
+    Finished jobs are kept until popped, or for `finished_job_ttl` seconds - long enough for a session that went away
+    not to leak its results forever."""
+    def __init__(self, finished_job_ttl: float = 3600.):
+        self.finished_job_ttl = finished_job_ttl
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+            self,
+            coroutine: Coroutine,
+            name: str = '',
+            progress: Optional[Callable[[], Any]] = None,
+            metadata: Optional[dict] = None
+    ) -> str:
+        """Start a coroutine in the background, returning its job ID."""
+        self.prune()
+        job_id = uuid.uuid4().hex
+        future = asyncio.run_coroutine_threadsafe(coroutine, get_event_loop())
+        job = Job(job_id, name, future, progress, metadata or {})
+
+        def on_done(done_future: Future):
+            job.finished_at = time.time()
+            print(f'Job {name or job_id} {job.status} after {job.elapsed:.1f}s')
+
+        future.add_done_callback(on_done)
+        with self._lock:
+            self._jobs[job_id] = job
+        print(f'Started job {name or job_id}')
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pop(self, job_id: str) -> Optional[Job]:
+        """Remove a job, e.g. once its result has been collected."""
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        return job is not None and job.future.cancel()
+
+    def get_running_jobs(self) -> list[Job]:
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.done]
+
+    def prune(self):
+        """Drop finished jobs older than finished_job_ttl."""
+        now = time.time()
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.finished_at is not None and now - job.finished_at > self.finished_job_ttl:
+                    del self._jobs[job_id]
+
+
+_job_runner: Optional[JobRunner] = None
+_job_runner_lock = threading.Lock()
+
+
+def get_job_runner() -> JobRunner:
+    """Get the process-wide job runner, shared by every session."""
+    global _job_runner
+    with _job_runner_lock:
+        if _job_runner is None:
+            _job_runner = JobRunner()
+        return _job_runner
@@ -0,0 +1,129 @@
+from functools import lru_cache
+from typing import Optional
+
+import fitz
+from PIL import Image
+
+PAGE_WIDTH = 612.  # US letter, like fitz's default new_page
+TEXT_LEFT = 50.
+TEXT_WIDTH = 500.
+
+
+class LineLayout:
+    """Single-pass layout of text lines for highlight rendering.
+
+    Each line is word-wrapped to `text_width` once, using the font's measured glyph widths, so every line's height and
+    position is known up front - rendering never has to retry a text box or re-typeset a taller page. `render` can
+    draw just a window of lines around the highlighted ones."""
+    def __init__(
+            self,
+            text: str,
+            fontname: str = 'helv',
+            fontsize: float = 8.,
+            line_height: float = 16.,
+            row_height: Optional[float] = None,
+            text_width: float = TEXT_WIDTH
+    ):
+        self.fontname = fontname
+        self.fontsize = fontsize
+        self.line_height = line_height
+        self.row_height = row_height if row_height is not None else fontsize * 1.25  # spacing of wrapped rows
+        self.text_width = text_width
+        self._font = fitz.Font(fontname)
+        self._char_widths = {}  # char -> width at fontsize
+        self.lines = text.splitlines()
+        self.rows = [self.wrap(line) for line in self.lines]  # line index -> wrapped rows
+        self.tops = []  # line index -> y of the top of the line
+        y = 0.
+        for rows in self.rows:
+            self.tops.append(y)
+            y += self.line_height + (len(rows) - 1) * self.row_height
+        self.height = y
+
+    def measure(self, text: str) -> float:
+        """Width of a text, summed from memoized glyph widths - much cheaper than measuring each string with fitz."""
+        unseen = ''.join({char for char in text if char not in self._char_widths})
+        if unseen:
+            self._char_widths.update(zip(unseen, self._font.char_lengths(unseen, self.fontsize)))
+        return sum(self._char_widths[char] for char in text)
+
+    def wrap(self, line: str) -> list[str]:
+        """Split a line into rows that fit `text_width`, breaking between words (or inside words too long for a row).
+
+        Each word is measured once and row widths are summed as words are added, so wrapping is linear in the line's
+        length - the base-14 fonts have no kerning, so a row's width is the sum of its words' and spaces' widths."""
+        if self.measure(line) <= self.text_width:
+            return [line]
+        space_width = self.measure(' ')
+        rows = []
+        row, row_width = '', 0.
+        for word in line.split(' '):
+            word_width = self.measure(word)
+            candidate_width = row_width + space_width + word_width if row else word_width
+            if candidate_width <= self.text_width:
+                row = f'{row} {word}' if row else word
+                row_width = candidate_width
+                continue
+            if row:
+                rows.append(row)
+            if word_width > self.text_width:  # hard-break an over-long word
+                start, word_width = 0, 0.
+                for char_ind, char in enumerate(word):
+                    char_width = self._char_widths[char]
+                    if char_ind > start and word_width + char_width > self.text_width:
+                        rows.append(word[start:char_ind])
+                        start, word_width = char_ind, 0.
+                    word_width += char_width
+                word = word[start:]
+            row, row_width = word, word_width
+        rows.append(row)
+        return rows
+
+    def get_line_bottom(self, line_ind: int) -> float:
+        return self.tops[line_ind + 1] if line_ind + 1 < len(self.tops) else self.height
+
+    def render(
+            self,
+            highlight_lines: list[int],
+            window_lines: Optional[int] = None,
+            highlight_color: tuple = (1, 1, 0),
+            highlight_opacity: float = 0.3,
+            zoom: float = 2.0,
+            margin: float = 20.
+    ) -> Image.Image:
+        """Rasterize the laid-out lines with `highlight_lines` highlighted. With `window_lines`, only that many lines of
+        context above the first and below the last highlighted line are drawn."""
+        first_line, last_line = 0, len(self.lines) - 1
+        if window_lines is not None and highlight_lines:
+            first_line = max(0, min(highlight_lines) - window_lines)
+            last_line = min(len(self.lines) - 1, max(highlight_lines) + window_lines)
+        if last_line < first_line:  # no text
+            top, bottom = 0., self.line_height
+        else:
+            top, bottom = self.tops[first_line], self.get_line_bottom(last_line)
+
+        doc = fitz.open()
+        page = doc.new_page(width=PAGE_WIDTH, height=bottom - top + margin)
+        highlight_set = set(highlight_lines)
+        for line_ind in range(first_line, last_line + 1):
+            line_top = self.tops[line_ind] - top
+            if line_ind in highlight_set:
+                page.draw_rect(
+                    fitz.Rect(0, line_top, PAGE_WIDTH, self.get_line_bottom(line_ind) - top),
+                    color=None,
+                    fill=highlight_color,
+                    fill_opacity=highlight_opacity
+                )
+            for row_ind, row in enumerate(self.rows[line_ind]):
+                baseline = line_top + 2 + self.fontsize + row_ind * self.row_height
+                page.insert_text((TEXT_LEFT, baseline), row, fontname=self.fontname, fontsize=self.fontsize)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        img = Image.frombytes('RGB', [pix.width, pix.height], pix.samples)
+        doc.close()
+        return img
+
+
+@lru_cache(maxsize=64)
+def get_line_layout(text: str, fontsize: float = 8., line_height: float = 16.) -> LineLayout:
+    """Get the (memoized) layout of a text - e.g. a WD page, laid out once however many of its lines are cited."""
+    return LineLayout(text, fontsize=fontsize, line_height=line_height)
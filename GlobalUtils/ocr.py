@@ -7,6 +7,13 @@ import time
 import httpx
 import asyncio
 import tomli
+from pathlib import Path
+from typing import Optional
+
+from GlobalUtils.document import Document
+from GlobalUtils.ocr_cache import OCRResultStore
+from GlobalUtils.openai_uploading import sha256
+from GlobalUtils.whisper_client import get_whisper_client
 
 
 def derotated_load_pdf(pdf_path):
@@ -245,76 +252,87 @@ def whisper_pdf_text_extraction(
 async def async_whisper_pdf_text_extraction(
         unstract_api_key: str,
         input_pdf_path: str,
-        retry_wait_step=1.,
-        max_retry_time=30.,
-        wait_step=1.,
-        max_wait_time=30.,
         return_json=False,
-        add_line_nos = False
+        add_line_nos = False,
+        mode: Optional[str] = None,
+        pdf_data: Optional[bytes] = None,
+        page_count: Optional[int] = None,
+        timeout: Optional[float] = None,
+        client: Optional[httpx.AsyncClient] = None
 ):
-    creation_start_time = time.time()
-
-    with open(input_pdf_path, 'rb') as pdf_file:
-        pdf_data = pdf_file.read()
-
-    BASE_URL = 'https://llmwhisperer-api.us-central.unstract.com/api/v2'
-    auth_headers = {'unstract-key': unstract_api_key}
-    create_params = {}
-    if add_line_nos:
-        create_params['add_line_nos'] = True
-
-
-    async with httpx.AsyncClient() as client:
-        # Retry loop for job creation with rate limit handling
-        while time.time() - creation_start_time < max_retry_time:
-            create_job_response = await client.post(
-                f'{BASE_URL}/whisper',
-                headers=auth_headers,
-                params=create_params,
-                content=pdf_data
-            )
+    """Extract text from a PDF with LLMWhisperer.
+
+    The job is submitted to the shared AsyncWhisperClient for the running loop, so it's polled (with backoff) by the
+    same poller as every other in-flight job. Unless `timeout` is given, it scales with `page_count` (or the file size).
+    Requests go through the shared, pooled HTTP client unless `client` is given."""
+    if pdf_data is None:
+        with open(input_pdf_path, 'rb') as pdf_file:
+            pdf_data = pdf_file.read()
+
+    whisper_client = get_whisper_client(unstract_api_key, client=client)
+    result_json = await whisper_client.extract(
+        pdf_data,
+        add_line_nos=add_line_nos,
+        mode=mode,
+        page_count=page_count,
+        timeout=timeout
+    )
 
-            if create_job_response.status_code == 429:
-                print(f"Rate limited, retrying in {retry_wait_step} seconds...")
-                await asyncio.sleep(retry_wait_step)
-            else:
-                create_job_response.raise_for_status()
-                whisper_hash = create_job_response.json()['whisper_hash']
-                break
-        else:
-            raise TimeoutError(f"Could not create Whisper job within {max_retry_time} seconds due to rate limiting")
+    if return_json:
+        return result_json
 
-        # Status polling loop
-        status_start_time = time.time()
-        complete = False
+    return result_json['result_text']
 
-        while not complete:
-            status_response = await client.get(
-                f'{BASE_URL}/whisper-status',
-                headers=auth_headers,
-                params={'whisper_hash': whisper_hash}
-            )
 
-            if status_response.json()['status'] == 'error':
-                raise RuntimeError(f"Whisper job failed: {status_response.json()}")
-            elif status_response.json()['status'] == 'processed':
-                complete = True
-            elif time.time() - status_start_time > max_wait_time:
-                raise TimeoutError(f"Whisper job did not complete within {max_wait_time} seconds")
-            else:
-                await asyncio.sleep(wait_step)
-
-        # Retrieve results
-        result_response = await client.get(
-            f'{BASE_URL}/whisper-retrieve',
-            headers=auth_headers,
-            params={'whisper_hash': whisper_hash}
+async def cached_async_whisper_pdf_text_extraction(
+        unstract_api_key: str,
+        input_pdf_path: str,
+        result_store: Optional[OCRResultStore] = None,
+        document: Optional[Document] = None,
+        return_json=False,
+        add_line_nos = False,
+        mode: Optional[str] = None,
+        **kwargs
+):
+    """async_whisper_pdf_text_extraction, skipping the Unstract round trip if the same file has already been OCR'd
+    with the same options. Results are stored in `result_store` (if given), keyed by the file's SHA-256 digest.
+
+    If the file's shared `document` handle is given, its memoized digest and mapped bytes are used instead of reading
+    the file again."""
+    if result_store is None:
+        return await async_whisper_pdf_text_extraction(
+            unstract_api_key=unstract_api_key,
+            input_pdf_path=input_pdf_path,
+            return_json=return_json,
+            add_line_nos=add_line_nos,
+            mode=mode,
+            pdf_data=None if document is None else document.data.tobytes(),
+            page_count=None if document is None else await asyncio.to_thread(getattr, document, 'page_count'),
+            **kwargs
         )
-
-        if return_json:
-            return result_response.json()
-
-        return result_response.json()['result_text']
+    if document is not None:
+        digest = await asyncio.to_thread(document.get_digest)
+    else:
+        digest = await asyncio.to_thread(sha256, Path(input_pdf_path))
+    options = {'add_line_nos': bool(add_line_nos), 'mode': mode}
+    result_json = await asyncio.to_thread(result_store.get, digest, options)
+    if result_json is None:
+        result_json = await async_whisper_pdf_text_extraction(
+            unstract_api_key=unstract_api_key,
+            input_pdf_path=input_pdf_path,
+            return_json=True,
+            add_line_nos=add_line_nos,
+            mode=mode,
+            pdf_data=None if document is None else document.data.tobytes(),
+            page_count=None if document is None else await asyncio.to_thread(getattr, document, 'page_count'),
+            **kwargs
+        )
+        await asyncio.to_thread(result_store.put, digest, options, result_json)
+    else:
+        print(f'Using stored OCR result for {input_pdf_path}')
+    if return_json:
+        return result_json
+    return result_json['result_text']
 
 if __name__ == "__main__":
     pdf_path = r"C:\Users\jaeckle\PycharmProjects\DavisBaconApp\documents\coulson.pdf"
@@ -0,0 +1,35 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional
+
+from GlobalUtils.disk_store import DiskLRUStore
+
+OCR_CACHE_VERSION = 1
+
+
+class OCRResultStore:
+    """Content-addressed on-disk store of OCR results.
+
+    Results are keyed by the SHA-256 digest of the source file and the extraction options (e.g. add_line_nos, mode),
+    and stored as gzipped JSON, one file per result. Reads refresh a result's mtime, and once the store grows past
+    `max_bytes` the least recently used results are evicted."""
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._disk = DiskLRUStore(cache_dir, '.json.gz', max_bytes, label='OCR result')
+
+    @staticmethod
+    def get_key(digest: str, options: dict) -> str:
+        key_json = json.dumps({'version': OCR_CACHE_VERSION, 'digest': digest, 'options': options}, sort_keys=True)
+        return hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+
+    def get_path(self, digest: str, options: dict) -> Path:
+        return self._disk.get_path(self.get_key(digest, options))
+
+    def get(self, digest: str, options: dict) -> Optional[dict]:
+        """Get a stored result, or None if there isn't one."""
+        return self._disk.read_json(self.get_key(digest, options))
+
+    def put(self, digest: str, options: dict, result: dict):
+        self._disk.write_json(self.get_key(digest, options), result)
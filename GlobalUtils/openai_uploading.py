@@ -1,8 +1,18 @@
 from pathlib import Path
+from collections import OrderedDict
+from typing import Optional
+import asyncio
 import hashlib
 import json
+import sqlite3
+import threading
+import time
+import weakref
+import openai
 from openai import AsyncOpenAI
 
+from GlobalUtils.rate_limiting import get_rate_limiter
+
 def sha256(path: Path) -> str:
     h = hashlib.sha256()
     with path.open("rb") as f:
@@ -16,28 +26,208 @@ def load_cache(cache_path) -> dict:
         return json.loads(cache_path.read_text())
     return {}
 
-def save_cache(cache_path: Path, cache: dict):
-    cache_path.write_text(json.dumps(cache))
 
-async def get_or_upload_async(file_path: str, client: AsyncOpenAI, cache_path: str, purpose = "user_data") -> str:
-    cache_path = Path(cache_path)
-    file_path = Path(file_path)
-    cache = load_cache(cache_path)
-    digest = sha256(file_path)
+class OpenAIFileCache:
+    """SQLite-backed cache of OpenAI file IDs, keyed by (file SHA-256 digest, purpose).
+
+    The database runs in WAL mode, so concurrent checkers (threads or processes) can read while one writes, and
+    entries are added with an atomic INSERT OR IGNORE - if two callers upload the same file at once, both end up
+    using whichever ID was stored first. An in-process LRU sits in front of the database.
+
+    Cached IDs are validated lazily: at most once per `validate_after` seconds, the ID is checked with
+    `files.retrieve` before use, and the file is re-uploaded if it's been deleted, failed processing, or expires before
+    the next check would be due."""
+    def __init__(self, db_path: str, lru_size: int = 1024, validate_after: float = 3600.):
+        self.db_path = Path(db_path)
+        self.lru_size = lru_size
+        self.validate_after = validate_after
+        self._lru = OrderedDict()  # (digest, purpose) -> (file_id, validated_at)
+        self._lru_lock = threading.Lock()
+        self._local = threading.local()
+        self._upload_locks = weakref.WeakKeyDictionary()  # event loop -> {(digest, purpose): [asyncio.Lock, users]}
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'digest TEXT NOT NULL, purpose TEXT NOT NULL, file_id TEXT NOT NULL, '
+                'created_at REAL NOT NULL, validated_at REAL NOT NULL, '
+                'PRIMARY KEY (digest, purpose))'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS imports ('
+                'path TEXT PRIMARY KEY, digest TEXT NOT NULL, imported_at REAL NOT NULL)'
+            )
+        self.migrate_json(self.db_path.with_suffix('.json'))
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection to the database."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def migrate_json(self, json_path: Path, purpose: str = 'user_data'):
+        """Import a legacy JSON cache (digest -> file ID). The JSON file is left in place (it's tracked in git); a
+        marker row records which version of it was imported, so it's only imported again if it changes."""
+        if not json_path.exists():
+            return
+        json_digest = sha256(json_path)
+        conn = self._connect()
+        row = conn.execute('SELECT digest FROM imports WHERE path = ?', (str(json_path.resolve()),)).fetchone()
+        if row is not None and row[0] == json_digest:
+            return
+        legacy_cache = load_cache(json_path)
+        now = time.time()
+        with conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO files (digest, purpose, file_id, created_at, validated_at) VALUES (?, ?, ?, ?, 0)',
+                [(digest, purpose, file_id, now) for digest, file_id in legacy_cache.items()]
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO imports (path, digest, imported_at) VALUES (?, ?, ?)',
+                (str(json_path.resolve()), json_digest, now)
+            )
+        print(f'Imported {len(legacy_cache)} cached file IDs from {json_path}')
+
+    def _lru_get(self, key: tuple[str, str]) -> Optional[tuple[str, float]]:
+        with self._lru_lock:
+            if key not in self._lru:
+                return None
+            self._lru.move_to_end(key)
+            return self._lru[key]
+
+    def _lru_put(self, key: tuple[str, str], file_id: str, validated_at: float):
+        with self._lru_lock:
+            self._lru[key] = (file_id, validated_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _lru_discard(self, key: tuple[str, str]):
+        with self._lru_lock:
+            self._lru.pop(key, None)
+
+    def get(self, digest: str, purpose: str) -> Optional[tuple[str, float]]:
+        """Get the cached (file ID, last validated time) for a file, or None."""
+        key = (digest, purpose)
+        entry = self._lru_get(key)
+        if entry is None:
+            row = self._connect().execute(
+                'SELECT file_id, validated_at FROM files WHERE digest = ? AND purpose = ?', key
+            ).fetchone()
+            if row is None:
+                return None
+            entry = (row[0], row[1])
+            self._lru_put(key, *entry)
+        return entry
 
-    # 1. Cache hit ➜ just return the ID
-    if digest in cache:
-        return cache[digest]
+    def insert(self, digest: str, purpose: str, file_id: str) -> str:
+        """Store a file ID, unless another caller already stored one for the file. Returns the stored ID."""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO files (digest, purpose, file_id, created_at, validated_at) VALUES (?, ?, ?, ?, ?)',
+                (digest, purpose, file_id, now, now)
+            )
+            row = conn.execute('SELECT file_id, validated_at FROM files WHERE digest = ? AND purpose = ?', (digest, purpose)).fetchone()
+        self._lru_put((digest, purpose), row[0], row[1])
+        return row[0]
 
-    # 2. Cache miss ➜ upload once
-    with open(file_path, "rb") as f:
-        creation_resp = await client.files.create(file=f, purpose=purpose)
+    def mark_validated(self, digest: str, purpose: str, file_id: str):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute('UPDATE files SET validated_at = ? WHERE digest = ? AND purpose = ? AND file_id = ?', (now, digest, purpose, file_id))
+        self._lru_put((digest, purpose), file_id, now)
+
+    def delete(self, digest: str, purpose: str, file_id: str):
+        """Forget a file ID (only if it's still the stored one)."""
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM files WHERE digest = ? AND purpose = ? AND file_id = ?', (digest, purpose, file_id))
+        self._lru_discard((digest, purpose))
+
+    def is_usable(self, file) -> bool:
+        """Whether a retrieved file can still be used until its next validation is due."""
+        if getattr(file, 'status', None) == 'error':
+            return False
+        expires_at = getattr(file, 'expires_at', None)
+        return expires_at is None or expires_at - time.time() > self.validate_after
+
+    async def get_or_upload(self, file_path: Path, client: AsyncOpenAI, purpose: str = 'user_data', digest: Optional[str] = None) -> str:
+        if digest is None:
+            digest = await asyncio.to_thread(sha256, file_path)
+        # one upload per file at a time in this process (asyncio locks are bound to a loop, so they're kept per loop,
+        # and dropped once nothing holds or waits on them)
+        loop_locks = self._upload_locks.setdefault(asyncio.get_running_loop(), {})
+        key = (digest, purpose)
+        lock_entry = loop_locks.setdefault(key, [asyncio.Lock(), 0])
+        lock_entry[1] += 1
+        try:
+            async with lock_entry[0]:
+                return await self._get_or_upload(file_path, client, purpose, digest)
+        finally:
+            lock_entry[1] -= 1
+            if lock_entry[1] == 0:
+                del loop_locks[key]
+
+    async def _get_or_upload(self, file_path: Path, client: AsyncOpenAI, purpose: str, digest: str) -> str:
+        limiter = get_rate_limiter('openai')
+        # 1. Cache hit ➜ return the ID, checking it's still usable if it hasn't been checked in a while
+        entry = await asyncio.to_thread(self.get, digest, purpose)
+        if entry is not None:
+            file_id, validated_at = entry
+            if time.time() - validated_at < self.validate_after:
+                return file_id
+            try:
+                file = await limiter.call(lambda: client.files.retrieve(file_id))
+            except openai.NotFoundError:
+                print(f'Cached file {file_id} for {file_path} no longer exists - re-uploading.')
+                await asyncio.to_thread(self.delete, digest, purpose, file_id)
+            else:
+                if self.is_usable(file):
+                    await asyncio.to_thread(self.mark_validated, digest, purpose, file_id)
+                    return file_id
+                print(f'Cached file {file_id} for {file_path} has expired or failed (status {file.status}, expires at {file.expires_at}) - re-uploading.')
+                await asyncio.to_thread(self.delete, digest, purpose, file_id)
+
+        # 2. Cache miss ➜ upload once
+        creation_resp = await limiter.call(lambda: client.files.create(file=file_path, purpose=purpose))
         file_id = creation_resp.id
 
-    # 3. Remember it for next time
-    cache[digest] = file_id
-    save_cache(cache_path, cache)
-    return file_id
+        # 3. Remember it for next time - if another process beat us to it, use its upload and drop ours
+        stored_file_id = await asyncio.to_thread(self.insert, digest, purpose, file_id)
+        if stored_file_id != file_id:
+            try:
+                await limiter.call(lambda: client.files.delete(file_id))
+            except openai.OpenAIError as e:
+                print(f'Could not delete duplicate upload {file_id}: {e}')
+        return stored_file_id
+
+
+_file_caches: dict[Path, OpenAIFileCache] = {}
+_file_caches_lock = threading.Lock()
+
+def get_file_cache(cache_path: str) -> OpenAIFileCache:
+    """Get the (process-wide) file ID cache for a path. A legacy '.json' cache path maps to a SQLite database alongside
+    it, and the JSON cache is imported into it."""
+    db_path = Path(cache_path)
+    if db_path.suffix == '.json':
+        db_path = db_path.with_suffix('.sqlite3')
+    db_path = db_path.resolve()
+    with _file_caches_lock:
+        if db_path not in _file_caches:
+            _file_caches[db_path] = OpenAIFileCache(db_path)
+        return _file_caches[db_path]
+
+async def get_or_upload_async(file_path: str, client: AsyncOpenAI, cache_path: str, purpose = "user_data", digest: Optional[str] = None) -> str:
+    return await get_file_cache(cache_path).get_or_upload(Path(file_path), client, purpose=purpose, digest=digest)
 
 # async def get_or_upload_stream_async(file_stream, client: AsyncOpenAI, cache_path: str, purpose = "user_data", file_type = 'application/pdf', file_name = 'document.pdf') -> str:
 #     if isinstance(file_stream, BytesIO):
@@ -60,4 +250,4 @@ async def get_or_upload_async(file_path: str, client: AsyncOpenAI, cache_path: s
 #     # 3. Remember it for next time
 #     cache[digest] = file_id
 #     save_cache(cache_path, cache)
-#     return file_id
\ No newline at end of file
+#     return file_id
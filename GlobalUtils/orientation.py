@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import fitz
+import pytesseract
+from PIL import Image
+
+from GlobalUtils.document import Document
+from GlobalUtils.ocr_cache import OCRResultStore
+
+# pages with at least this many characters of horizontal text in their own text layer are taken to be upright
+MIN_UPRIGHT_TEXT_CHARS = 200
+ORIENTATION_OPTIONS = {'kind': 'page_rotations', 'method': 'text_direction+osd', 'version': 2}  # OCRResultStore options for the map
+
+
+def detect_page_rotation(pdf_page: fitz.Page) -> int:
+    """Detect how far (in degrees) a page's content is rotated, via Tesseract OSD. Returns 0 if detection fails."""
+    try:
+        small_pix = pdf_page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))  # as displayed - get_pixmap applies /Rotate itself
+        small_img = Image.frombytes("RGB", [small_pix.width, small_pix.height], small_pix.samples)
+        osd = pytesseract.image_to_osd(small_img)
+        for line in osd.split('\n'):
+            if 'Rotate:' in line:
+                return int(line.split(':')[1].strip())
+    except (pytesseract.TesseractError, pytesseract.TesseractNotFoundError) as e:  # the latter can't be pickled back from a worker
+        print(f'Error during OSD rotation detection on page {pdf_page.number}: {e}')
+    return 0
+
+
+def _detect_pdf_page_rotation(pdf_path: str, page: int) -> int:
+    """Process pool worker - detect the rotation of one page of a PDF file."""
+    with fitz.open(pdf_path) as doc:
+        return detect_page_rotation(doc[page])
+
+
+def is_upright_digital_page(pdf_page: fitz.Page, min_chars: int = MIN_UPRIGHT_TEXT_CHARS) -> bool:
+    """Whether a page has a text layer that's mostly left-to-right horizontal (and no /Rotate), so it can't need
+    rotating."""
+    if pdf_page.rotation != 0:
+        return False
+    horizontal_chars = 0
+    other_chars = 0
+    for block in pdf_page.get_text('dict')['blocks']:
+        for line in block.get('lines', []):
+            n_chars = sum(len(span['text'].strip()) for span in line['spans'])
+            dir_x, dir_y = line['dir']
+            if dir_x > 0.99 and abs(dir_y) < 0.01:
+                horizontal_chars += n_chars
+            else:
+                other_chars += n_chars
+    return horizontal_chars >= min_chars and horizontal_chars >= 4 * other_chars
+
+
+_osd_pool: Optional[ProcessPoolExecutor] = None
+_osd_pool_workers = min(os.cpu_count() or 1, 4)
+_osd_pool_lock = threading.Lock()
+
+
+def get_osd_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """Get the process-wide OSD process pool, shared by every document being ingested so concurrent payrolls don't
+    each start their own. Passing `max_workers` (re)configures its size."""
+    global _osd_pool, _osd_pool_workers
+    with _osd_pool_lock:
+        if max_workers is not None and max_workers != _osd_pool_workers:
+            _osd_pool_workers = max_workers
+            if _osd_pool is not None:
+                _osd_pool.shutdown(wait=False)  # running jobs finish on the old pool
+                _osd_pool = None
+        if _osd_pool is None:
+            # spawned, not forked - the app has threads (event loop, thread pools) that fork would copy mid-flight
+            _osd_pool = ProcessPoolExecutor(max_workers=_osd_pool_workers, mp_context=multiprocessing.get_context('spawn'))
+        return _osd_pool
+
+
+def _discard_osd_pool(pool: ProcessPoolExecutor):
+    """Drop a broken pool, so the next caller gets a fresh one."""
+    global _osd_pool
+    with _osd_pool_lock:
+        if _osd_pool is pool:
+            _osd_pool = None
+    pool.shutdown(wait=False)
+
+
+def detect_page_rotations(document: Document) -> dict[int, int]:
+    """Get every page's content rotation (page index -> degrees). Upright digital pages are settled from their text
+    layer; the rest get Tesseract OSD, spread across the shared OSD process pool."""
+    start_time = time.perf_counter()
+    with document.lock:
+        doc = document.fitz_doc
+        rotations = {page: 0 for page in range(len(doc)) if is_upright_digital_page(doc[page])}
+        osd_pages = [page for page in range(len(doc)) if page not in rotations]
+    if len(osd_pages) == 1:
+        rotations[osd_pages[0]] = _detect_pdf_page_rotation(document.path, osd_pages[0])
+    elif osd_pages:
+        pool = get_osd_pool()
+        try:
+            for page, rotation in zip(osd_pages, pool.map(_detect_pdf_page_rotation, [document.path] * len(osd_pages), osd_pages)):
+                rotations[page] = rotation
+        except BrokenProcessPool:
+            _discard_osd_pool(pool)
+            raise
+    print(f'Detected page orientations for {document.path} in {time.perf_counter() - start_time:.2f}s ({len(osd_pages)} page(s) needed OSD)')
+    return dict(sorted(rotations.items()))
+
+
+def get_page_rotations(document: Document, result_store: Optional[OCRResultStore] = None) -> dict[int, int]:
+    """Get a document's page orientation map, computing it once and keeping it on the document (and in `result_store`,
+    alongside the document's OCR results, if given)."""
+    if document.page_rotations is not None:
+        return document.page_rotations
+    page_rotations = None
+    if result_store is not None:
+        stored = result_store.get(document.get_digest(), ORIENTATION_OPTIONS)
+        if stored is not None:
+            page_rotations = {int(page): rotation for page, rotation in stored['page_rotations'].items()}
+    if page_rotations is None:
+        page_rotations = detect_page_rotations(document)
+        if result_store is not None:
+            result_store.put(document.get_digest(), ORIENTATION_OPTIONS, {'page_rotations': {str(page): rotation for page, rotation in page_rotations.items()}})
+    with document.lock:
+        document.page_rotations = page_rotations
+    return page_rotations
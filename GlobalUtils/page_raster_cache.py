@@ -0,0 +1,108 @@
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional
+
+from PIL import Image
+
+from GlobalUtils.disk_store import DiskLRUStore
+
+PAGE_RASTER_CACHE_VERSION = 2
+
+
+class PageRasterCache:
+    """Two-level LRU cache of rendered (un-highlighted) page images, keyed by (document digest, page, zoom, rotation).
+
+    Rasters are kept in memory up to `max_memory_bytes`, and - if `cache_dir` is given - as PNGs on disk up to
+    `max_disk_bytes`, so a page is rasterized once however many citation dialogs show it. Cached images are shared:
+    callers must copy them before drawing on them."""
+    def __init__(self, cache_dir: Optional[str] = None, max_memory_bytes: int = 256 * 1024 * 1024, max_disk_bytes: int = 1024 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # key -> Image
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._disk = DiskLRUStore(cache_dir, '.png', max_disk_bytes, label='page raster') if cache_dir is not None else None
+
+    @staticmethod
+    def get_key(digest: str, page: int, zoom: float, rotation: int) -> tuple:
+        return digest, page, round(float(zoom), 4), rotation % 360
+
+    @staticmethod
+    def get_disk_key(key: tuple) -> str:
+        key_str = f'{PAGE_RASTER_CACHE_VERSION}|' + '|'.join(str(part) for part in key)
+        return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+    def _memory_get(self, key: tuple) -> Optional[Image.Image]:
+        with self._lock:
+            img = self._memory.get(key)
+            if img is not None:
+                self._memory.move_to_end(key)
+            return img
+
+    def _memory_put(self, key: tuple, img: Image.Image):
+        img_bytes = img.width * img.height * len(img.getbands())
+        if img_bytes > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = img
+            self._memory_bytes += img_bytes
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.width * evicted.height * len(evicted.getbands())
+
+    def _disk_get(self, key: tuple) -> Optional[Image.Image]:
+        if self._disk is None:
+            return None
+        data = self._disk.read(self.get_disk_key(key))
+        if data is None:
+            return None
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                img.load()
+        except OSError as e:
+            print(f'Ignoring unreadable page raster {self._disk.get_path(self.get_disk_key(key))}: {e}')
+            return None
+        return img
+
+    def _disk_put(self, key: tuple, img: Image.Image):
+        if self._disk is None:
+            return
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG', compress_level=1)  # fast - these are re-read far more often than written
+        self._disk.write(self.get_disk_key(key), buffer.getvalue())
+
+    def get_or_render(self, digest: str, page: int, zoom: float, rotation: int, render: Callable[[], Image.Image]) -> Image.Image:
+        """Get a page raster, rendering (and caching) it with `render` if it isn't cached."""
+        key = self.get_key(digest, page, zoom, rotation)
+        img = self._memory_get(key)
+        if img is not None:
+            return img
+        img = self._disk_get(key)
+        if img is None:
+            render_start = time.perf_counter()
+            img = render()
+            print(f'Rendered page {page} at zoom {zoom} in {time.perf_counter() - render_start:.2f}s')
+            self._disk_put(key, img)
+        self._memory_put(key, img)
+        return img
+
+
+_page_raster_caches: dict[Optional[Path], PageRasterCache] = {}
+_page_raster_caches_lock = threading.Lock()
+
+
+def get_page_raster_cache(cache_dir: Optional[str] = None, max_memory_bytes: int = 256 * 1024 * 1024, max_disk_bytes: int = 1024 * 1024 * 1024) -> PageRasterCache:
+    """Get the (process-wide) page raster cache for a directory (or the memory-only cache, if `cache_dir` is None).
+    The size limits apply when the cache is first created."""
+    key = Path(cache_dir).resolve() if cache_dir is not None else None
+    with _page_raster_caches_lock:
+        if key not in _page_raster_caches:
+            _page_raster_caches[key] = PageRasterCache(cache_dir, max_memory_bytes=max_memory_bytes, max_disk_bytes=max_disk_bytes)
+        return _page_raster_caches[key]
@@ -0,0 +1,246 @@
+import asyncio
+import contextlib
+import email.utils
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+import anthropic
+import httpx
+import openai
+from agents import Model, ModelProvider
+from agents.models import get_default_model
+from agents.models.openai_responses import OpenAIResponsesModel
+
+# requests per minute to pace each provider at, before any rate limit headers have been seen
+DEFAULT_REQUESTS_PER_MINUTE = {
+    'openai': 500.,
+    'anthropic': 50.,
+    'unstract': 60.,
+    'google': 600.,
+}
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+DURATION_PART_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')  # OpenAI reset durations, e.g. '6m0s', '20ms'
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Get the delay (in seconds) requested by `retry-after-ms`/`retry-after` headers, or None."""
+    if headers is None:
+        return None
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000.
+        except ValueError:
+            pass
+    retry_after = headers.get('retry-after')
+    if retry_after is None:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0., retry_date.timestamp() - time.time())
+
+
+def parse_reset(reset: str) -> Optional[float]:
+    """Parse a rate limit reset header - an RFC 3339 time (Anthropic), a duration like '6m0s' (OpenAI) or a number of
+    seconds - into seconds from now."""
+    reset = reset.strip()
+    try:
+        return float(reset)
+    except ValueError:
+        pass
+    parts = DURATION_PART_PATTERN.findall(reset)
+    if parts and ''.join(number + unit for number, unit in parts) == reset:
+        scale = {'ms': 0.001, 's': 1., 'm': 60., 'h': 3600.}
+        return sum(float(number) * scale[unit] for number, unit in parts)
+    try:
+        return max(0., datetime.fromisoformat(reset.replace('Z', '+00:00')).timestamp() - time.time())
+    except ValueError:
+        return None
+
+
+def get_rate_limit_wait(headers) -> Optional[float]:
+    """If the rate limit headers of a response say a limit is used up, get how long until it resets."""
+    if headers is None:
+        return None
+    waits = []
+    for name, value in headers.items():
+        name = name.lower()
+        if 'ratelimit' not in name or 'remaining' not in name:
+            continue
+        try:
+            remaining = float(value)
+        except ValueError:
+            continue
+        if remaining > 0:
+            continue
+        # e.g. anthropic-ratelimit-requests-remaining -> anthropic-ratelimit-requests-reset,
+        # x-ratelimit-remaining-tokens -> x-ratelimit-reset-tokens
+        reset = headers.get(name.replace('remaining', 'reset'))
+        wait = parse_reset(reset) if reset is not None else None
+        if wait is not None:
+            waits.append(wait)
+    return max(waits) if waits else None
+
+
+def get_error_retry_info(e: BaseException) -> tuple[bool, Optional[httpx.Headers]]:
+    """Get whether an API error is worth retrying, and the headers of the response that caused it (if any)."""
+    if isinstance(e, (anthropic.APIStatusError, openai.APIStatusError)):
+        return e.status_code in RETRYABLE_STATUS_CODES, e.response.headers
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code in RETRYABLE_STATUS_CODES, e.response.headers
+    if isinstance(e, (anthropic.APIConnectionError, openai.APIConnectionError, httpx.TransportError)):
+        return True, None
+    return False, None
+
+
+class RateLimiter:
+    """Shared rate limiter for one provider's API.
+
+    Requests are paced by a token bucket (`requests_per_minute`, with bursts of up to `burst` requests). When a
+    response's rate limit headers show a limit is used up, or a request is rate limited, every caller waits until the
+    reset/retry-after time - rather than each one sleeping on its own schedule. Retryable failures (429s, overloads,
+    5xxs, connection errors) are retried with exponential backoff and jitter."""
+    def __init__(
+            self,
+            name: str,
+            requests_per_minute: float,
+            burst: Optional[float] = None,
+            max_retries: int = 6,
+            base_delay: float = 1.,
+            max_delay: float = 60.
+    ):
+        self.name = name
+        self.rate = requests_per_minute / 60.
+        self.burst = burst if burst is not None else max(1., requests_per_minute / 6.)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()  # callers may be on different threads/loops
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.
+
+    def configure(self, requests_per_minute: float, burst: Optional[float] = None):
+        """Change the pacing. Safe while other callers are using the limiter - tokens accrued so far are kept, up to
+        the new burst."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = requests_per_minute / 60.
+            self.burst = burst if burst is not None else max(1., requests_per_minute / 6.)
+            self._tokens = min(self._tokens, self.burst)
+
+    def reserve(self) -> float:
+        """Take a token, returning how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1.
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.
+            return max(wait, self._blocked_until - now)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def block_for(self, seconds: float):
+        """Hold back every caller for `seconds`."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        wait = get_rate_limit_wait(headers)
+        if wait is not None and wait > 0:
+            print(f'{self.name} rate limit reached - pausing requests for {wait:.1f}s')
+            self.block_for(wait)
+
+    def get_backoff(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(delay / 2, delay)  # jitter, so waiting callers don't all retry at once
+
+    async def call(
+            self,
+            make_request: Callable[[], Awaitable],
+            get_headers: Optional[Callable] = None,
+            slot: Optional[asyncio.Semaphore] = None
+    ):
+        """Make a request (a fresh awaitable per attempt) under the limiter, retrying retryable failures.
+
+        `get_headers`, if given, gets the response headers from a successful result, so the limiter can pace ahead of
+        the provider's limits. `slot`, if given, is held only while each attempt is in flight - not while it waits on
+        the limiter or backs off - so throttled requests don't keep other work from running."""
+        for attempt in range(self.max_retries + 1):
+            await self.acquire()
+            try:
+                async with slot if slot is not None else contextlib.nullcontext():
+                    result = await make_request()
+            except Exception as e:
+                retryable, headers = get_error_retry_info(e)
+                if not retryable or attempt == self.max_retries:
+                    raise
+                retry_after = parse_retry_after(headers)
+                delay = retry_after if retry_after is not None else self.get_backoff(attempt)
+                if headers is not None and e.response.status_code == 429:
+                    self.block_for(delay)  # the whole provider is limited, not just this request
+                print(f'{self.name} request failed with {type(e).__name__} - retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})')
+                await asyncio.sleep(delay)
+                continue
+            if get_headers is not None:
+                self.update_from_headers(get_headers(result))
+            return result
+
+
+class RateLimitedResponsesModel(OpenAIResponsesModel):
+    """Agents SDK Responses model that sends each model request through a RateLimiter. A failed request is retried
+    on its own - the agent run's earlier turns and tool calls (e.g. geocoding) aren't repeated."""
+    def __init__(self, model: str, openai_client: openai.AsyncOpenAI, limiter: RateLimiter, slot: Optional[asyncio.Semaphore] = None):
+        super().__init__(model=model, openai_client=openai_client)
+        self.limiter = limiter
+        self.slot = slot
+
+    async def get_response(self, *args, **kwargs):
+        return await self.limiter.call(lambda: super(RateLimitedResponsesModel, self).get_response(*args, **kwargs), slot=self.slot)
+
+
+class RateLimitedModelProvider(ModelProvider):
+    """Model provider for `RunConfig(model_provider=...)`, whose models pace and retry requests with `limiter` (holding
+    `slot`, if given, while each request is in flight)."""
+    def __init__(self, openai_client: openai.AsyncOpenAI, limiter: RateLimiter, slot: Optional[asyncio.Semaphore] = None):
+        self.openai_client = openai_client
+        self.limiter = limiter
+        self.slot = slot
+
+    def get_model(self, model_name: Optional[str]) -> Model:
+        return RateLimitedResponsesModel(model_name or get_default_model(), self.openai_client, self.limiter, slot=self.slot)
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, requests_per_minute: Optional[float] = None) -> RateLimiter:
+    """Get the process-wide limiter for a provider ('openai', 'anthropic', 'unstract', 'google'). Passing
+    `requests_per_minute` (re)configures its pacing."""
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = RateLimiter(
+                provider,
+                requests_per_minute if requests_per_minute is not None else DEFAULT_REQUESTS_PER_MINUTE.get(provider, 60.)
+            )
+        elif requests_per_minute is not None:
+            _limiters[provider].configure(requests_per_minute)
+        return _limiters[provider]
@@ -0,0 +1,39 @@
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from GlobalUtils.disk_store import DiskLRUStore
+
+RUN_STORE_VERSION = 2
+
+
+def get_run_key(*parts: str) -> str:
+    """Get the key of a pipeline run from everything its outputs depend on, e.g. (payroll digest, WD digest, prompt and
+    model version)."""
+    key_json = json.dumps([RUN_STORE_VERSION, *parts])
+    return hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+
+
+class RunStore:
+    """On-disk checkpoints of pipeline stage outputs, so an interrupted or failed run resumes from its last completed
+    stages instead of paying for them again.
+
+    Outputs are stored as gzipped JSON, one file per (run key, stage). Reads refresh a checkpoint's mtime, and once the
+    store grows past `max_bytes` the least recently used checkpoints are evicted."""
+    def __init__(self, cache_dir: str, max_bytes: int = 256 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._disk = DiskLRUStore(cache_dir, '.json.gz', max_bytes, label='checkpoint')
+
+    def get_path(self, run_key: str, stage: str) -> Path:
+        return self._disk.get_path(f'{run_key}.{stage}')
+
+    def get(self, run_key: str, stage: str) -> Optional[dict]:
+        """Get a stage's checkpoint - {'output': ...} - or None if there isn't one."""
+        return self._disk.read_json(f'{run_key}.{stage}')
+
+    def put(self, run_key: str, stage: str, output: Any):
+        """Checkpoint a stage's (JSON-serializable) output."""
+        self._disk.write_json(f'{run_key}.{stage}', {'output': output, 'created_at': time.time()})
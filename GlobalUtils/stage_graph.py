@@ -0,0 +1,136 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Iterable, Optional
+
+
+class Stage:
+    """One step of a pipeline.
+
+    `run` is called with a dict of the results of the stage's finished inputs (name -> result) once every one of its
+    required `inputs` has finished. `optional_inputs` never hold a stage back - their results are passed along only if
+    they're already done when the stage starts."""
+    def __init__(
+            self,
+            name: str,
+            run: Callable[[dict], Awaitable],
+            inputs: Iterable[str] = (),
+            optional_inputs: Iterable[str] = ()
+    ):
+        self.name = name
+        self.run = run
+        self.inputs = tuple(inputs)
+        self.optional_inputs = tuple(optional_inputs)
+
+
+class StageTiming:
+    def __init__(self, name: str, ready: float, start: float, end: float, waited_on: Optional[str], failed: bool):
+        self.name = name
+        self.ready = ready  # when the stage was scheduled (all zero-based, in seconds from the start of the run)
+        self.start = start  # when its inputs were done and it started running
+        self.end = end
+        self.waited_on = waited_on  # the required input that finished last, i.e. what held the stage back
+        self.failed = failed
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class StageGraph:
+    """Runs a DAG of stages, starting each one as soon as its inputs are done, so independent stages overlap.
+
+    Each stage is timed, and `get_critical_path` gives the chain of stages that determined the total run time. If a
+    stage fails, stages that require it fail with the same exception and `run` raises it. `statuses` is kept up to
+    date as the graph runs, so other threads can poll its progress."""
+    def __init__(self, stages: Iterable[Stage]):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in self.stages.values():
+            for input_name in stage.inputs + stage.optional_inputs:
+                if input_name not in self.stages:
+                    raise ValueError(f'Stage "{stage.name}" depends on unknown stage "{input_name}"')
+        self.timings: dict[str, StageTiming] = {}
+        self.statuses: dict[str, str] = {name: 'pending' for name in self.stages}  # 'pending', 'running', 'done', 'failed'
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        visiting, visited = set(), set()
+
+        def visit(name: str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f'Stage graph has a cycle through "{name}"')
+            visiting.add(name)
+            stage = self.stages[name]
+            for input_name in stage.inputs + stage.optional_inputs:
+                visit(input_name)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    async def run(self) -> dict:
+        """Run every stage, returning their results (stage name -> result)."""
+        self.timings = {}
+        self.statuses = {name: 'pending' for name in self.stages}
+        run_start = time.perf_counter()
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage):
+            ready = time.perf_counter() - run_start
+            waited_on = None
+            if stage.inputs:
+                await asyncio.wait([tasks[name] for name in stage.inputs])
+                waited_on = max(stage.inputs, key=lambda name: self.timings[name].end)
+            start = time.perf_counter() - run_start
+            self.statuses[stage.name] = 'running'
+            try:
+                for name in stage.inputs:
+                    tasks[name].result()  # raises the input's exception, if it failed
+                inputs = {
+                    name: tasks[name].result()
+                    for name in stage.inputs + stage.optional_inputs
+                    if tasks[name].done() and not tasks[name].cancelled() and tasks[name].exception() is None
+                }
+                result = await stage.run(inputs)
+            except BaseException:
+                self.timings[stage.name] = StageTiming(stage.name, ready, start, time.perf_counter() - run_start, waited_on, True)
+                self.statuses[stage.name] = 'failed'
+                raise
+            self.timings[stage.name] = StageTiming(stage.name, ready, start, time.perf_counter() - run_start, waited_on, False)
+            self.statuses[stage.name] = 'done'
+            return result
+
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.create_task(run_stage(stage), name=f'stage:{stage.name}')
+        try:
+            await asyncio.wait(tasks.values())
+        except asyncio.CancelledError:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        for task in tasks.values():
+            task.result()
+        return {name: task.result() for name, task in tasks.items()}
+
+    def get_critical_path(self) -> list[StageTiming]:
+        """The chain of stages, ending with the last one to finish, where each one was held back by the one before."""
+        if not self.timings:
+            return []
+        timing = max(self.timings.values(), key=lambda timing: timing.end)
+        path = [timing]
+        while timing.waited_on is not None:
+            timing = self.timings[timing.waited_on]
+            path.append(timing)
+        return path[::-1]
+
+    def format_timings(self) -> str:
+        critical_stages = {timing.name for timing in self.get_critical_path()}
+        lines = []
+        for timing in sorted(self.timings.values(), key=lambda timing: timing.start):
+            marker = '*' if timing.name in critical_stages else ' '
+            status = ' (failed)' if timing.failed else ''
+            lines.append(f'{marker} {timing.name:<24} {timing.start:7.2f}s -> {timing.end:7.2f}s ({timing.duration:.2f}s){status}')
+        lines.append('(* = critical path)')
+        return '\n'.join(lines)
@@ -0,0 +1,205 @@
+import asyncio
+import time
+from typing import AsyncIterator, Hashable, Optional
+import weakref
+
+import httpx
+
+from GlobalUtils.clients import get_http_client
+from GlobalUtils.rate_limiting import get_rate_limiter
+
+BASE_URL = 'https://llmwhisperer-api.us-central.unstract.com/api/v2'
+
+
+class WhisperJob:
+    """A submitted LLMWhisperer job, and the future its result is delivered to."""
+    def __init__(self, pdf_data: bytes, params: dict, timeout: float, future: asyncio.Future):
+        self.pdf_data = pdf_data
+        self.params = params
+        self.timeout = timeout
+        self.future = future
+        self.whisper_hash = None
+        self.submitted_at = time.monotonic()
+        self.poll_interval = None
+        self.next_poll = None
+
+    @property
+    def deadline(self) -> float:
+        return self.submitted_at + self.timeout
+
+
+class AsyncWhisperClient:
+    """LLMWhisperer client that submits jobs as soon as they're requested and polls every in-flight job from one
+    shared poller task.
+
+    Each job is polled quickly at first (`min_poll_interval`), backing off by `poll_backoff` per poll up to
+    `max_poll_interval`, so short jobs come back promptly without long scanned payrolls flooding the status endpoint.
+    Each job gets a timeout scaled to its size - `base_timeout` plus `timeout_per_page` per page (or `timeout_per_mb`
+    per MB when the page count isn't known). Results are delivered through each job's future as soon as it's done.
+
+    Jobs and the poller are bound to the event loop they were submitted on - use `get_whisper_client`."""
+    def __init__(
+            self,
+            unstract_api_key: str,
+            client: Optional[httpx.AsyncClient] = None,
+            base_url: str = BASE_URL,
+            min_poll_interval: float = 1.,
+            max_poll_interval: float = 15.,
+            poll_backoff: float = 1.5,
+            base_timeout: float = 120.,
+            timeout_per_page: float = 20.,
+            timeout_per_mb: float = 60.
+    ):
+        self.auth_headers = {'unstract-key': unstract_api_key}
+        self.client = client
+        self.base_url = base_url
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_backoff = poll_backoff
+        self.base_timeout = base_timeout
+        self.timeout_per_page = timeout_per_page
+        self.timeout_per_mb = timeout_per_mb
+        self.limiter = get_rate_limiter('unstract')
+
+        self._polling: set[WhisperJob] = set()  # created jobs waiting to be processed
+        self._poller_task: Optional[asyncio.Task] = None
+        self._wake_poller = asyncio.Event()
+        self._tasks: set[asyncio.Task] = set()  # keeps creation/retrieval tasks referenced until they finish
+
+    def get_timeout(self, size_bytes: int, page_count: Optional[int] = None) -> float:
+        if page_count is not None:
+            return self.base_timeout + self.timeout_per_page * page_count
+        return self.base_timeout + self.timeout_per_mb * size_bytes / (1024 * 1024)
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Make an API request under the shared Unstract rate limiter (which retries 429s and 5xxs)."""
+        client = self.client if self.client is not None else get_http_client()
+
+        async def make_request():
+            response = await client.request(method, f'{self.base_url}/{path}', headers=self.auth_headers, **kwargs)
+            response.raise_for_status()
+            return response
+        return await self.limiter.call(make_request, get_headers=lambda response: response.headers)
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def submit(
+            self,
+            pdf_data: bytes,
+            add_line_nos: bool = False,
+            mode: Optional[str] = None,
+            page_count: Optional[int] = None,
+            timeout: Optional[float] = None
+    ) -> asyncio.Future:
+        """Submit a PDF for extraction right away, returning a future for the result JSON. Must be called from the
+        event loop the client is used on."""
+        params = {}
+        if add_line_nos:
+            params['add_line_nos'] = True
+        if mode is not None:
+            params['mode'] = mode
+        if timeout is None:
+            timeout = self.get_timeout(len(pdf_data), page_count)
+        job = WhisperJob(pdf_data, params, timeout, asyncio.get_running_loop().create_future())
+        self._spawn(self._create(job))
+        return job.future
+
+    async def extract(self, pdf_data: bytes, **kwargs) -> dict:
+        return await self.submit(pdf_data, **kwargs)
+
+    async def as_completed(self, futures: dict[Hashable, asyncio.Future]) -> AsyncIterator[tuple[Hashable, dict | BaseException]]:
+        """Yield (key, result JSON or exception) for submitted jobs, in the order they finish."""
+        keys = {future: key for key, future in futures.items()}
+        pending = set(keys)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield keys[future], future.exception() or future.result()
+
+    async def extract_many(self, pdfs: dict[Hashable, bytes], **kwargs) -> AsyncIterator[tuple[Hashable, dict | BaseException]]:
+        """Submit a batch of PDFs up front, yielding (key, result JSON or exception) as each one finishes."""
+        futures = {key: self.submit(pdf_data, **kwargs) for key, pdf_data in pdfs.items()}
+        async for key, result in self.as_completed(futures):
+            yield key, result
+
+    async def _create(self, job: WhisperJob):
+        try:
+            response = await self.request('POST', 'whisper', params=job.params, content=job.pdf_data)
+            job.whisper_hash = response.json()['whisper_hash']
+        except Exception as e:
+            self._fail(job, e)
+            return
+        job.pdf_data = None  # uploaded - don't hold on to it while the job runs
+        job.poll_interval = self.min_poll_interval
+        job.next_poll = time.monotonic() + job.poll_interval
+        self._polling.add(job)
+        self._wake_poller.set()
+        if self._poller_task is None or self._poller_task.done():
+            self._poller_task = asyncio.create_task(self._poll_jobs())
+
+    def _fail(self, job: WhisperJob, e: BaseException):
+        self._polling.discard(job)
+        if not job.future.done():
+            job.future.set_exception(e)
+
+    async def _poll_jobs(self):
+        """Poll every job that's due, then sleep until the next one is (or a new job arrives)."""
+        while self._polling:
+            now = time.monotonic()
+            for job in [job for job in self._polling if job.future.done()]:  # cancelled by the caller
+                self._polling.discard(job)
+            due = [job for job in self._polling if job.next_poll <= now]
+            await asyncio.gather(*[self._poll(job) for job in due])
+            if not self._polling:
+                break
+            self._wake_poller.clear()
+            next_poll = min(job.next_poll for job in self._polling)
+            try:
+                await asyncio.wait_for(self._wake_poller.wait(), timeout=max(0., next_poll - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, job: WhisperJob):
+        try:
+            status_response = await self.request('GET', 'whisper-status', params={'whisper_hash': job.whisper_hash})
+            status_json = status_response.json()
+        except Exception as e:
+            self._fail(job, e)
+            return
+        status = status_json['status']
+        if status == 'error':
+            self._fail(job, RuntimeError(f'Whisper job failed: {status_json}'))
+        elif status == 'processed':
+            self._polling.discard(job)
+            self._spawn(self._retrieve(job))
+        elif time.monotonic() > job.deadline:
+            self._fail(job, TimeoutError(f'Whisper job {job.whisper_hash} did not complete within {job.timeout:.0f} seconds'))
+        else:
+            job.poll_interval = min(self.max_poll_interval, job.poll_interval * self.poll_backoff)
+            job.next_poll = time.monotonic() + job.poll_interval
+
+    async def _retrieve(self, job: WhisperJob):
+        try:
+            result_response = await self.request('GET', 'whisper-retrieve', params={'whisper_hash': job.whisper_hash})
+            result_json = result_response.json()
+        except Exception as e:
+            self._fail(job, e)
+            return
+        if not job.future.done():
+            job.future.set_result(result_json)
+
+
+_whisper_clients = weakref.WeakKeyDictionary()  # event loop -> {(api key, http client id): AsyncWhisperClient}
+
+
+def get_whisper_client(unstract_api_key: str, client: Optional[httpx.AsyncClient] = None) -> AsyncWhisperClient:
+    """Get the shared Whisper client for an API key on the running event loop, so every caller's jobs share one
+    poller."""
+    loop_clients = _whisper_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (unstract_api_key, id(client))
+    if key not in loop_clients:
+        loop_clients[key] = AsyncWhisperClient(unstract_api_key, client=client)
+    return loop_clients[key]
@@ -0,0 +1,83 @@
+"""Check that WD citation highlights land on their text on pages with a /Rotate flag.
+
+Builds a fixture PDF with the same text on pages rotated 0, 90, 180 and 270 degrees (one with a shifted cropbox),
+indexes it like a wage determination, and checks that every highlight drawn by render_pdf_page_with_highlights covers
+dark (text) pixels of the rendered page - and that the highlight of a line placed in the page's top-left corner lands
+in the corner it's displayed in.
+
+Run from the repo root:
+    python -m benchmarks.citation_rotation_check
+"""
+import tempfile
+from pathlib import Path
+
+import fitz
+import numpy as np
+
+from GlobalUtils.citation import get_bbox_pixel_rects, render_page_raster
+from GlobalUtils.document import get_document
+from GlobalUtils.page_raster_cache import PageRasterCache
+from wd_index import WageDeterminationIndex
+
+ROTATIONS = [0, 90, 180, 270]
+LINES = ['CARPENTER                                   $ 32.50   $ 12.10', 'ELECTRICIAN                                 $ 41.25   $ 18.75']
+ZOOM = 2.0
+
+
+def make_fixture(path: str):
+    doc = fitz.open()
+    for rotation in ROTATIONS:
+        page = doc.new_page()
+        for line_ind, line in enumerate(LINES):
+            page.insert_text((50, 100 + 40 * line_ind), line, fontname='helv', fontsize=11)
+        page.set_rotation(rotation)
+    shifted = doc.new_page()  # rotated, and cropped so the cropbox doesn't start at the origin
+    for line_ind, line in enumerate(LINES):
+        shifted.insert_text((80, 130 + 40 * line_ind), line, fontname='helv', fontsize=11)
+    shifted.set_cropbox(fitz.Rect(30, 30, 580, 760))
+    shifted.set_rotation(90)
+    doc.save(path)
+
+
+def check_page(document, index: WageDeterminationIndex, page: int) -> list[str]:
+    errors = []
+    img = np.asarray(render_page_raster(document, page, zoom=ZOOM, raster_cache=PageRasterCache()).convert('L'))
+    with document.lock:
+        pdf_page = document.fitz_doc[page]
+        bboxes = [bbox for bbox in index.line_bboxes[page] if bbox is not None]
+        rects = get_bbox_pixel_rects(pdf_page, bboxes, zoom=ZOOM)
+        rotation = pdf_page.rotation
+    if len(rects) != len(LINES):
+        return [f'page {page}: expected {len(LINES)} line bboxes, got {len(rects)}']
+    for line_ind, (x0, y0, x1, y1) in enumerate(rects):
+        crop = img[max(0, int(y0)):int(y1) + 1, max(0, int(x0)):int(x1) + 1]
+        dark_fraction = float((crop < 128).mean()) if crop.size else 0.
+        if dark_fraction < 0.05:
+            errors.append(f'page {page} (/Rotate {rotation}): highlight of line {line_ind} at {[round(v) for v in (x0, y0, x1, y1)]} covers no text')
+    # the first line starts near the unrotated page's top left, so it should be drawn in the matching displayed corner
+    height, width = img.shape
+    center_x, center_y = (rects[0][0] + rects[0][2]) / 2, (rects[0][1] + rects[0][3]) / 2
+    expected_corner = {0: (False, False), 90: (True, False), 180: (True, True), 270: (False, True)}[rotation]
+    corner = (center_x > width / 2, center_y > height / 2)
+    if rotation in (0, 180) and corner[1] != expected_corner[1] or rotation in (90, 270) and corner[0] != expected_corner[0]:
+        errors.append(f'page {page} (/Rotate {rotation}): first line drawn at ({center_x:.0f}, {center_y:.0f}) on a {width}x{height} image')
+    return errors
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = str(Path(tmp_dir) / 'rotated_wd.pdf')
+        make_fixture(pdf_path)
+        document = get_document(pdf_path)
+        index = WageDeterminationIndex.from_pdf(pdf_path)
+        errors = []
+        for page in range(index.page_count):
+            errors.extend(check_page(document, index, page))
+    if errors:
+        print('\n'.join(errors))
+        raise SystemExit(1)
+    print(f'Highlights cover their text on all {index.page_count} fixture pages (/Rotate {ROTATIONS} and a cropped page).')
+
+
+if __name__ == '__main__':
+    main()
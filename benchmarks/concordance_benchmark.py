@@ -0,0 +1,106 @@
+"""Benchmark the wage check concordance against the legacy greedy pairing loop.
+
+Run from the repo root:
+    python -m benchmarks.concordance_benchmark --rows 1000
+"""
+import argparse
+import random
+import string
+import time
+
+from rapidfuzz import fuzz
+from rapidfuzz.utils import default_process as rapidfuzz_default_process
+
+from concordance import match_records
+
+FIRST_NAMES = ['James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William', 'Elizabeth',
+               'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+               'Jose', 'Juan', 'Luis', 'Carlos', 'Maria', 'Ana', 'Miguel', 'Jorge', 'Pedro', 'Rosa']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+              'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+              'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Ramirez', 'Lewis', 'Robinson']
+TITLES = ['Laborer', 'Carpenter', 'Electrician', 'Operator', 'Ironworker', 'Plumber', 'Cement Mason', 'Painter']
+
+
+def legacy_greedy_pairs(left_names: list[str], right_names: list[str], name_match_threshold: float = 80.) -> list[tuple[int, int]]:
+    """The pairing loop formerly in ComplianceChecker.get_payroll_compliance_table."""
+    comparisons = []
+    for left_ind, left_name in enumerate(left_names):
+        for right_ind, right_name in enumerate(right_names):
+            score = fuzz.ratio(left_name, right_name, processor=rapidfuzz_default_process)
+            comparisons.append((score, left_ind, right_ind))
+    comparisons.sort(reverse=True, key=lambda x: x[0])
+    unmatched_left, unmatched_right = set(range(len(left_names))), set(range(len(right_names)))
+    pairs = []
+    for score, left_ind, right_ind in comparisons:
+        if score < name_match_threshold:
+            break
+        if left_ind not in unmatched_left or right_ind not in unmatched_right:
+            continue
+        unmatched_left.remove(left_ind)
+        unmatched_right.remove(right_ind)
+        pairs.append((left_ind, right_ind))
+    return sorted(pairs)
+
+
+def perturb(name: str, rng: random.Random) -> str:
+    """Simulate a model transcribing a name slightly differently - a dropped, swapped or misread character."""
+    chars = list(name)
+    ind = rng.randrange(len(chars))
+    edit = rng.choice(['drop', 'swap', 'replace', 'none'])
+    if edit == 'drop':
+        del chars[ind]
+    elif edit == 'swap' and ind + 1 < len(chars):
+        chars[ind], chars[ind + 1] = chars[ind + 1], chars[ind]
+    elif edit == 'replace':
+        chars[ind] = rng.choice(string.ascii_lowercase)
+    return ''.join(chars)
+
+
+def make_rows(rows: int, id_fraction: float, seed: int):
+    """Make two noisy, shuffled copies of a synthetic payroll. Returns the left/right names, ids and titles, and the
+    true (left, right) pairs."""
+    rng = random.Random(seed)
+    names = [f'{rng.choice(FIRST_NAMES)} {rng.choice(string.ascii_uppercase)}. {rng.choice(LAST_NAMES)}' for _ in range(rows)]
+    ids = [f'{rng.randrange(10_000):04d}' if rng.random() < id_fraction else '' for _ in range(rows)]
+    titles = [rng.choice(TITLES) for _ in range(rows)]
+    order = list(range(rows))
+    rng.shuffle(order)
+    right_names = [perturb(names[i], rng) for i in order]
+    right_ids = [ids[i] for i in order]
+    right_titles = [titles[i] for i in order]
+    truth = sorted((original, shuffled) for shuffled, original in enumerate(order))
+    return names, ids, titles, right_names, right_ids, right_titles, truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--id-fraction', type=float, default=0.5, help='fraction of rows with an identification number')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    left_names, left_ids, left_titles, right_names, right_ids, right_titles, truth = make_rows(args.rows, args.id_fraction, args.seed)
+    truth = set(truth)
+
+    start = time.perf_counter()
+    legacy_pairs = legacy_greedy_pairs(left_names, right_names)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    concordance = match_records(
+        left_names, right_names,
+        left_ids=left_ids, right_ids=right_ids,
+        left_titles=left_titles, right_titles=right_titles
+    )
+    concordance_time = time.perf_counter() - start
+
+    print(f'{args.rows} x {args.rows} rows, {args.id_fraction:.0%} with identification numbers')
+    for label, pairs, elapsed in [('legacy greedy', legacy_pairs, legacy_time), ('concordance', concordance.pairs, concordance_time)]:
+        correct = len(truth.intersection(pairs))
+        print(f'{label:>14}: {elapsed:8.3f}s  {len(pairs)} pairs, {correct} correct ({correct / len(truth):.1%} recall)')
+    print(f'speedup: {legacy_time / concordance_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Benchmark the single-pass line layout renderer against the legacy text box renderer for WD line highlights.
+
+Run from the repo root:
+    python -m benchmarks.line_layout_benchmark --lines 120 --repeats 5
+"""
+import argparse
+import io
+import random
+import string
+import time
+
+import fitz
+from PIL import Image
+
+from GlobalUtils.line_layout import LineLayout
+
+CLASSIFICATIONS = ['CARPENTER', 'ELECTRICIAN', 'LABORER: Common or General', 'OPERATOR: Backhoe/Excavator/Trackhoe',
+                   'IRONWORKER, STRUCTURAL', 'PLUMBER', 'CEMENT MASON/CONCRETE FINISHER', 'TRUCK DRIVER: Dump Truck']
+
+
+def legacy_render_line_highlights(
+        text: str,
+        highlight_lines: list[int],
+        highlight_color: tuple = (1, 1, 0),
+        highlight_opacity: float = 0.3,
+        zoom: float = 2.0,
+        line_height: int = 16,
+        text_height: int = 8,
+        page_height: int | None = None
+):
+    """The retry-and-re-typeset renderer formerly in GlobalUtils.citation.render_line_highlights."""
+    doc = fitz.open()  # new empty PDF
+    if page_height is not None:
+        page = doc.new_page(height=page_height)  # new page
+    else:
+        page = doc.new_page()  # new page
+    y = 0
+    for line_ind, line in enumerate(text.splitlines()):
+        highlight_rect = fitz.Rect(0, y, page.rect.width, y + line_height)
+        text_rect = fitz.Rect(50, y + 2, 550, y + line_height)
+        while page.insert_textbox(text_rect, line, fontsize=text_height) < 0.:
+            text_rect.y1 += line_height
+            highlight_rect.y1 += line_height
+        if line_ind in highlight_lines:
+            annot = page.add_highlight_annot(highlight_rect)
+            annot.set_colors(stroke=highlight_color)
+            annot.set_opacity(highlight_opacity)
+            annot.update()
+        y = highlight_rect.y1  # increment y position for next line
+    if y > page.rect.height:
+        return legacy_render_line_highlights(text, highlight_lines, highlight_color, highlight_opacity, zoom, line_height, text_height, page_height=y+20)
+    mat = fitz.Matrix(zoom, zoom)
+    pix_bytes = page.get_pixmap(matrix = mat).tobytes('png')
+    img = Image.open(io.BytesIO(pix_bytes))
+    return img.convert('RGB')
+
+
+def make_wd_page(n_lines: int, seed: int) -> str:
+    """A WD-like page: rate lines, headers, and some long footnote lines that wrap."""
+    rng = random.Random(seed)
+    lines = []
+    for line_ind in range(n_lines):
+        kind = rng.random()
+        if kind < 0.1:
+            lines.append(f'SU{rng.choice(string.ascii_uppercase)}{rng.randint(2000, 2024)}-{rng.randint(1, 999):03d} {rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(2018, 2024)}')
+        elif kind < 0.85:
+            lines.append(f'{rng.choice(CLASSIFICATIONS):<45}${rng.uniform(15, 60):6.2f} ${rng.uniform(0, 25):6.2f}')
+        else:
+            lines.append(' '.join(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(rng.randint(30, 80))))
+    return '\n'.join(lines)
+
+
+def time_call(function, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=120, help='lines on the WD page')
+    parser.add_argument('--highlights', type=int, default=3, help='consecutive highlighted lines')
+    parser.add_argument('--window', type=int, default=10, help='context lines for the windowed render')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    text = make_wd_page(args.lines, args.seed)
+    first_highlight = random.Random(args.seed).randrange(max(1, args.lines - args.highlights))
+    highlight_lines = list(range(first_highlight, first_highlight + args.highlights))
+
+    legacy_time = time_call(lambda: legacy_render_line_highlights(text, highlight_lines), args.repeats)
+    layout_time = time_call(lambda: LineLayout(text), args.repeats)
+    layout = LineLayout(text)
+    full_render_time = time_call(lambda: layout.render(highlight_lines), args.repeats)
+    window_render_time = time_call(lambda: layout.render(highlight_lines, window_lines=args.window), args.repeats)
+
+    print(f'{args.lines} lines, {len(highlight_lines)} highlighted')
+    print(f'legacy (text box retries + re-typeset):   {legacy_time * 1000:8.1f} ms per click')
+    print(f'single-pass layout (once per page):       {layout_time * 1000:8.1f} ms')
+    print(f'  + full page render:                     {full_render_time * 1000:8.1f} ms per click')
+    print(f'  + window render ({args.window} lines of context):  {window_render_time * 1000:8.1f} ms per click')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import re
+from typing import Optional
+
+import numpy as np
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process as rapidfuzz_default_process
+from scipy.optimize import linear_sum_assignment
+
+ID_STRIP_PATTERN = re.compile(r'[^0-9a-z]')
+
+
+def normalize_identification_number(identification_number: Optional[str]) -> str:
+    """Normalize an identification number for blocking - '' means there isn't one."""
+    if not identification_number:
+        return ''
+    return ID_STRIP_PATTERN.sub('', identification_number.lower())
+
+
+class ConcordanceResult:
+    """Pairing of two lists of records (e.g. the OpenAI and Claude wage checks of a payroll).
+
+    `pairs` holds (left index, right index) tuples, sorted by left index, with the name score of each pair in `scores`.
+    Records left unpaired are listed in `unmatched_left`/`unmatched_right`."""
+    def __init__(self, pairs: list[tuple[int, int]], scores: list[float], unmatched_left: list[int], unmatched_right: list[int]):
+        self.pairs = pairs
+        self.scores = scores
+        self.unmatched_left = unmatched_left
+        self.unmatched_right = unmatched_right
+
+    def __len__(self):
+        return len(self.pairs)
+
+
+def _score_matrix(left: list[str], right: list[str]) -> np.ndarray:
+    return process.cdist(left, right, scorer=fuzz.ratio, processor=rapidfuzz_default_process, workers=-1, dtype=np.float32)
+
+
+def _assign(
+        left_inds: list[int],
+        right_inds: list[int],
+        left_names: list[str],
+        right_names: list[str],
+        left_titles: Optional[list[str]],
+        right_titles: Optional[list[str]],
+        name_match_threshold: float,
+        title_weight: float
+) -> list[tuple[int, int, float]]:
+    """Solve the assignment between two blocks of records, maximizing the total name score over pairs scoring at
+    least `name_match_threshold`. Title scores (scaled by `title_weight`) only break ties between equal names."""
+    if not left_inds or not right_inds:
+        return []
+    name_scores = _score_matrix([left_names[i] for i in left_inds], [right_names[j] for j in right_inds])
+    valid = name_scores >= name_match_threshold
+    if not valid.any():
+        return []
+    weights = np.where(valid, name_scores, 0.)
+    if left_titles is not None and right_titles is not None and title_weight > 0:
+        title_scores = _score_matrix([left_titles[i] for i in left_inds], [right_titles[j] for j in right_inds])
+        weights = weights + np.where(valid, title_weight * title_scores, 0.)
+    # only rows/columns with at least one valid pair take part - this keeps the solve small on sparse blocks
+    rows = np.flatnonzero(valid.any(axis=1))
+    cols = np.flatnonzero(valid.any(axis=0))
+    row_inds, col_inds = linear_sum_assignment(weights[np.ix_(rows, cols)], maximize=True)
+    return [
+        (left_inds[rows[r]], right_inds[cols[c]], float(name_scores[rows[r], cols[c]]))
+        for r, c in zip(row_inds, col_inds)
+        if valid[rows[r], cols[c]]
+    ]
+
+
+def match_records(
+        left_names: list[str],
+        right_names: list[str],
+        left_ids: Optional[list[str]] = None,
+        right_ids: Optional[list[str]] = None,
+        left_titles: Optional[list[str]] = None,
+        right_titles: Optional[list[str]] = None,
+        name_match_threshold: float = 80.,
+        title_weight: float = 0.01
+) -> ConcordanceResult:
+    """Pair up two lists of records by name, as an optimal one-to-one assignment.
+
+    If identification numbers are given, records are first blocked on them - records sharing an identification number
+    are only paired with each other. Whatever's left unpaired (no identification number, no counterpart with the same
+    one, or surplus records in a block) is then paired on name alone. Names are scored with rapidfuzz's `fuzz.ratio`,
+    and pairs scoring below `name_match_threshold` are never made."""
+    matches = []
+    remaining_left = list(range(len(left_names)))
+    remaining_right = list(range(len(right_names)))
+
+    if left_ids is not None and right_ids is not None:
+        left_blocks, right_blocks = {}, {}
+        for i, identification_number in enumerate(left_ids):
+            key = normalize_identification_number(identification_number)
+            if key:
+                left_blocks.setdefault(key, []).append(i)
+        for j, identification_number in enumerate(right_ids):
+            key = normalize_identification_number(identification_number)
+            if key:
+                right_blocks.setdefault(key, []).append(j)
+        for key, block_left in left_blocks.items():
+            if key in right_blocks:
+                matches.extend(_assign(
+                    block_left, right_blocks[key], left_names, right_names, left_titles, right_titles,
+                    name_match_threshold, title_weight
+                ))
+        matched_left = {i for i, j, score in matches}
+        matched_right = {j for i, j, score in matches}
+        remaining_left = [i for i in remaining_left if i not in matched_left]
+        remaining_right = [j for j in remaining_right if j not in matched_right]
+
+    matches.extend(_assign(
+        remaining_left, remaining_right, left_names, right_names, left_titles, right_titles,
+        name_match_threshold, title_weight
+    ))
+    matches.sort()
+    matched_left = {i for i, j, score in matches}
+    matched_right = {j for i, j, score in matches}
+    return ConcordanceResult(
+        pairs=[(i, j) for i, j, score in matches],
+        scores=[score for i, j, score in matches],
+        unmatched_left=[i for i in range(len(left_names)) if i not in matched_left],
+        unmatched_right=[j for j in range(len(right_names)) if j not in matched_right]
+    )
+
+
+def match_wage_checks(left: list, right: list, name_match_threshold: float = 80.) -> ConcordanceResult:
+    """Pair up two lists of EmployeeWageCheck by employee name, blocking on identification number and breaking ties
+    on payroll title."""
+    return match_records(
+        left_names=[wage_check.employee_name for wage_check in left],
+        right_names=[wage_check.employee_name for wage_check in right],
+        left_ids=[wage_check.identification_number for wage_check in left],
+        right_ids=[wage_check.identification_number for wage_check in right],
+        left_titles=[wage_check.payroll_title for wage_check in left],
+        right_titles=[wage_check.payroll_title for wage_check in right],
+        name_match_threshold=name_match_threshold
+    )
@@ -17,9 +17,6 @@ from rapidfuzz.utils import default_process as rapidfuzz_default_process
 import time
 import importlib
 
-import nest_asyncio
-nest_asyncio.apply() # todo this is hacky - necessary?
-
 DEV_MODE = False # todo set false for deployment
 
 if DEV_MODE: # force reload of db_utils for easier dev
@@ -29,6 +26,17 @@ if DEV_MODE: # force reload of db_utils for easier dev
             del sys.modules[mod_name]
 
 from db_utils import ComplianceChecker, EmployeeWageCheck, ComplianceTable
+from GlobalUtils.ocr_cache import OCRResultStore
+from location_memo import get_location_memo
+from GlobalUtils.gazetteer import get_gazetteer
+from GlobalUtils.page_raster_cache import get_page_raster_cache
+from GlobalUtils.citation_prefetch import CitationPrefetcher
+from GlobalUtils.citation_cache import get_citation_cache, get_citation_key
+from GlobalUtils.geocoding import get_geocoder
+from GlobalUtils.jobs import Job, get_job_runner
+from GlobalUtils.run_store import RunStore
+from GlobalUtils.orientation import get_osd_pool
+from GlobalUtils.rate_limiting import get_rate_limiter
 
 
 
@@ -125,13 +133,35 @@ def fix_table_checks(compliance_table: ComplianceTable):
         wage_check.compliance = ftfy.fix_text(wage_check.compliance)
     return compliance_table
 
+def get_session_citation_cache():
+    """Get the (process-wide) citation image cache, and this session's id in it."""
+    config_dict = load_config()
+    citation_cache = get_citation_cache(
+        config_dict['citation_cache_dir'],
+        max_memory_bytes = config_dict['citation_cache_memory_mb'] * 1024 * 1024,
+        max_session_bytes = config_dict['citation_cache_session_mb'] * 1024 * 1024,
+        max_disk_bytes = config_dict['citation_cache_disk_mb'] * 1024 * 1024
+    )
+    if 'session_id' not in st.session_state:
+        st.session_state['session_id'] = uuid.uuid4().hex
+    return citation_cache, st.session_state['session_id']
+
 def reset_st_session_state():
+    if 'compliance_job_id' in st.session_state:
+        get_job_runner().cancel(st.session_state['compliance_job_id'])
+        get_job_runner().pop(st.session_state['compliance_job_id'])
+    if 'citation_prefetcher' in st.session_state:
+        st.session_state['citation_prefetcher'].close()
+    citation_cache, session_id = get_session_citation_cache()
+    citation_cache.release_session(session_id)
     keys_to_clear = [
         'compliance_results',
+        'payroll_file_names',
         'payroll_files_paths',
         'db_wages_file_path',
         'failed_indices',
-        'citation_cache',
+        'citation_prefetcher',
+        'compliance_job_id',
     ]
     for key in keys_to_clear:
         if key in st.session_state:
@@ -162,6 +192,54 @@ def get_bool_compliance_symbol(is_compliant: bool):
     else:
         return '❌'
 
+def get_citation_images(compliance_checker: ComplianceChecker, payroll_citation_line_hexes: list[str], wage_determination_citation_line_hexes: list[str]):
+    """Render the citation images for a wage check, as cached for the citation dialog:
+    ((db_wages_images, db_wages_page_numbers), (payroll_images, payroll_page_numbers))"""
+    payroll_citation_images, payroll_citation_page_numbers = compliance_checker.get_payroll_citation_images_from_line_hexes(
+        citation_line_hexes=payroll_citation_line_hexes
+    )
+    db_wages_citation_images, db_wages_citation_page_numbers = compliance_checker.get_db_wages_citation_images_from_line_hexes(
+        citation_line_hexes=wage_determination_citation_line_hexes
+    )
+    return (db_wages_citation_images, db_wages_citation_page_numbers), (payroll_citation_images, payroll_citation_page_numbers)
+
+def get_disputed_citation_line_hexes(openai_wage_check: EmployeeWageCheck, claude_wage_check: EmployeeWageCheck):
+    """Get the (payroll, wage determination) citation lines for a disputed wage check - all lines, from both models."""
+    payroll_citation_line_hexes = list(set(openai_wage_check.payroll_citation_lines + claude_wage_check.payroll_citation_lines))
+    wage_determination_citation_line_hexes = list(set(openai_wage_check.wage_determination_citation_lines + claude_wage_check.wage_determination_citation_lines))
+    return payroll_citation_line_hexes, wage_determination_citation_line_hexes
+
+def get_wage_check_citation_key(compliance_checker: ComplianceChecker, payroll_citation_line_hexes: list[str], wage_determination_citation_line_hexes: list[str]) -> str:
+    """Get a wage check's citation cache key - by the documents and cited lines, not by where the row is displayed."""
+    return get_citation_key(
+        compliance_checker.payroll_document.get_digest(),
+        payroll_citation_line_hexes,
+        compliance_checker.db_wages_document.get_digest(),
+        wage_determination_citation_line_hexes
+    )
+
+def create_citation_prefetcher() -> CitationPrefetcher:
+    config_dict = load_config()
+    citation_cache, session_id = get_session_citation_cache()
+    return CitationPrefetcher(citation_cache, session_id, max_workers = config_dict['citation_prefetch_workers'])
+
+def prefetch_payroll_citations(prefetcher: CitationPrefetcher, compliance_result: dict):
+    """Start rendering the citations for every agreed and disputed wage check of a payroll into the citation cache in
+    the background, in display order."""
+    compliance_checker = compliance_result['compliance_checker']
+    line_hexes_list = [
+        (wage_check.payroll_citation_lines, wage_check.wage_determination_citation_lines)
+        for wage_check in compliance_result['compliance_table'].wage_checks
+    ] + [
+        get_disputed_citation_line_hexes(openai_wage_check, claude_wage_check)
+        for openai_wage_check, claude_wage_check in compliance_result['disputed_wage_checks']
+    ]
+    for line_hexes in line_hexes_list:
+        prefetcher.submit(
+            get_wage_check_citation_key(compliance_checker, *line_hexes),
+            lambda line_hexes=line_hexes: get_citation_images(compliance_checker, *line_hexes)
+        )
+
 @st.dialog('View Citation Source', width='large')
 def show_citation_dialog(
         wage_check: EmployeeWageCheck,
@@ -178,42 +256,36 @@ def show_citation_dialog(
         st.write(wage_check.davis_bacon_classification)
         st.markdown(f'**Title:** {wage_check.payroll_title} | **Identification Number:** {wage_check.identification_number} | **Paid Rate:** \\${wage_check.paid_rate:,.2f} | **Overtime rate:** \\${wage_check.overtime_rate} | **Davis-Bacon Classification:** {wage_check.davis_bacon_classification} | **Davis-Bacon Total Rate:** \\${wage_check.davis_bacon_total_rate:,.2f} | Compliance: {get_compliance_symbol(wage_check.compliance)}')
 
-    # Initialize cache if it doesn't exist
-    if 'citation_cache' not in st.session_state:
-        st.session_state['citation_cache'] = {}
-    if disputed:
-        cache_key = f'disputed_{payroll_index}_{employee_index}'
+    if payroll_citation_line_hexes_override is None:
+        payroll_citation_line_hexes = wage_check.payroll_citation_lines
+    else:
+        payroll_citation_line_hexes = payroll_citation_line_hexes_override
+    if db_wages_citation_line_hexes_override is None:
+        wage_determination_citation_line_hexes = wage_check.wage_determination_citation_lines
     else:
-        cache_key = f'{payroll_index}_{employee_index}'
+        wage_determination_citation_line_hexes = db_wages_citation_line_hexes_override
+    # shared across sessions - and usually already rendered into it by the session's prefetcher
+    citation_cache, session_id = get_session_citation_cache()
+    citation_key = get_wage_check_citation_key(compliance_checker, payroll_citation_line_hexes, wage_determination_citation_line_hexes)
 
     start_time = time.time()
     # Check if citation is already cached
-    if cache_key in st.session_state['citation_cache']:
-        (db_wages_citation_images, db_wages_citation_page_numbers), (payroll_citation_images, payroll_citation_page_numbers) = st.session_state['citation_cache'][cache_key]
+    citation = citation_cache.get(citation_key, session_id)
+    if citation is not None:
         st.info('Loaded source from cache')
     else:
         with st.spinner('Generating citation (<5 seconds) ...', show_time=True):
             try:
-                if payroll_citation_line_hexes_override is None:
-                    payroll_citation_line_hexes = wage_check.payroll_citation_lines
-                else:
-                    payroll_citation_line_hexes = payroll_citation_line_hexes_override
-                if db_wages_citation_line_hexes_override is None:
-                    wage_determination_citation_line_hexes = wage_check.wage_determination_citation_lines
-                else:
-                    wage_determination_citation_line_hexes = db_wages_citation_line_hexes_override
-                payroll_citation_images, payroll_citation_page_numbers = compliance_checker.get_payroll_citation_images_from_line_hexes(
-                    citation_line_hexes=payroll_citation_line_hexes
-                )
-
-                db_wages_citation_images, db_wages_citation_page_numbers = compliance_checker.get_db_wages_citation_images_from_line_hexes(
-                    citation_line_hexes=wage_determination_citation_line_hexes
-                )
-                st.session_state['citation_cache'][cache_key] = (db_wages_citation_images, db_wages_citation_page_numbers), (payroll_citation_images, payroll_citation_page_numbers)
+                if 'citation_prefetcher' in st.session_state and st.session_state['citation_prefetcher'].wait(citation_key):
+                    citation = citation_cache.get(citation_key, session_id)  # was being rendered in the background
+                if citation is None:
+                    citation = get_citation_images(compliance_checker, payroll_citation_line_hexes, wage_determination_citation_line_hexes)
+                    citation_cache.put(citation_key, citation, session_id)
             except Exception as e:
                 st.error(f'Error generating citation: {str(e)}')
                 raise e
                 # return
+    (db_wages_citation_images, db_wages_citation_page_numbers), (payroll_citation_images, payroll_citation_page_numbers) = citation
     end_time = time.time()
 
     if payroll_citation_images:
@@ -302,8 +374,7 @@ def show_disputed_employee_additional_info(
         """)
     if r_col.button(f'show citation for {selected_openai_wage_check.employee_name}', key=f'disputed_show_citation_{payroll_index}_{selected_dispute_index}'):
         #show all citation lines, from both models
-        payroll_citation_line_hexes = list(set(selected_openai_wage_check.payroll_citation_lines + selected_claude_wage_check.payroll_citation_lines))
-        wage_determination_citation_line_hexes = list(set(selected_openai_wage_check.wage_determination_citation_lines + selected_claude_wage_check.wage_determination_citation_lines))
+        payroll_citation_line_hexes, wage_determination_citation_line_hexes = get_disputed_citation_line_hexes(selected_openai_wage_check, selected_claude_wage_check)
         show_citation_dialog(
             wage_check=selected_openai_wage_check,
             compliance_checker=compliance_checker,
@@ -318,6 +389,8 @@ def get_tables_html(compliance_results: list[dict], failed_indices: list[int]):
     """Get HTML representation of compliance results tables."""
     tables_html = ''
     for ind, compliance_result in enumerate(compliance_results):
+        if compliance_result is None:  # still being checked
+            continue
         tables_html+='<br><br><hr><hr><br><br>'
         if ind in failed_indices:
             tables_html += f'\n<p style = "font-size: 25px; color:red">{compliance_result["file_name"]} - FAILED TO PROCESS</p>'
@@ -365,8 +438,23 @@ def render_compliance_results(cell_style_jscode: JsCode):
     if st.session_state['failed_indices']:
         st.error(
             f'Compliance check failed for {len(st.session_state['failed_indices'])} payroll files: \n{", ".join([st.session_state['compliance_results'][i]['file_name'] for i in st.session_state['failed_indices']])}')
+        if 'compliance_job_id' not in st.session_state and st.button('Retry failed payrolls'):
+            st.session_state['compliance_job_id'] = retry_failed_payrolls()
+            st.rerun()
 
-    st.info('Compliance tables successfully loaded')
+    if 'compliance_job_id' in st.session_state:
+        show_compliance_job_progress()
+    else:
+        st.info('Compliance tables successfully loaded')
+    completion_times = [
+        compliance_result['completion_time'] for compliance_result in st.session_state['compliance_results']
+        if compliance_result is not None and compliance_result['completion_time'] is not None
+    ]
+    if completion_times:
+        timing_caption = f'First result after {min(completion_times):.1f}s'
+        if 'compliance_job_id' not in st.session_state:
+            timing_caption += f', all {len(completion_times)} after {max(completion_times):.1f}s'
+        st.caption(timing_caption)
     st.markdown('### Compliance Results:')
 
     # get html for the table
@@ -382,6 +470,8 @@ def render_compliance_results(cell_style_jscode: JsCode):
         reset_st_session_state()
         st.rerun()
     for payroll_index, compliance_result in enumerate(st.session_state['compliance_results']):
+        if compliance_result is None:  # still being checked - rendered once it finishes
+            continue
         if payroll_index in st.session_state['failed_indices']:
             st.write(compliance_result)
             st.write(compliance_result['exception']) # todo remove?
@@ -427,7 +517,7 @@ def render_compliance_results(cell_style_jscode: JsCode):
         }
         hidden_cols = ['index', 'compliance_reasoning', 'payroll_citation_lines', 'wage_determination_citation_lines']
         grid_options = get_aggrid_options(data, hidden_cols=hidden_cols, column_widths = column_widths, column_names = column_names, cell_style_jscode=cell_style_jscode)
-        with st.expander(label=f'({file_name}) - {compliance_table.payroll_name}', expanded=False):
+        with st.expander(label=f'({file_name}) - {compliance_table.payroll_name} (finished in {compliance_result["completion_time"]:.0f}s)', expanded=False):
             st.write(f'**Project location**: {compliance_checker.project_location_str}')
             st.write(f'Payroll covers one week: {get_bool_compliance_symbol(compliance_table.is_one_week)}')
             st.write(f'Payroll contains contract number: {get_bool_compliance_symbol(compliance_table.has_contract_number)}')
@@ -529,13 +619,11 @@ def render_compliance_results(cell_style_jscode: JsCode):
 
         st.divider()
 
-def get_compliance_results(
+def start_compliance_job(
         payroll_files,
         db_wages_file
-):
-    """Get compliance results for uploaded payroll and Davis-Bacon wages files."""
-    st.success('Files uploaded successfully!')
-
+) -> str:
+    """Start checking the uploaded payroll and Davis-Bacon wages files in the background, returning the job ID."""
     config_dict = load_config()
     files_save_dir = config_dict['files_save_dir']
 
@@ -551,6 +639,30 @@ def get_compliance_results(
     st.session_state['payroll_files_paths'] = file_paths[:-1]
     st.session_state['db_wages_file_path'] = db_wages_file_path
 
+    compliance_checkers = create_compliance_checkers(st.session_state['payroll_files_paths'], db_wages_file_path)
+    return submit_compliance_job({
+        payroll_ind: (payroll_file.name, checker)
+        for payroll_ind, (payroll_file, checker) in enumerate(zip(payroll_files, compliance_checkers))
+    })
+
+def retry_failed_payrolls() -> str:
+    """Re-check the payrolls that failed, with fresh checkers - stages they completed before failing are resumed from
+    the run store, so only the missing work is redone. Returns the job ID."""
+    failed_indices = sorted(st.session_state['failed_indices'])
+    compliance_checkers = create_compliance_checkers(
+        [st.session_state['payroll_files_paths'][payroll_ind] for payroll_ind in failed_indices],
+        st.session_state['db_wages_file_path']
+    )
+    for payroll_ind in failed_indices:
+        st.session_state['compliance_results'][payroll_ind] = None
+    st.session_state['failed_indices'] = []
+    return submit_compliance_job({
+        payroll_ind: (st.session_state['payroll_file_names'][payroll_ind], checker)
+        for payroll_ind, checker in zip(failed_indices, compliance_checkers)
+    })
+
+def create_compliance_checkers(payroll_files_paths: list[str], db_wages_file_path: str) -> list[ComplianceChecker]:
+    config_dict = load_config()
     with open(config_dict['openai_compliance_matrix_prompt_path'], 'r', encoding='utf-8') as f:
         openai_compliance_matrix_prompt = f.read()
     with open(config_dict['openai_single_wage_check_prompt_path'], 'r', encoding='utf-8') as f:
@@ -559,11 +671,34 @@ def get_compliance_results(
         claude_compliance_matrix_prompt = f.read()
     with open(config_dict['claude_single_wage_check_prompt_path'], 'r', encoding='utf-8') as f:
         claude_single_wage_check_prompt = f.read()
+    with open(config_dict['openai_batch_wage_check_prompt_path'], 'r', encoding='utf-8') as f:
+        openai_batch_wage_check_prompt = f.read()
+    with open(config_dict['claude_batch_wage_check_prompt_path'], 'r', encoding='utf-8') as f:
+        claude_batch_wage_check_prompt = f.read()
     with open(config_dict['relevant_locations_prompt_path'], 'r', encoding='utf-8') as f:
         relevant_locations_prompt = f.read()
 
 
     compliance_semaphore = asyncio.Semaphore(config_dict['max_concurrent_compliance_checks'])
+    ocr_result_store = OCRResultStore(config_dict['ocr_cache_dir'], max_bytes = config_dict['ocr_cache_max_mb'] * 1024 * 1024)
+    run_store = RunStore(config_dict['run_store_dir'], max_bytes = config_dict['run_store_max_mb'] * 1024 * 1024)
+    location_memo = get_location_memo(config_dict['location_cache_dir'])  # shared by the whole batch, and across runs
+    page_raster_cache = get_page_raster_cache(
+        config_dict['page_raster_cache_dir'],
+        max_memory_bytes = config_dict['page_raster_cache_memory_mb'] * 1024 * 1024,
+        max_disk_bytes = config_dict['page_raster_cache_disk_mb'] * 1024 * 1024
+    )
+    gazetteer = get_gazetteer(config_dict['gazetteer_path'])
+    geocoder = get_geocoder(
+        google_api_key = st.secrets['gcloud_api_key'],
+        cache_path = config_dict['geocode_cache_path'],
+        ttl = config_dict['geocode_cache_ttl_days'] * 24 * 3600,
+        offline = config_dict['offline_geocoding'],
+        gazetteer = gazetteer,
+    )
+    for provider in ('openai', 'anthropic', 'unstract', 'google'):
+        get_rate_limiter(provider, requests_per_minute = config_dict[f'{provider}_requests_per_minute'])
+    get_osd_pool(max_workers = config_dict['orientation_max_workers'])
     compliance_checkers = [
         ComplianceChecker(
             semaphore = compliance_semaphore,
@@ -580,57 +715,169 @@ def get_compliance_results(
             gcloud_api_key = st.secrets['gcloud_api_key'],
             openai_model = config_dict['openai_model'],
             claude_model = config_dict['claude_model'],
-            openai_files_cache_path = config_dict['openai_files_cache_path']
+            openai_files_cache_path = config_dict['openai_files_cache_path'],
+            wd_index_cache_dir = config_dict['wd_index_cache_dir'],
+            wd_retrieval_min_lines = config_dict['wd_retrieval_min_lines'],
+            openai_batch_wage_check_prompt = openai_batch_wage_check_prompt,
+            claude_batch_wage_check_prompt = claude_batch_wage_check_prompt,
+            max_batch_wage_checks = config_dict['max_batch_wage_checks'],
+            ocr_result_store = ocr_result_store,
+            locations_wait_for_ocr = config_dict['locations_wait_for_ocr'],
+            compliance_tables_wait_for_locations = config_dict['compliance_tables_wait_for_locations'],
+            location_memo = location_memo,
+            geocoder = geocoder,
+            gazetteer = gazetteer,
+            page_raster_cache = page_raster_cache,
+            run_store = run_store,
+            wd_citation_context_lines = config_dict['wd_citation_context_lines']
         )
-        for payroll_path in st.session_state['payroll_files_paths']
+        for payroll_path in payroll_files_paths
     ]
+    return compliance_checkers
+
+def submit_compliance_job(payrolls: dict[int, tuple[str, ComplianceChecker]]) -> str:
+    """Start checking payrolls (payroll index -> (file name, checker)) in the background, returning the job ID."""
+    completed = {}  # payroll index -> (compliance table result or exception, seconds from the start of the batch)
+    compliance_checkers = [checker for file_name, checker in payrolls.values()]
+
+    async def run_compliance_checker(payroll_ind: int, checker: ComplianceChecker, batch_start: float):
+        try:
+            result = await checker.get_payroll_compliance_table()
+        except Exception as e:
+            result = e
+        completed[payroll_ind] = (result, time.perf_counter() - batch_start)  # picked up by the progress fragment
+
+    async def run_compliance_checkers():
+        batch_start = time.perf_counter()
+        for checker in compliance_checkers:
+            checker.start_ocr()  # every payroll's OCR job is submitted before any checker starts waiting on one
+        await asyncio.gather(*[
+            run_compliance_checker(payroll_ind, checker, batch_start)
+            for payroll_ind, (file_name, checker) in payrolls.items()
+        ])
+    # runs on the persistent background loop, so pooled connections are reused across batches and sessions - and
+    # the script thread is free to rerun while it does
+    return get_job_runner().submit(
+        run_compliance_checkers(),
+        name = f'compliance check of {len(payrolls)} payroll(s)',
+        progress = lambda: {
+            'stage_statuses': {payroll_ind: checker.get_stage_statuses() for payroll_ind, (file_name, checker) in payrolls.items()},
+            'completed': dict(completed),
+        },
+        metadata = {'payrolls': payrolls}
+    )
 
-    tasks_results = asyncio.run(asyncio.gather(
-        *[checker.get_payroll_compliance_table() for checker in compliance_checkers],
-        return_exceptions = True
-    ))
-    compliance_results = []
-    failed_indices = []
-    for payroll_ind in range(len(st.session_state['payroll_files_paths'])):
-        file_name = payroll_files[payroll_ind].name
-        if isinstance(tasks_results[payroll_ind], Exception):
-            print(f'Error processing "{file_name}": \n{type(tasks_results[payroll_ind])}:{tasks_results[payroll_ind]}')
-            compliance_results.append(
-                {
-                    'file_name': file_name,
-                    'compliance_checker': compliance_checkers[payroll_ind],
-                    'exception': tasks_results[payroll_ind],
-                }
-            )
-            failed_indices.append(payroll_ind)
+def get_compliance_result(file_name: str, compliance_checker: ComplianceChecker, task_result, completion_time: float):
+    """Get the compliance result for one payroll of a compliance check job, and whether it failed."""
+    if isinstance(task_result, BaseException):
+        print(f'Error processing "{file_name}": \n{type(task_result)}:{task_result}')
+        return {
+            'file_name': file_name,
+            'compliance_checker': compliance_checker,
+            'exception': task_result,
+            'completion_time': completion_time,
+        }, True
+    compliance_table, disputed_wage_checks, unmatched_openai, unmatched_claude = task_result
+    if compliance_table is None:
+        return {
+            'file_name': file_name,
+            'exception': ValueError('Compliance table is None'),
+            'completion_time': completion_time,
+        }, True
+    compliance_table = fix_table_checks(compliance_table)
+    return {
+        'file_name': file_name,
+        'compliance_checker': compliance_checker,
+        'compliance_table': compliance_table,
+        'disputed_wage_checks': disputed_wage_checks,
+        'unmatched_openai': unmatched_openai,
+        'unmatched_claude': unmatched_claude,
+        'completion_time': completion_time,
+    }, False
+
+def collect_compliance_results(job: Job) -> int:
+    """Move payrolls the job has finished into st.session_state['compliance_results'] (in file order, with None for
+    payrolls still in flight), and start prefetching their citations. Returns how many were new."""
+    payrolls = job.metadata['payrolls']
+    n_new = 0
+    for payroll_ind, (task_result, completion_time) in job.progress()['completed'].items():
+        if st.session_state['compliance_results'][payroll_ind] is not None:
+            continue
+        file_name, compliance_checker = payrolls[payroll_ind]
+        compliance_result, failed = get_compliance_result(file_name, compliance_checker, task_result, completion_time)
+        st.session_state['compliance_results'][payroll_ind] = compliance_result
+        if failed:
+            st.session_state['failed_indices'].append(payroll_ind)
         else:
-            compliance_table, disputed_wage_checks, unmatched_openai, unmatched_claude = tasks_results[payroll_ind]
-            if compliance_table is None:
-                compliance_results.append(
-                    {
-                        'file_name': file_name,
-                        'exception': ValueError('Compliance table is None')
-                    }
-                )
-                failed_indices.append(payroll_ind)
-            else:
-                compliance_table = fix_table_checks(compliance_table)
-                compliance_results.append(
-                    {
-                        'file_name': file_name,
-                        'compliance_checker': compliance_checkers[payroll_ind],
-                        'compliance_table': compliance_table,
-                        'disputed_wage_checks': disputed_wage_checks,
-                        'unmatched_openai': unmatched_openai,
-                        'unmatched_claude': unmatched_claude,
-                    }
-                )
-    return compliance_results, failed_indices
+            prefetch_payroll_citations(st.session_state['citation_prefetcher'], compliance_result)
+        n_new += 1
+    return n_new
+
+def fail_unfinished_payrolls(exception: Exception):
+    """Mark payrolls that never finished (e.g. because the job was cancelled) as failed."""
+    for payroll_ind, compliance_result in enumerate(st.session_state['compliance_results']):
+        if compliance_result is None:
+            st.session_state['compliance_results'][payroll_ind] = {
+                'file_name': st.session_state['payroll_file_names'][payroll_ind],
+                'exception': exception,
+                'completion_time': None,
+            }
+            st.session_state['failed_indices'].append(payroll_ind)
+
+STAGE_LABELS = {
+    'ocr': 'OCR',
+    'locations': 'Locations',
+    'openai_compliance_table': 'OpenAI table',
+    'claude_compliance_table': 'Claude table',
+    'combine': 'Disputes',
+}
+STAGE_STATUS_SYMBOLS = {'pending': '⏳', 'running': '🔄', 'done': '✅', 'failed': '❌'}
+
+@st.fragment(run_every = 1)
+def show_compliance_job_progress():
+    """Poll the session's compliance check job, showing per-payroll stage progress. The app reruns as each payroll
+    finishes, so finished payrolls are shown while the rest are still being checked."""
+    job_runner = get_job_runner()
+    job_id = st.session_state['compliance_job_id']
+    job = job_runner.get(job_id)
+    if job is None:
+        del st.session_state['compliance_job_id']
+        fail_unfinished_payrolls(RuntimeError('The compliance check is no longer available - please upload the files again.'))
+        st.rerun(scope = 'app')
+    n_new = collect_compliance_results(job)
+    if job.done:
+        job_runner.pop(job_id)
+        del st.session_state['compliance_job_id']
+        if job.status == 'done':
+            print(f'Compliance check finished in {job.elapsed:.1f}s')
+        elif job.status == 'failed':
+            fail_unfinished_payrolls(job.future.exception())
+        else:
+            fail_unfinished_payrolls(RuntimeError('Compliance check cancelled.'))
+        st.rerun(scope = 'app')
+    if n_new:
+        st.rerun(scope = 'app')
+
+    n_finished = sum(compliance_result is not None for compliance_result in st.session_state['compliance_results'])
+    st.info(f'Checking compliance ({job.elapsed:.0f}s, {n_finished}/{len(st.session_state["compliance_results"])} payrolls done) - finished payrolls are shown below as they come in.')
+    progress_rows = []
+    for payroll_ind, stage_statuses in job.progress()['stage_statuses'].items():
+        if st.session_state['compliance_results'][payroll_ind] is not None:
+            continue
+        progress_row = {'Payroll': st.session_state['payroll_file_names'][payroll_ind]}
+        for stage_name, label in STAGE_LABELS.items():
+            progress_row[label] = STAGE_STATUS_SYMBOLS[stage_statuses.get(stage_name, 'pending')]
+        progress_rows.append(progress_row)
+    st.dataframe(DataFrame(progress_rows), hide_index = True)
+    if st.button('Cancel'):
+        job_runner.cancel(job_id)
 
 if 'citation_prompt' not in st.session_state:
     config_dict = load_config()
     with open(config_dict['citation_prompt_path'], 'r', encoding='utf-8') as f:
         st.session_state['citation_prompt'] = f.read()
+    # loaded (or warned about) once per process, at startup rather than in the first batch
+    get_gazetteer(config_dict['gazetteer_path'])
 
 # <editor-fold> CSS for page styling
 gray_background_css = '''
@@ -710,11 +957,11 @@ if 'compliance_results' not in st.session_state:
 
     if st.button('Check Payroll Compliance'):
         if payroll_files and db_wages_file:
-            st.write('Do not interact with the app until processing is complete.')
-            with st.spinner('Checking compliance (may take several minutes)...', show_time=True):
-                st.session_state['compliance_results'], st.session_state['failed_indices'] = get_compliance_results(payroll_files, db_wages_file)
-                # st.session_state['compliance_results'] is a list of dicts with keys:
-                # 'file_name', 'compliance_checker', 'compliance_table', 'disputed_wage_checks', 'unmatched_openai', 'unmatched_claude'
+            st.session_state['compliance_job_id'] = start_compliance_job(payroll_files, db_wages_file)
+            st.session_state['payroll_file_names'] = [payroll_file.name for payroll_file in payroll_files]
+            st.session_state['compliance_results'] = [None] * len(payroll_files)  # filled in as each payroll finishes
+            st.session_state['failed_indices'] = []
+            st.session_state['citation_prefetcher'] = create_citation_prefetcher()
             st.rerun()
         else:
             st.error('Please upload both payroll files and the Davis-Bacon wages file.')
@@ -1,7 +1,7 @@
 import agents
 import anthropic
 from agents import *
-from typing import Optional
+from typing import Awaitable, Callable, Literal, Optional
 from PIL import Image
 import pytesseract
 import io
@@ -10,25 +10,39 @@ from pypdf import PdfReader, PdfWriter
 import pypdfium2 as pdfium
 from openai import AsyncOpenAI
 import json
+import math
 import asyncio
 from pydantic import BaseModel
-from rapidfuzz import fuzz
-from rapidfuzz.utils import default_process as rapidfuzz_default_process
 import tomli
-import base64
-import googlemaps
+import hashlib
 import fitz
-import geopy.distance
 from unstract.llmwhisperer import LLMWhispererClientV2
 
-from GlobalUtils.ocr import async_whisper_pdf_text_extraction
+from GlobalUtils.ocr import cached_async_whisper_pdf_text_extraction
+from GlobalUtils.gazetteer import Gazetteer, haversine_miles
+from GlobalUtils.geocoding import Geocoder, get_geocoder
+from GlobalUtils.ocr_cache import OCRResultStore
+from GlobalUtils.orientation import get_page_rotations
+from GlobalUtils.page_raster_cache import PageRasterCache
+from GlobalUtils.stage_graph import Stage, StageGraph
+from GlobalUtils.run_store import RunStore, get_run_key
+from GlobalUtils.document import Document, get_document
+from GlobalUtils.clients import get_openai_client, get_anthropic_client
+from GlobalUtils.rate_limiting import RateLimitedModelProvider, get_rate_limiter
 from GlobalUtils.openai_uploading import get_or_upload_async
 from GlobalUtils.citation import (
     find_best_openai_lines,
+    prepare_line_highlights,
     render_line_highlights,
-    render_pdf_line_metadatas_to_images
+    render_pdf_line_metadatas_to_images,
+    render_pdf_page_with_highlights
 )
+from concordance import match_wage_checks
+from location_memo import LocationMemo, LocationResult, detect_project_identifier
 from pydeck_rendering import make_project_arc_deck, StoredLocation
+from wd_index import WageDeterminationIndex, get_wage_determination_index
+from wd_rates import WageRateTable, RateCheckResult, get_wage_rate_table
+from wd_retrieval import get_relevant_wd_text
 
 
 class EmployeeWageCheck(BaseModel):
@@ -67,6 +81,14 @@ def report_wage_check(wage_check: EmployeeWageCheck):
     """Report an employee wage check."""
     return wage_check
 
+class EmployeeWageChecksList(BaseModel):
+    wage_checks: list[EmployeeWageCheck]
+
+@function_tool
+def report_wage_checks(wage_checks: EmployeeWageChecksList):
+    """Report the wage checks for a list of employees."""
+    return wage_checks
+
 @function_tool
 def report_parsing_error(error_message: str):
     """Report an error in parsing the compliance table."""
@@ -103,36 +125,136 @@ def report_locations(locations: LocationsList):
     """Report the project location."""
     return 'Successfully reported locations list.'
 
-def get_lines_page_numbers(lines: list[int], page_lengths: list[int]) -> dict[int, list[int]]:
-    """Get the pages corresponding to the given line numbers.
-
-    Returns a dict mapping page # to the lines to highlight on that page."""
-    lines = sorted(lines)
-    pages = dict()
-    lines_ind = 0
-    cumulative_lines = 0
-    for page_index, page_length in enumerate(page_lengths):
-        while lines_ind < len(lines):
-            if lines[lines_ind] < cumulative_lines + page_length:
-                if page_index not in pages:
-                    pages[page_index] = []
-                pages[page_index].append(lines[lines_ind]-cumulative_lines)
-                lines_ind += 1
-            else:
-                break
-        cumulative_lines += page_length
-    return pages
-
-
-def create_search_location_tool(google_api_key: str):
-    google_maps_client = googlemaps.Client(key=google_api_key)
+def create_search_location_tool(geocoder: Geocoder):
     @function_tool
-    def search_location(location_query: str):
+    async def search_location(location_query: str):
         '''Search for a location using the Google Maps Geocoding API.'''
-        geocode_result = google_maps_client.geocode(location_query)
+        geocode_result = await geocoder.geocode(location_query)
         return json.dumps(geocode_result)
     return search_location
 
+def create_nearby_places_tool(gazetteer: Gazetteer):
+    @function_tool
+    def find_nearby_places(latitude: float, longitude: float, kind: Literal['county', 'place'] = 'place', count: int = 5):
+        '''Find the US counties or places (cities, towns) nearest a point, with their distances in miles. Answered
+        locally - prefer this to searching for places near a known point.'''
+        return json.dumps(gazetteer.nearest(latitude, longitude, k=min(count, 25), kind=kind))
+    return find_nearby_places
+
+def get_prompt_cache_key(*parts: str) -> str:
+    """Get an OpenAI prompt_cache_key for requests sharing a prefix - requests with the same key are routed together,
+    so they're more likely to hit the cached prefix."""
+    return 'db-' + hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+def get_claude_usage_record(call_name: str, usage) -> dict:
+    """Get a token usage record (including prompt cache hits) for a Claude response."""
+    return {
+        'call': call_name,
+        'provider': 'anthropic',
+        'input_tokens': usage.input_tokens + (usage.cache_read_input_tokens or 0) + (usage.cache_creation_input_tokens or 0),
+        'cached_input_tokens': usage.cache_read_input_tokens or 0,
+        'cache_write_tokens': usage.cache_creation_input_tokens or 0,
+        'output_tokens': usage.output_tokens,
+    }
+
+def get_openai_usage_record(call_name: str, run_result) -> dict:
+    """Get a token usage record (including prompt cache hits) for an agents run."""
+    usage = run_result.context_wrapper.usage
+    return {
+        'call': call_name,
+        'provider': 'openai',
+        'input_tokens': usage.input_tokens,
+        'cached_input_tokens': usage.input_tokens_details.cached_tokens or 0,
+        'cache_write_tokens': 0,
+        'output_tokens': usage.output_tokens,
+    }
+
+def get_tool_output(run_result, tool_name: str):
+    """Get the output of the first call to `tool_name` in an agents run, or None if it wasn't called."""
+    for i, item in enumerate(run_result.new_items):
+        if (
+                i > 0 and
+                isinstance(item, agents.items.ToolCallOutputItem) and
+                isinstance(run_result.new_items[i - 1], agents.items.ToolCallItem) and
+                run_result.new_items[i - 1].raw_item.name == tool_name
+        ):
+            return item.output
+    return None
+
+def dump_combined_result(combined_result: tuple) -> list:
+    """Serialize combine_compliance_tables' (compliance table, disputed pairs, unmatched OpenAI, unmatched Claude)."""
+    compliance_table, disputed_wage_checks, unmatched_openai, unmatched_claude = combined_result
+    return [
+        compliance_table.model_dump(mode='json') if compliance_table is not None else None,
+        [[openai_wc.model_dump(mode='json'), claude_wc.model_dump(mode='json')] for openai_wc, claude_wc in disputed_wage_checks] if disputed_wage_checks is not None else None,
+        [wage_check.model_dump(mode='json') for wage_check in unmatched_openai] if unmatched_openai is not None else None,
+        [wage_check.model_dump(mode='json') for wage_check in unmatched_claude] if unmatched_claude is not None else None,
+    ]
+
+def load_combined_result(output: list) -> tuple:
+    compliance_table, disputed_wage_checks, unmatched_openai, unmatched_claude = output
+    return (
+        ComplianceTable.model_validate(compliance_table) if compliance_table is not None else None,
+        [(EmployeeWageCheck.model_validate(openai_wc), EmployeeWageCheck.model_validate(claude_wc)) for openai_wc, claude_wc in disputed_wage_checks] if disputed_wage_checks is not None else None,
+        [EmployeeWageCheck.model_validate(wage_check) for wage_check in unmatched_openai] if unmatched_openai is not None else None,
+        [EmployeeWageCheck.model_validate(wage_check) for wage_check in unmatched_claude] if unmatched_claude is not None else None,
+    )
+
+def parse_claude_wage_check(wage_check: dict) -> EmployeeWageCheck:
+    """Build an EmployeeWageCheck from a wage check object in a Claude JSON response."""
+    return EmployeeWageCheck(
+        employee_name=wage_check['employee_name'],
+        identification_number=wage_check['identification_number'],
+        payroll_title=wage_check['payroll_title'],
+        davis_bacon_classification=wage_check['davis_bacon_classification'],
+        davis_bacon_base_rate=wage_check['davis_bacon_base_rate'],
+        davis_bacon_fringe_rate=wage_check['davis_bacon_fringe_rate'],
+        davis_bacon_total_rate=wage_check['davis_bacon_total_rate'],
+        overtime_rate=wage_check.get('overtime_rate'),
+        paid_rate=wage_check['paid_rate'],
+        compliance_reasoning=wage_check['compliance_reasoning'],
+        compliance=wage_check['compliance'],
+        payroll_citation_lines=wage_check['payroll_citation_lines'],
+        wage_determination_citation_lines=wage_check['wage_determination_citation_lines'],
+    )
+
+def combine_wage_rechecks(
+        openai_check: Optional[EmployeeWageCheck],
+        claude_check: Optional[EmployeeWageCheck]
+) -> Optional[EmployeeWageCheck]:
+    """Combine the OpenAI and Claude re-checks of a disputed employee - None if they still disagree."""
+    if openai_check is None and claude_check is None:
+        return None
+    elif openai_check is None:
+        return claude_check
+    elif claude_check is None:
+        return openai_check
+    elif abs(openai_check.davis_bacon_total_rate - claude_check.davis_bacon_total_rate) > 0.1:
+        return None
+    elif abs(openai_check.paid_rate - claude_check.paid_rate) > 0.1:
+        return None
+    else:  # why do we throw away everything else? because its harder to match those strings. there may be idiosyncrasies in naming conventions
+        return claude_check  # prefer claude
+
+def match_batch_wage_checks(
+        requested: list[EmployeeWageCheck],
+        returned: list[EmployeeWageCheck],
+        name_match_threshold: float = 80.
+) -> list[Optional[EmployeeWageCheck]]:
+    """Match the wage checks returned by a batched re-check to the employees requested. Returns one entry per
+    requested employee - None where the batch omitted them."""
+    matches = [None] * len(requested)
+    for requested_ind, returned_ind in match_wage_checks(requested, returned, name_match_threshold=name_match_threshold).pairs:
+        matches[requested_ind] = returned[returned_ind]
+    return matches
+
+def get_batch_employees_text(wage_checks: list[EmployeeWageCheck]) -> str:
+    """List the employees for a batched re-check, as reported by an earlier check."""
+    return 'Please extract the payroll information for the following employees:\n' + '\n'.join(
+        f'{i + 1}. Name: {wage_check.employee_name}; identification number: {wage_check.identification_number or "(none)"}; title: {wage_check.payroll_title}'
+        for i, wage_check in enumerate(wage_checks)
+    )
+
 
 class ComplianceChecker:
     def __init__(
@@ -146,36 +268,77 @@ class ComplianceChecker:
             openai_api_key: str, anthropic_api_key: str, unstract_api_key: str, gcloud_api_key: str,
             openai_model: str, claude_model: str,
             openai_files_cache_path: str,
-            claude_wait_time:int = 30,
-            max_claude_waits: int = 4
+            wd_index_cache_dir: Optional[str] = None,
+            wd_retrieval_min_lines: Optional[int] = None,
+            openai_batch_wage_check_prompt: Optional[str] = None,
+            claude_batch_wage_check_prompt: Optional[str] = None,
+            max_batch_wage_checks: int = 20,
+            ocr_result_store: Optional[OCRResultStore] = None,
+            locations_wait_for_ocr: bool = False,
+            compliance_tables_wait_for_locations: bool = True,
+            location_memo: Optional[LocationMemo] = None,
+            geocoder: Optional[Geocoder] = None,
+            gazetteer: Optional[Gazetteer] = None,
+            page_raster_cache: Optional[PageRasterCache] = None,
+            run_store: Optional[RunStore] = None,
+            wd_citation_context_lines: Optional[int] = None
     ):
-        self.openai_client = AsyncOpenAI(api_key=openai_api_key)
-        set_default_openai_key(openai_api_key)
-        self.anthropic_client = AsyncAnthropic(api_key=anthropic_api_key)
-        self.claude_wait_time = claude_wait_time
-        self.max_claude_waits = max_claude_waits
-
+        # shared, pooled clients - run the checker on the clients' background loop (GlobalUtils.clients.run_async)
+        self.openai_client = get_openai_client(openai_api_key)
+        set_default_openai_client(self.openai_client)
+        self.anthropic_client = get_anthropic_client(anthropic_api_key)
+        # process-wide, so concurrent checkers pace and back off together
+        self.openai_limiter = get_rate_limiter('openai')
+        self.anthropic_limiter = get_rate_limiter('anthropic')
+        # the semaphore bounds model requests in flight - it's taken per request, after any rate limit wait
         self._sem = semaphore
+        self.openai_run_config = RunConfig(model_provider=RateLimitedModelProvider(self.openai_client, self.openai_limiter, slot=self._sem))
 
         self.db_wages_file_path = db_wages_file_path
         self.payroll_file_path = payroll_file_path
+        # read, hashed and encoded once, and shared with every other checker using the same files
+        self.db_wages_document = get_document(db_wages_file_path)
+        self.payroll_document = get_document(payroll_file_path)
 
         self.openai_compliance_matrix_prompt = openai_compliance_matrix_prompt
         self.openai_single_wage_check_prompt = openai_single_wage_check_prompt
         self.claude_compliance_matrix_prompt = claude_compliance_matrix_prompt
         self.claude_single_wage_check_prompt = claude_single_wage_check_prompt
+        # disputed employees are re-checked in one request per provider if both batch prompts are given
+        self.openai_batch_wage_check_prompt = openai_batch_wage_check_prompt
+        self.claude_batch_wage_check_prompt = claude_batch_wage_check_prompt
+        self.max_batch_wage_checks = max_batch_wage_checks
         self.relevant_locations_prompt = relevant_locations_prompt
 
         self.gcloud_api_key = gcloud_api_key
+        # uncached Google geocoding unless a (cached, or offline) geocoder is given
+        self.geocoder = geocoder if geocoder is not None else get_geocoder(gcloud_api_key)
+        self.gazetteer = gazetteer
+        self.page_raster_cache = page_raster_cache
+        # lines of context drawn around cited WD lines that have no position on the original page (None = whole page)
+        self.wd_citation_context_lines = wd_citation_context_lines
         self.unstract_api_key = unstract_api_key
 
         self.openai_model = openai_model
         self.claude_model = claude_model
 
         self.openai_files_cache_path = openai_files_cache_path
+        self.wd_index_cache_dir = wd_index_cache_dir
+        self.wd_retrieval_min_lines = wd_retrieval_min_lines
+        self.db_wages_index = None
+        self.ocr_result_store = ocr_result_store
 
         self.payroll_unstract_json = None
         self.payroll_ocr_str = None
+        self._ocr_task = None
+        self.locations_wait_for_ocr = locations_wait_for_ocr
+        self.compliance_tables_wait_for_locations = compliance_tables_wait_for_locations
+        self._compliance_table_had_locations = {}  # compliance table stage -> whether it ran with the project location
+        self.location_memo = location_memo
+        self.stage_timings = {}  # stage name -> StageTiming, from the last get_payroll_compliance_table run
+        self.stage_graph = None  # the running (or last run) pipeline, for progress reporting
+        self.run_store = run_store  # stage checkpoints, so a failed or interrupted run resumes where it stopped
+        self._run_key = None
         self.openai_compliance_table = None
 
         self.project_location_str = None
@@ -183,35 +346,111 @@ class ComplianceChecker:
         self.relevant_locations = None
         self.relevant_locations_str = None
 
-    async def ocr_payroll(self):
-        async with self._sem:
-            self.payroll_unstract_json = await async_whisper_pdf_text_extraction(
+        self.token_usage = []  # one record per model call, see get_claude_usage_record/get_openai_usage_record
+
+    def record_usage(self, usage_record: dict):
+        self.token_usage.append(usage_record)
+        print(f'{usage_record["call"]} ({usage_record["provider"]}): {usage_record["input_tokens"]} input tokens, {usage_record["cached_input_tokens"]} from prompt cache, {usage_record["cache_write_tokens"]} written to cache')
+
+    async def upload_documents(self, *documents: Document) -> list[str]:
+        """Get the OpenAI file IDs of documents, uploading them if they aren't cached."""
+        digests = await asyncio.gather(*[asyncio.to_thread(document.get_digest) for document in documents])
+        return await asyncio.gather(*[
+            get_or_upload_async(
+                file_path=document.path,
+                client=self.openai_client,
+                cache_path=self.openai_files_cache_path,
+                purpose='user_data',
+                digest=digest
+            )
+            for document, digest in zip(documents, digests)
+        ])
+
+    async def get_document_base64(self, document: Document) -> str:
+        return await asyncio.to_thread(getattr, document, 'base64')
+
+    def start_ocr(self) -> asyncio.Task:
+        """Submit the payroll for OCR now, without waiting for it - call this for every checker in a batch up front, so
+        all the Whisper jobs run while earlier checkers are still working. Must be called from the running loop."""
+        if self._ocr_task is None:
+            # not held under the semaphore - a submitted job only costs its (shared, backed-off) status polls
+            self._ocr_task = asyncio.create_task(cached_async_whisper_pdf_text_extraction(
                 unstract_api_key = self.unstract_api_key,
                 input_pdf_path = self.payroll_file_path,
+                result_store = self.ocr_result_store,
+                document = self.payroll_document,
                 return_json = True,
                 add_line_nos = True,
-            )
+            ))
+        return self._ocr_task
+
+    async def ocr_payroll(self):
+        self.payroll_unstract_json = await self.start_ocr()
         self.payroll_ocr_str = self.payroll_unstract_json['result_text']
         return self.payroll_unstract_json
 
-    async def get_relevant_locations(self):
-        upload_coroutines = [
-            get_or_upload_async(
-                file_path=path,
-                client=self.openai_client,
-                cache_path=self.openai_files_cache_path,
-                purpose='user_data'
+    async def get_project_identifier(self) -> Optional[str]:
+        """Detect the payroll's project/contract number - from the OCR text if it's ready, otherwise from the PDF's own
+        text layer, waiting for the OCR text if the text layer doesn't have one (e.g. scanned payrolls)."""
+        if self.payroll_ocr_str is not None:
+            return detect_project_identifier(self.payroll_ocr_str)
+
+        def get_text_layer():
+            with self.payroll_document.lock:
+                return '\n'.join(page.get_text() for page in self.payroll_document.fitz_doc)
+        project_identifier = detect_project_identifier(await asyncio.to_thread(get_text_layer))
+        if project_identifier is None:
+            await self.ocr_payroll()  # shares the OCR stage's job
+            project_identifier = detect_project_identifier(self.payroll_ocr_str)
+        return project_identifier
+
+    def get_location_agent_version(self) -> str:
+        return hashlib.sha256(json.dumps([self.relevant_locations_prompt, self.openai_model]).encode('utf-8')).hexdigest()
+
+    async def get_relevant_locations(self) -> LocationResult:
+        """Find the project location and the distances to relevant locations. Payrolls for the same project (same WD
+        and project/contract number) share one location agent run via the location memo - for payrolls without a text
+        layer, that means waiting for the OCR text to find the project number."""
+        project_identifier = None
+        if self.location_memo is not None:
+            project_identifier = await self.get_project_identifier()
+        if project_identifier is None:
+            location_result = await self.run_location_agent()
+        else:
+            wd_digest = await asyncio.to_thread(self.db_wages_document.get_digest)
+            location_result = await self.location_memo.get_or_compute(
+                wd_digest,
+                project_identifier,
+                self.get_location_agent_version(),
+                self.run_location_agent
             )
-            for path in [self.payroll_file_path, self.db_wages_file_path]
-        ]
+        self.set_location_result(location_result)
+        return location_result
+
+    def set_location_result(self, location_result: LocationResult):
+        self.project_location_str = location_result.project_location_name
+        self.project_location = Location(
+            name=location_result.project_location_name,
+            latitude=location_result.project_latitude,
+            longitude=location_result.project_longitude,
+        )
+        self.relevant_locations = list(location_result.relevant_locations)
+        if len(self.relevant_locations) > 0:
+            self.relevant_locations_str = 'Here are the distances from the project location to relevant locations:\n'
+            for relevant_location in self.relevant_locations:
+                self.relevant_locations_str += f'\n- "{relevant_location.name}": {relevant_location.project_distance:.2f} miles\n'
+
+    async def run_location_agent(self) -> LocationResult:
         async with self._sem:
-            payroll_file_id, db_wages_file_id = await asyncio.gather(*upload_coroutines)
+            payroll_file_id, db_wages_file_id = await self.upload_documents(self.payroll_document, self.db_wages_document)
 
-        search_location = create_search_location_tool(self.gcloud_api_key)
+        location_tools = [create_search_location_tool(self.geocoder)]
+        if self.gazetteer is not None:
+            location_tools.append(create_nearby_places_tool(self.gazetteer))
         location_agent = Agent(
             name="Relevant Locations Extraction Agent",
             instructions=self.relevant_locations_prompt,
-            tools=[search_location, report_project_location, report_employee_classifications, report_locations],
+            tools=location_tools + [report_project_location, report_employee_classifications, report_locations],
             model=self.openai_model,
             tool_use_behavior={'stop_at_tool_names': [report_locations.name]}
         )
@@ -237,43 +476,41 @@ class ComplianceChecker:
                 'text': 'The following text was extracted from the payroll file via OCR. Use it to cross-reference with the payroll file:\n' + self.payroll_ocr_str
             })
 
-        async with self._sem:
-            with trace('Project Relevant Locations Extraction Workflow'):
-                location_result = await Runner.run(
-                    location_agent,
-                    input=location_input
-                )
+        with trace('Project Relevant Locations Extraction Workflow'):
+            location_result = await self.run_openai_agent(location_agent, location_input)
 
+        project_location = None
+        locations_list_arg = []
         for item in location_result.new_items:
             if (isinstance(item, agents.items.ToolCallItem)):
                 if item.raw_item.name == report_project_location.name:
-                    project_location_arg = json.loads(item.raw_item.arguments)['location']
-                    self.project_location_str = project_location_arg['name']
-                    self.project_location = Location(
-                        name=project_location_arg['name'],
-                        latitude = project_location_arg['latitude'],
-                        longitude = project_location_arg['longitude'],
-                    )
+                    project_location = Location(**json.loads(item.raw_item.arguments)['location'])
                 elif item.raw_item.name == report_locations.name:
                     locations_list_arg = json.loads(item.raw_item.arguments)['locations']['locations']
-                    self.relevant_locations = []
-                    for loc in locations_list_arg:
-                        distance_to_project = geopy.distance.distance(
-                            (self.project_location.latitude, self.project_location.longitude),
-                            (loc['latitude'],loc['longitude'])
-                        ).miles
-                        self.relevant_locations.append(
-                            StoredLocation(
-                                name=loc['name'],
-                                latitude=loc['latitude'],
-                                longitude=loc['longitude'],
-                                project_distance=distance_to_project
-                            )
-                        )
-        if len(self.relevant_locations) > 0:
-            self.relevant_locations_str = 'Here are the distances from the project location to relevant locations:\n'
-            for relevant_location in self.relevant_locations:
-                self.relevant_locations_str += f'\n- "{relevant_location.name}": {relevant_location.project_distance:.2f} miles\n'
+        if project_location is None:
+            raise ValueError('The location agent did not report a project location.')
+        # all the distances to the project at once
+        distances_to_project = haversine_miles(
+            float(project_location.latitude),
+            float(project_location.longitude),
+            [float(loc['latitude']) for loc in locations_list_arg],
+            [float(loc['longitude']) for loc in locations_list_arg]
+        )
+        relevant_locations = [
+            StoredLocation(
+                name=loc['name'],
+                latitude=loc['latitude'],
+                longitude=loc['longitude'],
+                project_distance=distance_to_project
+            )
+            for loc, distance_to_project in zip(locations_list_arg, distances_to_project)
+        ]
+        return LocationResult(
+            project_location_name=project_location.name,
+            project_latitude=project_location.latitude,
+            project_longitude=project_location.longitude,
+            relevant_locations=relevant_locations
+        )
 
 
     def get_relevant_locations_pydeck(
@@ -300,27 +537,74 @@ class ComplianceChecker:
             initial_zoom=8,
         )
 
+    def get_db_wages_index(self) -> WageDeterminationIndex:
+        """Get the (process-wide, shared) text index of the wage determination file."""
+        if self.db_wages_index is None:
+            self.db_wages_index = get_wage_determination_index(
+                self.db_wages_file_path,
+                cache_dir=self.wd_index_cache_dir,
+                digest=self.db_wages_document.get_digest()
+            )
+        return self.db_wages_index
+
+    def get_db_wages_rate_table(self) -> WageRateTable:
+        """Get the rate table parsed from the wage determination file."""
+        return get_wage_rate_table(self.get_db_wages_index())
+
+    def check_wage_check_rates(self, wage_checks: list[EmployeeWageCheck]) -> RateCheckResult:
+        """Check reported Davis-Bacon base/fringe rates against the rate table parsed from the wage determination.
+
+        Wage checks whose rates don't match get a note in their compliance reasoning, and the WD rate line added to
+        their citations, so reviewers see the mismatch."""
+        rate_table = self.get_db_wages_rate_table()
+        rate_check = rate_table.check_wage_checks(wage_checks)
+        for wage_check, ok, row, expected_base, expected_fringe in zip(wage_checks, rate_check.ok, rate_check.rows, rate_check.expected_base_rates, rate_check.expected_fringe_rates):
+            if ok:
+                continue
+            expected_fringe_str = f'${expected_fringe:.2f}' if not math.isnan(expected_fringe) else rate_table.fringe_text[row]
+            print(f'Rates reported for {wage_check.employee_name} ("{wage_check.davis_bacon_classification}": ${wage_check.davis_bacon_base_rate:.2f} + ${wage_check.davis_bacon_fringe_rate:.2f}) do not match the wage determination (${expected_base:.2f} + {expected_fringe_str})')
+            wage_check.compliance_reasoning += (
+                f' [Rate check: the wage determination lists ${expected_base:.2f} base + {expected_fringe_str} fringe for'
+                f' "{rate_table.classification[row]}", not the reported ${wage_check.davis_bacon_base_rate:.2f} +'
+                f' ${wage_check.davis_bacon_fringe_rate:.2f}.]'
+            )
+            rate_line = hex(int(rate_table.line_number[row]))
+            if rate_line not in wage_check.wage_determination_citation_lines:
+                wage_check.wage_determination_citation_lines.append(rate_line)
+        return rate_check
+
     def get_db_wages_file_text(self, include_line_nos: bool = True, return_page_lengths: bool = False):
-        page_lengths = []
-        db_wages_doc = fitz.open(self.db_wages_file_path)
-        db_wages_file_text = ''
-        line_no = 0
-        page_start_line_no = 0
-        for page in db_wages_doc:
-            page_text = page.get_text(sort=True).strip()
-            for line in page_text.splitlines():
-                if include_line_nos:
-                    db_wages_file_text += f'{hex(line_no)}:{line}'+'\n'
-                else:
-                    db_wages_file_text += line + '\n'
-                line_no += 1
-            page_lengths.append(line_no - page_start_line_no)
-            page_start_line_no = line_no
-        db_wages_doc.close()
+        db_wages_index = self.get_db_wages_index()
+        db_wages_file_text = db_wages_index.numbered_text if include_line_nos else db_wages_index.text
         if return_page_lengths:
-            return db_wages_file_text, page_lengths
+            return db_wages_file_text, db_wages_index.page_lengths
         return db_wages_file_text
 
+    def prepare_db_wages_citations(self):
+        """Lay out the text of the WD pages that citations may have to fall back to rendering (those with lines missing
+        a bbox), so the first click on one of them only has to draw."""
+        db_wages_index = self.get_db_wages_index()
+        for page in range(db_wages_index.page_count):
+            if any(bbox is None and line.strip() for line, bbox in zip(db_wages_index.page_lines[page], db_wages_index.line_bboxes[page])):
+                prepare_line_highlights(db_wages_index.page_text(page))
+
+    async def get_db_wages_prompt_text(self) -> str:
+        """Get the hex-numbered wage determination text for the compliance table prompts.
+
+        If retrieval is enabled (wd_retrieval_min_lines is set) and the payroll has been OCR'd, large WDs are cut down
+        to the classification sections matching the payroll. Lines keep their original hex numbers."""
+        db_wages_index = await asyncio.to_thread(self.get_db_wages_index)
+        if self.wd_retrieval_min_lines is not None:
+            relevant_text = get_relevant_wd_text(
+                wd_index=db_wages_index,
+                rate_table=self.get_db_wages_rate_table(),
+                payroll_text=self.payroll_ocr_str,
+                min_lines=self.wd_retrieval_min_lines
+            )
+            if relevant_text is not None:
+                return 'Here are the sections of the Davis-Bacon wage determination file relevant to this payroll, with their original hex line numbers (omitted lines are marked "[...]"):\n' + relevant_text
+        return 'Here is the Davis-Bacon wage determination file, with hex line numbers:\n' + db_wages_index.numbered_text
+
     def get_payroll_citation_images_from_line_hexes(self, citation_line_hexes: list[str]):
         """Get citation images from line hex identifiers using the payroll OCR data."""
         citation_lines = [int(hex, 16)-1 for hex in citation_line_hexes] # the -1 is because unstract hex lines are 1-indexed
@@ -328,49 +612,64 @@ class ComplianceChecker:
 
         citation_images, citation_pages = render_pdf_line_metadatas_to_images(
             whisper_line_metadatas = whisper_line_metadatas,
-            pdf_source=self.payroll_file_path,
-            detect_rotation = True
+            pdf_source=self.payroll_document,
+            detect_rotation = True,
+            raster_cache = self.page_raster_cache
         )
         return citation_images, citation_pages
 
     def get_db_wages_citation_images_from_line_hexes(self, citation_line_hexes: list[str]):
-        """Get citation images from the Davis-Bacon wages file based on a citation query."""
-        # Get the text using the helper (without line numbers)
+        """Get citation images from the Davis-Bacon wages file, highlighting the cited lines on the original pages.
+
+        Line positions come from the bboxes recorded when the WD was indexed, and pages are drawn from the page raster
+        cache - nothing is re-extracted per click. Pages where none of the cited lines have a bbox fall back to a
+        rendering of the page's text."""
         citation_lines = [int(hex, 16) for hex in citation_line_hexes]  # convert hex to int
-        db_wages_file_text, page_lengths = self.get_db_wages_file_text(include_line_nos=False, return_page_lengths= True)
+        db_wages_index = self.get_db_wages_index()
 
-        citation_pages_dict = get_lines_page_numbers(citation_lines, page_lengths)
+        citation_pages_dict = db_wages_index.lines_page_numbers(citation_lines)
 
         citation_pages = []
         citation_images = []
-        db_wages_doc = fitz.open(self.db_wages_file_path)
         for page, lines in citation_pages_dict.items():
+            bboxes = [bbox for bbox in db_wages_index.page_line_bboxes(page, lines) if bbox is not None]
             citation_pages.append(page)
-            citation_images.append(
-                render_line_highlights(
-                    text = db_wages_doc[page].get_text(sort=True).strip(),
-                    highlight_lines = lines
+            if bboxes:
+                citation_images.append(
+                    render_pdf_page_with_highlights(
+                        pdf_source = self.db_wages_document,
+                        page = page,
+                        bboxes = bboxes,
+                        padding = 2,  # the text bboxes are tight around the glyphs
+                        raster_cache = self.page_raster_cache
+                    )
+                )
+            else:
+                citation_images.append(
+                    render_line_highlights(
+                        text = db_wages_index.page_text(page),
+                        highlight_lines = lines,
+                        window_lines = self.wd_citation_context_lines
+                    )
                 )
-            )
-        db_wages_doc.close()
 
         return citation_images, citation_pages
 
     async def openai_payroll_compliance_table(self):
         # openai extraction
         async with self._sem:
-            payroll_file_id = await get_or_upload_async(
-                file_path=self.payroll_file_path,
-                client=self.openai_client,
-                cache_path=self.openai_files_cache_path,
-                purpose='user_data'
-            )
-        db_wages_file_text = self.get_db_wages_file_text(include_line_nos=True)
+            payroll_file_id, = await self.upload_documents(self.payroll_document)
+        db_wages_prompt_text = await self.get_db_wages_prompt_text()
+        # instructions + wage determination text form the prefix shared by every payroll in the batch
         openai_compliance_agent = Agent(
             name="Payroll Compliance Agent",
             instructions=self.openai_compliance_matrix_prompt,
             tools=[report_compliance_table, report_parsing_error],
             model=self.openai_model,
+            model_settings=ModelSettings(extra_args={
+                # keyed by the WD text actually sent - payrolls only share a prefix if they got the same retrieval slice
+                'prompt_cache_key': get_prompt_cache_key('compliance_table', self.openai_model, hashlib.sha256(db_wages_prompt_text.encode('utf-8')).hexdigest())
+            }),
             tool_use_behavior='stop_on_first_tool'
         )
         openai_compliance_input = [
@@ -379,7 +678,7 @@ class ComplianceChecker:
                 'content': [
                     {
                         'type': 'input_text',
-                        'text': 'Here is the Davis-Bacon wage determination file, with hex line numbers:\n' + db_wages_file_text
+                        'text': db_wages_prompt_text
                     },
                     {
                         'type': 'input_file',
@@ -403,42 +702,35 @@ class ComplianceChecker:
                 'type': 'input_text',
                 'text': self.relevant_locations_str
             })
-        async with self._sem:
-            with trace('Payroll Compliance Workflow'):
-                openai_compliance_result = await Runner.run(openai_compliance_agent, input=openai_compliance_input)
-        for i, item in enumerate(openai_compliance_result.new_items):
-            if (
-                    i > 0 and
-                    isinstance(item, agents.items.ToolCallOutputItem) and
-                    isinstance(openai_compliance_result.new_items[i - 1], agents.items.ToolCallItem) and
-                    openai_compliance_result.new_items[i - 1].raw_item.name == 'report_compliance_table'
-            ):
-                openai_compliance_table = item.output
-                break
-        else:
-            openai_compliance_table = None
+        with trace('Payroll Compliance Workflow'):
+            openai_compliance_result = await self.run_openai_agent(openai_compliance_agent, openai_compliance_input)
+        self.record_usage(get_openai_usage_record('OpenAI compliance table', openai_compliance_result))
+        openai_compliance_table = get_tool_output(openai_compliance_result, 'report_compliance_table')
         self.openai_compliance_table = openai_compliance_table
         return openai_compliance_table
 
     async def claude_payroll_compliance_table(self):
         """Generate compliance table using Claude."""
-        with open(self.payroll_file_path, "rb") as f:
-            payroll_bytes = f.read()
-        payroll_base64_string = base64.b64encode(payroll_bytes).decode('utf-8')
+        payroll_base64_string = await self.get_document_base64(self.payroll_document)
 
-        db_wages_file_text = self.get_db_wages_file_text(include_line_nos=True)
+        db_wages_prompt_text = await self.get_db_wages_prompt_text()
 
+        # the system prompt and wage determination text are the prefix shared by every payroll in the batch - cache them
+        claude_compliance_system = [
+            {
+                'type': 'text',
+                'text': self.claude_compliance_matrix_prompt,
+                'cache_control': {'type': 'ephemeral'}
+            }
+        ]
         claude_compliance_input = [
             {
                 'role': 'user',
                 'content': [
                     {
                         'type': 'text',
-                        'text': self.claude_compliance_matrix_prompt
-                    },
-                    {
-                        'type': 'text',
-                        'text': 'Here is the Davis-Bacon wage determination file, with hex line numbers:\n' + db_wages_file_text
+                        'text': db_wages_prompt_text,
+                        'cache_control': {'type': 'ephemeral'}
                     },
                     {
                         'type': 'document',
@@ -470,46 +762,20 @@ class ComplianceChecker:
                 'type': 'text',
                 'text': self.relevant_locations_str
             })
-        async with self._sem:
-            for wait in range(self.max_claude_waits):
-                try:
-                    claude_compliance_response = await self.anthropic_client.messages.create(
-                        model=self.claude_model,
-                        messages=claude_compliance_input,
-                        max_tokens=10_000
-                    )
-                    break
-                except anthropic.RateLimitError as e:
-                    if wait+1 == self.max_claude_waits:
-                        raise e
-                    else:
-                        await asyncio.sleep(self.claude_wait_time)
-
-
+        claude_compliance_response = await self.create_claude_message(
+            model=self.claude_model,
+            system=claude_compliance_system,
+            messages=claude_compliance_input,
+            max_tokens=10_000
+        )
+        self.record_usage(get_claude_usage_record('Claude compliance table', claude_compliance_response.usage))
 
         claude_compliance_result = json.loads('{"success":' + claude_compliance_response.content[0].text)
         try:
             assert claude_compliance_result.get('success'), 'Claude indicated failure in compliance table extraction.'
             if 'wage_checks' not in claude_compliance_result:
                 raise ValueError("Claude response indicates success but no 'wage_checks' found in response.")
-            claude_wage_checks = [
-                EmployeeWageCheck(
-                    employee_name=wage_check['employee_name'],
-                    identification_number =wage_check['identification_number'],
-                    payroll_title=wage_check['payroll_title'],
-                    davis_bacon_classification=wage_check['davis_bacon_classification'],
-                    davis_bacon_base_rate=wage_check['davis_bacon_base_rate'],
-                    davis_bacon_fringe_rate=wage_check['davis_bacon_fringe_rate'],
-                    davis_bacon_total_rate=wage_check['davis_bacon_total_rate'],
-                    overtime_rate=wage_check.get('overtime_rate'),
-                    paid_rate=wage_check['paid_rate'],
-                    compliance_reasoning=wage_check['compliance_reasoning'],
-                    compliance=wage_check['compliance'],
-                    payroll_citation_lines=wage_check['payroll_citation_lines'],
-                    wage_determination_citation_lines=wage_check['wage_determination_citation_lines']
-                )
-                for wage_check in claude_compliance_result['wage_checks']
-            ]
+            claude_wage_checks = [parse_claude_wage_check(wage_check) for wage_check in claude_compliance_result['wage_checks']]
             claude_compliance_table = ComplianceTable(
                 payroll_name=claude_compliance_result.get('payroll_name', ''),
                 is_one_week=claude_compliance_result['is_one_week'],
@@ -525,25 +791,10 @@ class ComplianceChecker:
             claude_compliance_table = None
         return claude_compliance_table
 
-    async def openai_single_wage_check(self, employee_wage_check: EmployeeWageCheck):
-        """Re-check a single employee's wage using OpenAI."""
-        upload_coroutines = [
-            get_or_upload_async(
-                file_path=path,
-                client=self.openai_client,
-                cache_path=self.openai_files_cache_path,
-                purpose='user_data'
-            )
-            for path in [self.db_wages_file_path, self.payroll_file_path]
-        ]
-        db_wages_file_id, payroll_file_id = await asyncio.gather(*upload_coroutines)
-        openai_check_agent = Agent(
-            name="Payroll Check Agent",
-            instructions=self.openai_single_wage_check_prompt,
-            tools=[report_wage_check, report_parsing_error],
-            model=self.openai_model,
-            tool_use_behavior='stop_on_first_tool'
-        )
+    async def get_openai_wage_check_input(self, request_text: str) -> tuple[list, str, str]:
+        """Build the OpenAI re-check input - the files, OCR text and locations shared by every re-check of this
+        payroll, followed by `request_text`. Returns the input and the wage determination/payroll file IDs."""
+        db_wages_file_id, payroll_file_id = await self.upload_documents(self.db_wages_document, self.payroll_document)
         openai_check_input = [
             {
                 'role': 'user',
@@ -576,47 +827,29 @@ class ComplianceChecker:
             })
         openai_check_input[0]['content'].append({
             'type': 'input_text',
-            'text': f'Please extract the payroll information for the following employee: {employee_wage_check.employee_name}'
+            'text': request_text
         })
-        async with self._sem:
-            with trace(f'Payroll Checking Workflow for {employee_wage_check.employee_name}'):
-                openai_check_result = await Runner.run(openai_check_agent, input=openai_check_input)
-        for i, item in enumerate(openai_check_result.new_items):
-            if (
-                    i > 0 and
-                    isinstance(item, agents.items.ToolCallOutputItem) and
-                    isinstance(openai_check_result.new_items[i - 1], agents.items.ToolCallItem) and
-                    openai_check_result.new_items[i - 1].raw_item.name == 'report_wage_check'
-            ):
-                openai_wage_check = item.output
-                break
-        else:
-            openai_wage_check = None
-        return openai_wage_check
-
-    async def claude_single_wage_check(self, employee_wage_check: EmployeeWageCheck):
-        """Re-check a single employee's wage using Claude."""
-        with open(self.payroll_file_path, "rb") as f:
-            payroll_bytes = f.read()
-        payroll_base64_string = base64.b64encode(payroll_bytes).decode('utf-8')
-        with open(self.db_wages_file_path, "rb") as f:
-            db_wages_bytes = f.read()
-        db_wages_base64_string = base64.b64encode(db_wages_bytes).decode('utf-8')
+        return openai_check_input, db_wages_file_id, payroll_file_id
+
+    async def get_claude_wage_check_input(self, request_text: str) -> list:
+        """Build the Claude re-check messages - the files, OCR text and locations shared by every re-check of this
+        payroll (cached), followed by `request_text`."""
+        payroll_base64_string, db_wages_base64_string = await asyncio.gather(
+            self.get_document_base64(self.payroll_document),
+            self.get_document_base64(self.db_wages_document)
+        )
         claude_check_input = [
             {
                 'role': 'user',
                 'content': [
-                    {
-                        'type': 'text',
-                        'text': self.claude_single_wage_check_prompt
-                    },
                     {
                         'type': 'document',
                         'source': {
                             'type': 'base64',
                             'media_type': 'application/pdf',
                             'data': db_wages_base64_string
-                        }
+                        },
+                        'cache_control': {'type': 'ephemeral'}
                     },
                     {
                         'type': 'document',
@@ -648,49 +881,136 @@ class ComplianceChecker:
                 'type': 'text',
                 'text': self.relevant_locations_str
             })
+        claude_check_input[0]['content'][-1]['cache_control'] = {'type': 'ephemeral'}
         claude_check_input[0]['content'].append({
             'type': 'text',
-            'text': f'Please extract the payroll information for the following employee: {employee_wage_check.employee_name}'
+            'text': request_text
         })
+        return claude_check_input
+
+    async def create_claude_message(self, **kwargs):
+        """Create a Claude message under the shared Anthropic rate limiter, which paces requests by the rate limit
+        headers and retries rate limited/overloaded requests with backoff. The semaphore is only held while a request
+        is in flight."""
+        raw_response = await self.anthropic_limiter.call(
+            lambda: self.anthropic_client.messages.with_raw_response.create(**kwargs),
+            get_headers=lambda response: response.headers,
+            slot=self._sem
+        )
+        return raw_response.parse()
 
-        async with self._sem:
-            for wait in range(self.max_claude_waits):
-                try:
-                    claude_check_response = await self.anthropic_client.messages.create(
-                        model=self.claude_model,
-                        messages=claude_check_input,
-                        max_tokens=10_000
-                    )
-                    break
-                except anthropic.RateLimitError as e:
-                    if wait+1 == self.max_claude_waits:
-                        raise e
-                    else:
-                        await asyncio.sleep(self.claude_wait_time)
+    async def run_openai_agent(self, agent: Agent, agent_input: list):
+        """Run an agent with each of its model requests paced by the shared OpenAI rate limiter (and holding the
+        semaphore while in flight). Rate limited/failed requests are retried with backoff individually, so the run's
+        tool calls aren't repeated."""
+        return await Runner.run(agent, input=agent_input, run_config=self.openai_run_config)
+
+    async def openai_single_wage_check(self, employee_wage_check: EmployeeWageCheck):
+        """Re-check a single employee's wage using OpenAI."""
+        openai_check_input, db_wages_file_id, payroll_file_id = await self.get_openai_wage_check_input(
+            f'Please extract the payroll information for the following employee: {employee_wage_check.employee_name}'
+        )
+        # everything but the employee name is shared by all re-checks of this payroll
+        openai_check_agent = Agent(
+            name="Payroll Check Agent",
+            instructions=self.openai_single_wage_check_prompt,
+            tools=[report_wage_check, report_parsing_error],
+            model=self.openai_model,
+            model_settings=ModelSettings(extra_args={
+                'prompt_cache_key': get_prompt_cache_key('single_wage_check', self.openai_model, db_wages_file_id, payroll_file_id)
+            }),
+            tool_use_behavior='stop_on_first_tool'
+        )
+        with trace(f'Payroll Checking Workflow for {employee_wage_check.employee_name}'):
+            openai_check_result = await self.run_openai_agent(openai_check_agent, openai_check_input)
+        self.record_usage(get_openai_usage_record(f'OpenAI wage check for {employee_wage_check.employee_name}', openai_check_result))
+        return get_tool_output(openai_check_result, 'report_wage_check')
+
+    async def claude_single_wage_check(self, employee_wage_check: EmployeeWageCheck):
+        """Re-check a single employee's wage using Claude."""
+        # cache the system prompt, the wage determination, and everything else shared by all re-checks of this payroll
+        claude_check_system = [
+            {
+                'type': 'text',
+                'text': self.claude_single_wage_check_prompt,
+                'cache_control': {'type': 'ephemeral'}
+            }
+        ]
+        claude_check_input = await self.get_claude_wage_check_input(
+            f'Please extract the payroll information for the following employee: {employee_wage_check.employee_name}'
+        )
+        claude_check_response = await self.create_claude_message(
+            model=self.claude_model,
+            system=claude_check_system,
+            messages=claude_check_input,
+            max_tokens=10_000
+        )
+        self.record_usage(get_claude_usage_record(f'Claude wage check for {employee_wage_check.employee_name}', claude_check_response.usage))
 
         new_wage_check = json.loads('{"success":' + claude_check_response.content[0].text)
         try:
             assert new_wage_check.get('success'), 'Claude indicated failure in single wage check extraction.'
-            claude_wage_check = EmployeeWageCheck(
-                employee_name=new_wage_check['employee_name'],
-                identification_number=new_wage_check['identification_number'],
-                payroll_title=new_wage_check['payroll_title'],
-                davis_bacon_classification=new_wage_check['davis_bacon_classification'],
-                davis_bacon_base_rate=new_wage_check['davis_bacon_base_rate'],
-                davis_bacon_fringe_rate=new_wage_check['davis_bacon_fringe_rate'],
-                davis_bacon_total_rate=new_wage_check['davis_bacon_total_rate'],
-                overtime_rate=new_wage_check.get('overtime_rate'),
-                paid_rate=new_wage_check['paid_rate'],
-                compliance_reasoning=new_wage_check['compliance_reasoning'],
-                compliance=new_wage_check['compliance'],
-                payroll_citation_lines=new_wage_check['payroll_citation_lines'],
-                wage_determination_citation_lines=new_wage_check['wage_determination_citation_lines'],
-            )
+            claude_wage_check = parse_claude_wage_check(new_wage_check)
         except Exception as e:
             print(f'Claude failed to extract single wage check with error {e}:\n{json.dumps(new_wage_check,indent=2)})')
             claude_wage_check = None
         return claude_wage_check
 
+    async def openai_batch_wage_check(self, employee_wage_checks: list[EmployeeWageCheck]) -> Optional[list[EmployeeWageCheck]]:
+        """Re-check a list of employees' wages using OpenAI, in one request. Returns None if the request failed -
+        otherwise, the returned list may omit employees the model couldn't find."""
+        openai_check_input, db_wages_file_id, payroll_file_id = await self.get_openai_wage_check_input(
+            get_batch_employees_text(employee_wage_checks)
+        )
+        openai_check_agent = Agent(
+            name="Payroll Batch Check Agent",
+            instructions=self.openai_batch_wage_check_prompt,
+            tools=[report_wage_checks, report_parsing_error],
+            model=self.openai_model,
+            model_settings=ModelSettings(extra_args={
+                'prompt_cache_key': get_prompt_cache_key('batch_wage_check', self.openai_model, db_wages_file_id, payroll_file_id)
+            }),
+            tool_use_behavior='stop_on_first_tool'
+        )
+        with trace(f'Payroll Batch Checking Workflow for {len(employee_wage_checks)} employees'):
+            openai_check_result = await self.run_openai_agent(openai_check_agent, openai_check_input)
+        self.record_usage(get_openai_usage_record(f'OpenAI batch wage check for {len(employee_wage_checks)} employees', openai_check_result))
+        openai_wage_checks = get_tool_output(openai_check_result, 'report_wage_checks')
+        return None if openai_wage_checks is None else openai_wage_checks.wage_checks
+
+    async def claude_batch_wage_check(self, employee_wage_checks: list[EmployeeWageCheck]) -> Optional[list[EmployeeWageCheck]]:
+        """Re-check a list of employees' wages using Claude, in one request. Returns None if the request failed -
+        otherwise, the returned list may omit employees the model couldn't find."""
+        claude_check_system = [
+            {
+                'type': 'text',
+                'text': self.claude_batch_wage_check_prompt,
+                'cache_control': {'type': 'ephemeral'}
+            }
+        ]
+        claude_check_input = await self.get_claude_wage_check_input(get_batch_employees_text(employee_wage_checks))
+        claude_check_response = await self.create_claude_message(
+            model=self.claude_model,
+            system=claude_check_system,
+            messages=claude_check_input,
+            max_tokens=min(4_000 + 2_000 * len(employee_wage_checks), 20_000)  # non-streaming requests must stay under ~21k
+        )
+        self.record_usage(get_claude_usage_record(f'Claude batch wage check for {len(employee_wage_checks)} employees', claude_check_response.usage))
+
+        new_wage_checks = json.loads('{"success":' + claude_check_response.content[0].text)
+        try:
+            assert new_wage_checks.get('success'), 'Claude indicated failure in batch wage check extraction.'
+            claude_wage_checks = []
+            for wage_check in new_wage_checks['wage_checks']:
+                try:
+                    claude_wage_checks.append(parse_claude_wage_check(wage_check))
+                except Exception as e:  # drop the malformed row - it's re-checked individually
+                    print(f'Claude returned a malformed wage check in batch with error {e}:\n{json.dumps(wage_check,indent=2)})')
+        except Exception as e:
+            print(f'Claude failed to extract batch wage checks with error {e}:\n{json.dumps(new_wage_checks,indent=2)})')
+            claude_wage_checks = None
+        return claude_wage_checks
+
     async def resolve_disputed_check(
             self,
             openai_wc: EmployeeWageCheck,
@@ -701,40 +1021,231 @@ class ComplianceChecker:
             self.openai_single_wage_check(employee_wage_check=openai_wc),
             self.claude_single_wage_check(employee_wage_check=claude_wc)
         )
-        if openai_check is None and claude_check is None:
-            return None
-        elif openai_check is None:
-            return claude_check
-        elif claude_check is None:
-            return openai_check
-        elif abs(openai_check.davis_bacon_total_rate - claude_check.davis_bacon_total_rate) > 0.1:
-            return None
-        elif abs(openai_check.paid_rate - claude_check.paid_rate) > 0.1:
-            return None
-        else:  # why do we throw away everything else? because its harder to match those strings. there may be idiosyncrasies in naming conventions
-            return claude_check  # prefer claude
+        return combine_wage_rechecks(openai_check, claude_check)
 
-    async def get_payroll_compliance_table(self, name_match_threshold: float = 80.):
-        """Get the payroll compliance table by running OCR, location extraction, and compliance checks."""
-        # Run preliminary steps if not already done
-        if self.payroll_unstract_json is None:
-            print('Running OCR on payroll...')
-            await self.ocr_payroll()
-            print('OCR complete.')
-
-        if self.project_location_str is None:
-            print('Getting relevant locations...')
-            await self.get_relevant_locations()
-            print(f'Project location: {self.project_location_str}')
-
-        # Run compliance tables from both AI models
-        print('Getting compliance tables from OpenAI and Claude...')
-        openai_compliance_table, claude_compliance_table = await asyncio.gather(
-            self.openai_payroll_compliance_table(),
-            self.claude_payroll_compliance_table()
+    async def batch_wage_checks_with_fallback(
+            self,
+            employee_wage_checks: list[EmployeeWageCheck],
+            batch_check,
+            single_check,
+            name_match_threshold: float = 80.
+    ) -> list[Optional[EmployeeWageCheck]]:
+        """Re-check employees with one provider, in batches of at most max_batch_wage_checks - falling back to
+        single-employee re-checks for any employees a batch omits."""
+        batches = [
+            employee_wage_checks[start:start + self.max_batch_wage_checks]
+            for start in range(0, len(employee_wage_checks), self.max_batch_wage_checks)
+        ]
+        batch_results = await asyncio.gather(*[batch_check(batch) for batch in batches], return_exceptions=True)
+        rechecks = []
+        for batch, batch_result in zip(batches, batch_results):
+            if isinstance(batch_result, Exception):
+                print(f'Batch wage check failed with error {type(batch_result)}: {batch_result}')
+                batch_result = None
+            rechecks.extend(match_batch_wage_checks(batch, batch_result or [], name_match_threshold=name_match_threshold))
+
+        missing_inds = [ind for ind, recheck in enumerate(rechecks) if recheck is None]
+        if missing_inds:
+            print(f'Re-checking {len(missing_inds)} employees omitted from batch wage checks individually...')
+            single_rechecks = await asyncio.gather(*[single_check(employee_wage_check=employee_wage_checks[ind]) for ind in missing_inds])
+            for ind, single_recheck in zip(missing_inds, single_rechecks):
+                rechecks[ind] = single_recheck
+        return rechecks
+
+    async def resolve_disputed_checks(
+            self,
+            disputed_wage_checks: list[tuple[EmployeeWageCheck, EmployeeWageCheck]],
+            name_match_threshold: float = 80.
+    ) -> list[Optional[EmployeeWageCheck]]:
+        """Resolve a payroll's disputed wage checks - one (OpenAI, Claude) pair per employee.
+
+        If both batch prompts are configured, all the disputed employees are re-checked in one request per provider;
+        otherwise (or if there's only one dispute), each is re-checked individually. Returns one resolved wage check
+        per pair, or None where the models still disagree."""
+        if len(disputed_wage_checks) == 0:
+            return []
+        if len(disputed_wage_checks) == 1 or self.openai_batch_wage_check_prompt is None or self.claude_batch_wage_check_prompt is None:
+            return await asyncio.gather(*[
+                self.resolve_disputed_check(openai_wc=openai_wc, claude_wc=claude_wc)
+                for openai_wc, claude_wc in disputed_wage_checks
+            ])
+        openai_rechecks, claude_rechecks = await asyncio.gather(
+            self.batch_wage_checks_with_fallback(
+                [openai_wc for openai_wc, claude_wc in disputed_wage_checks],
+                batch_check=self.openai_batch_wage_check,
+                single_check=self.openai_single_wage_check,
+                name_match_threshold=name_match_threshold
+            ),
+            self.batch_wage_checks_with_fallback(
+                [claude_wc for openai_wc, claude_wc in disputed_wage_checks],
+                batch_check=self.claude_batch_wage_check,
+                single_check=self.claude_single_wage_check,
+                name_match_threshold=name_match_threshold
+            )
         )
-        print('Done.')
+        return [
+            combine_wage_rechecks(openai_check, claude_check)
+            for openai_check, claude_check in zip(openai_rechecks, claude_rechecks)
+        ]
+
+    def get_stage_graph(self, name_match_threshold: float = 80.) -> StageGraph:
+        """The per-payroll pipeline as a DAG: uploads, encoding, WD indexing, OCR and page orientation detection start at
+        once, and each model call starts as soon as the context it needs is ready. The location agent only needs the
+        uploaded files - it gets the OCR text too if that's done first (or always, if locations_wait_for_ocr is set).
+
+        The compliance tables wait for the location agent, since the prompts use the project location to pick zone/area
+        rates. With compliance_tables_wait_for_locations off they start as soon as the documents are ready instead, and
+        any table that ran before the location was known is re-run with it before the comparison step. Tables are
+        checkpointed separately with and without the location context, so a location-less table is never reused for a
+        run that has one."""
+        async def run_ocr(inputs):
+            if self.payroll_unstract_json is None:
+                await self.ocr_payroll()
+            return self.payroll_unstract_json
+
+        async def run_orientation(inputs):
+            try:
+                return await asyncio.to_thread(get_page_rotations, self.payroll_document, self.ocr_result_store)
+            except Exception as e:  # only a precomputation - citations detect orientation on demand instead
+                print(f'Error detecting page orientations for {self.payroll_file_path}: {type(e).__name__}: {e}')
+                return {}
+
+        async def run_wd_citation_layouts(inputs):
+            try:
+                await asyncio.to_thread(self.prepare_db_wages_citations)
+            except Exception as e:  # only a precomputation - citations lay out their page on demand instead
+                print(f'Error laying out WD citation pages: {type(e).__name__}: {e}')
+
+        async def run_uploads(inputs):
+            async with self._sem:
+                return await self.upload_documents(self.payroll_document, self.db_wages_document)
+
+        async def run_locations(inputs):
+            if self.project_location_str is None:
+                location_result = await self.run_checkpointed(
+                    'locations',
+                    self.get_relevant_locations,
+                    dump=lambda location_result: location_result.model_dump(mode='json'),
+                    load=LocationResult.model_validate
+                )
+                self.set_location_result(location_result)
+                print(f'Project location: {self.project_location_str}')
+            return self.project_location_str
+
+        compliance_table_makers = {
+            'openai_compliance_table': self.openai_payroll_compliance_table,
+            'claude_compliance_table': self.claude_payroll_compliance_table,
+        }
+
+        async def run_compliance_table(stage_name: str) -> Optional[ComplianceTable]:
+            had_locations = self.project_location_str is not None
+            self._compliance_table_had_locations[stage_name] = had_locations
+            compliance_table = await self.run_checkpointed(
+                stage_name if had_locations else f'{stage_name}.no_locations',
+                compliance_table_makers[stage_name],
+                dump=lambda compliance_table: compliance_table.model_dump(mode='json'),
+                load=ComplianceTable.model_validate
+            )
+            if stage_name == 'openai_compliance_table':
+                self.openai_compliance_table = compliance_table
+            return compliance_table
+
+        async def add_location_context(stage_name: str, compliance_table: Optional[ComplianceTable]) -> Optional[ComplianceTable]:
+            if self.project_location_str is None or self._compliance_table_had_locations.get(stage_name):
+                return compliance_table
+            print(f'Re-running {stage_name} for {self.payroll_file_path} with the project location')
+            return await run_compliance_table(stage_name)
+
+        async def run_combine(inputs):
+            openai_compliance_table, claude_compliance_table = await asyncio.gather(
+                add_location_context('openai_compliance_table', inputs['openai_compliance_table']),
+                add_location_context('claude_compliance_table', inputs['claude_compliance_table'])
+            )
+
+            def combine():
+                return self.combine_compliance_tables(
+                    openai_compliance_table,
+                    claude_compliance_table,
+                    name_match_threshold=name_match_threshold
+                )
+            if openai_compliance_table is None or claude_compliance_table is None:
+                return await combine()  # not checkpointed - a retry should redo the model that failed
+            return await self.run_checkpointed('combine', combine, dump=dump_combined_result, load=load_combined_result)
 
+        ocr_dependency = {'inputs': ['uploads', 'ocr']} if self.locations_wait_for_ocr else {'inputs': ['uploads'], 'optional_inputs': ['ocr']}
+        if self.compliance_tables_wait_for_locations:
+            table_dependency = {'inputs': ['wd_index', 'ocr', 'locations']}
+        else:
+            table_dependency = {'inputs': ['wd_index', 'ocr'], 'optional_inputs': ['locations']}
+        return StageGraph([
+            Stage('ocr', run_ocr),
+            # so citation dialogs never run Tesseract - see GlobalUtils.orientation
+            Stage('orientation', run_orientation),
+            Stage('uploads', run_uploads),
+            Stage('payroll_base64', lambda inputs: self.get_document_base64(self.payroll_document)),
+            Stage('wd_index', lambda inputs: asyncio.to_thread(self.get_db_wages_index)),
+            Stage('wd_citation_layouts', run_wd_citation_layouts, inputs=['wd_index']),
+            Stage('locations', run_locations, **ocr_dependency),
+            Stage('openai_compliance_table', lambda inputs: run_compliance_table('openai_compliance_table'), inputs=['uploads', *table_dependency['inputs']], optional_inputs=table_dependency.get('optional_inputs', ())),
+            Stage('claude_compliance_table', lambda inputs: run_compliance_table('claude_compliance_table'), inputs=['payroll_base64', *table_dependency['inputs']], optional_inputs=table_dependency.get('optional_inputs', ())),
+            Stage('combine', run_combine, inputs=['openai_compliance_table', 'claude_compliance_table', 'locations']),
+        ])
+
+    def get_run_key(self) -> str:
+        """Key of this payroll's run in the run store: the payroll and WD digests, and a version of everything else the
+        stage outputs depend on (prompts, models, WD retrieval)."""
+        if self._run_key is None:
+            prompts = [
+                self.openai_compliance_matrix_prompt, self.openai_single_wage_check_prompt,
+                self.claude_compliance_matrix_prompt, self.claude_single_wage_check_prompt,
+                self.openai_batch_wage_check_prompt, self.claude_batch_wage_check_prompt,
+                self.relevant_locations_prompt,
+            ]
+            version = hashlib.sha256(json.dumps([prompts, self.openai_model, self.claude_model, self.wd_retrieval_min_lines, self.max_batch_wage_checks]).encode('utf-8')).hexdigest()
+            self._run_key = get_run_key(self.payroll_document.get_digest(), self.db_wages_document.get_digest(), version)
+        return self._run_key
+
+    async def run_checkpointed(self, stage_name: str, run: Callable[[], Awaitable], dump: Callable, load: Callable):
+        """Run a stage, or load its output if an earlier run of this payroll (same documents, prompts and models)
+        checkpointed it. None outputs (the model didn't produce a result) aren't checkpointed, so they're retried."""
+        if self.run_store is None:
+            return await run()
+        run_key = await asyncio.to_thread(self.get_run_key)
+        checkpoint = await asyncio.to_thread(self.run_store.get, run_key, stage_name)
+        if checkpoint is not None:
+            print(f'Resumed {stage_name} for {self.payroll_file_path} from its checkpoint')
+            return load(checkpoint['output'])
+        output = await run()
+        if output is not None:
+            await asyncio.to_thread(self.run_store.put, run_key, stage_name, dump(output))
+        return output
+
+    async def get_payroll_compliance_table(self, name_match_threshold: float = 80.):
+        """Get the payroll compliance table by running OCR, location extraction, and compliance checks. Stages
+        checkpointed by an earlier run (see run_checkpointed) are loaded rather than re-run."""
+        stage_graph = self.get_stage_graph(name_match_threshold=name_match_threshold)
+        self.stage_graph = stage_graph
+        try:
+            stage_results = await stage_graph.run()
+        finally:
+            self.stage_timings = stage_graph.timings
+            print(f'Pipeline stages for {self.payroll_file_path}:\n{stage_graph.format_timings()}')
+        return stage_results['combine']
+
+    def get_stage_statuses(self) -> dict[str, str]:
+        """Get the status of each pipeline stage ('pending', 'running', 'done' or 'failed') - safe to poll from another
+        thread while the pipeline runs."""
+        if self.stage_graph is None:
+            return {name: 'pending' for name in self.get_stage_graph().stages}
+        return dict(self.stage_graph.statuses)
+
+    async def combine_compliance_tables(
+            self,
+            openai_compliance_table: Optional[ComplianceTable],
+            claude_compliance_table: Optional[ComplianceTable],
+            name_match_threshold: float = 80.
+    ):
+        """Pair up the two models' wage checks, resolve the disputed ones and build the final compliance table."""
         if openai_compliance_table is None and claude_compliance_table is None:
             return None, None, None, None
         elif openai_compliance_table is None:
@@ -744,24 +1255,15 @@ class ComplianceChecker:
 
         # if we reach here, both are non-null - concordance time
 
-        # pair up wage checks by employee name similarity
-        wage_check_comparisons = []
-        for openai_ind, openai_wc in enumerate(openai_compliance_table.wage_checks):
-            for claude_ind, claude_wc in enumerate(claude_compliance_table.wage_checks):
-                score = fuzz.ratio(openai_wc.employee_name, claude_wc.employee_name, processor=rapidfuzz_default_process)
-                wage_check_comparisons.append((score, openai_ind, claude_ind))
-        wage_check_comparisons.sort(reverse=True, key=lambda x: x[0])
-        unmatched_openai_inds = set(range(len(openai_compliance_table.wage_checks)))
-        unmatched_claude_inds = set(range(len(claude_compliance_table.wage_checks)))
+        # pair up wage checks by employee (identification number, then name similarity)
+        concordance = match_wage_checks(
+            openai_compliance_table.wage_checks,
+            claude_compliance_table.wage_checks,
+            name_match_threshold=name_match_threshold
+        )
         matched_wage_checks = []
         disputed_wage_checks = []
-        for score, openai_ind, claude_ind in wage_check_comparisons:
-            if score < name_match_threshold:
-                break
-            if (openai_ind not in unmatched_openai_inds) or (claude_ind not in unmatched_claude_inds):
-                continue
-            unmatched_openai_inds.remove(openai_ind)
-            unmatched_claude_inds.remove(claude_ind)
+        for openai_ind, claude_ind in concordance.pairs:
             openai_wc = openai_compliance_table.wage_checks[openai_ind]
             claude_wc = claude_compliance_table.wage_checks[claude_ind]
             if abs(openai_wc.davis_bacon_total_rate - claude_wc.davis_bacon_total_rate)>0.1:
@@ -770,20 +1272,17 @@ class ComplianceChecker:
                 disputed_wage_checks.append((openai_wc, claude_wc))
             else: # why do we throw away everything else? because its harder to match those strings. there may be idiosyncrasies in naming conventions
                 matched_wage_checks.append(claude_wc) # prefer claude
-        unmatched_openai = [openai_compliance_table.wage_checks[ind] for ind in unmatched_openai_inds]
-        unmatched_claude = [claude_compliance_table.wage_checks[ind] for ind in unmatched_claude_inds]
+        unmatched_openai = [openai_compliance_table.wage_checks[ind] for ind in concordance.unmatched_left]
+        unmatched_claude = [claude_compliance_table.wage_checks[ind] for ind in concordance.unmatched_right]
 
         print('Resolving disputed wage checks...')
         # resolved matched but disputed wage checks
-        disputed_resolution_tasks = [
-            self.resolve_disputed_check(openai_wc=openai_wc, claude_wc=claude_wc)
-            for openai_wc, claude_wc in disputed_wage_checks
-        ]
-        disputed_resolutions = await asyncio.gather(*disputed_resolution_tasks)
+        disputed_resolutions = await self.resolve_disputed_checks(disputed_wage_checks, name_match_threshold=name_match_threshold)
         agreed_wage_checks = [wage_check for wage_check in disputed_resolutions if wage_check is not None]
         disputed_wage_checks = [disputed_wage_checks[disputed_ind] for disputed_ind in range(len(disputed_wage_checks)) if disputed_resolutions[disputed_ind] is None]
         matched_wage_checks.extend(agreed_wage_checks)
         print('Done.')
+        self.check_wage_check_rates(matched_wage_checks)  # notes mismatched rates on the wage checks
         return (
             ComplianceTable(
                 payroll_name = openai_compliance_table.payroll_name,
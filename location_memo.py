@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import weakref
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from pydantic import BaseModel
+
+from pydeck_rendering import StoredLocation
+
+LOCATION_MEMO_VERSION = 1
+# e.g. "Project or Contract No. 21-4417", "CONTRACT #: DTFH68-22-C-00012", "Project Number PR-0042"
+PROJECT_IDENTIFIER_PATTERN = re.compile(
+    r'\b(?:project\s+or\s+contract|contract|project)\s*(?:no\.?|number|num\.?|#|id)\s*[:#.]?\s*'
+    r'([A-Z0-9][A-Z0-9\-/.]*\d[A-Z0-9\-/.]*)',
+    re.IGNORECASE
+)
+
+
+def normalize_project_identifier(identifier: str) -> str:
+    return re.sub(r'[^A-Z0-9]', '', identifier.upper())
+
+
+def detect_project_identifier(text: Optional[str]) -> Optional[str]:
+    """Find the project/contract number on a payroll (normalized to upper-case alphanumerics), or None if there isn't
+    exactly one distinct one."""
+    if not text:
+        return None
+    identifiers = {
+        normalize_project_identifier(match.group(1))
+        for match in PROJECT_IDENTIFIER_PATTERN.finditer(text)
+    }
+    identifiers.discard('')
+    if len(identifiers) != 1:
+        return None
+    return identifiers.pop()
+
+
+class LocationResult(BaseModel):
+    """What the location agent found for a project - the same for every payroll on it."""
+    project_location_name: str
+    project_latitude: str
+    project_longitude: str
+    relevant_locations: list[StoredLocation]
+
+
+class LocationMemo:
+    """Memo of location agent results, keyed by (wage determination digest, project identifier, agent version) - the
+    agent version covers its prompt and model, so stored results don't outlive changes to either.
+
+    Within a process, concurrent lookups of the same key share one computation, so a batch of payrolls for one project
+    runs the location agent once. Results are written to `cache_dir` (if given) as JSON, which serves every later
+    lookup - only in-flight computations are held in memory."""
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self._in_flight = weakref.WeakKeyDictionary()  # event loop -> {key: asyncio.Future}
+
+    @staticmethod
+    def get_key(wd_digest: str, project_identifier: str, agent_version: str) -> str:
+        key_json = json.dumps({
+            'version': LOCATION_MEMO_VERSION,
+            'wd_digest': wd_digest,
+            'project': project_identifier,
+            'agent': agent_version
+        }, sort_keys=True)
+        return hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+
+    def load(self, key: str) -> Optional[LocationResult]:
+        if self.cache_dir is None:
+            return None
+        cache_path = self.cache_dir / f'{key}.json'
+        try:
+            return LocationResult.model_validate_json(cache_path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            print(f'Ignoring unreadable location result {cache_path}: {e}')
+            return None
+
+    def save(self, key: str, result: LocationResult):
+        if self.cache_dir is None:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        cache_path = self.cache_dir / f'{key}.json'
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp_path.write_text(result.model_dump_json(indent=2), encoding='utf-8')
+        os.replace(tmp_path, cache_path)
+
+    async def get_or_compute(
+            self,
+            wd_digest: str,
+            project_identifier: str,
+            agent_version: str,
+            compute: Callable[[], Awaitable[LocationResult]]
+    ) -> LocationResult:
+        """Get the memoized result for a project, computing (and storing) it if there isn't one. If the computation
+        fails, the callers waiting on it each try again themselves."""
+        key = self.get_key(wd_digest, project_identifier, agent_version)
+        in_flight = self._in_flight.setdefault(asyncio.get_running_loop(), {})
+        while key in in_flight:
+            future = in_flight[key]
+            await asyncio.wait([future])
+            if not future.cancelled() and future.exception() is None:
+                return future.result()
+            # otherwise the computing caller failed (and removed its future) - try again
+
+        future = asyncio.get_running_loop().create_future()
+        in_flight[key] = future
+        try:
+            result = await asyncio.to_thread(self.load, key)
+            if result is None:
+                result = await compute()
+                await asyncio.to_thread(self.save, key, result)
+            else:
+                print(f'Using stored locations for project {project_identifier}')
+        except BaseException as e:
+            del in_flight[key]
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # mark retrieved - waiters only check whether it failed
+            raise
+        future.set_result(result)
+        del in_flight[key]  # waiters hold the future - later lookups are served from disk, so finished keys don't pile up
+        return result
+
+
+_location_memos: dict[Optional[Path], LocationMemo] = {}
+_location_memos_lock = threading.Lock()
+
+
+def get_location_memo(cache_dir: Optional[str] = None) -> LocationMemo:
+    """Get the (process-wide) location memo for a cache directory."""
+    key = Path(cache_dir).resolve() if cache_dir is not None else None
+    with _location_memos_lock:
+        if key not in _location_memos:
+            _location_memos[key] = LocationMemo(cache_dir)
+        return _location_memos[key]
@@ -6,10 +6,15 @@ from typing import List, Optional, Sequence, Tuple, Union
 import math
 import os
 
+import numpy as np
 import pandas as pd
 import pydeck as pdk
 from pydantic import BaseModel
 
+from GlobalUtils.gazetteer import haversine_miles
+
+KM_PER_MILE = 1.609344
+
 class StoredLocation(BaseModel):
     name: str
     latitude: float
@@ -20,18 +25,15 @@ class StoredLocation(BaseModel):
 
 
 def _auto_zoom(project_lat: float, project_lon: float, locs: Sequence[StoredLocation]) -> int:
-    def hav_km(lat1, lon1, lat2, lon2):
-        r = 6371.0
-        p1, p2 = math.radians(lat1), math.radians(lat2)
-        dphi = math.radians(lat2 - lat1)
-        dl = math.radians(lon2 - lon1)
-        a = math.sin(dphi / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
-        return 2 * r * math.asin(math.sqrt(a))
-
     if not locs:
         return 12
 
-    max_km = max(hav_km(project_lat, project_lon, l.latitude, l.longitude) for l in locs)
+    max_km = float(np.max(haversine_miles(
+        project_lat,
+        project_lon,
+        [l.latitude for l in locs],
+        [l.longitude for l in locs]
+    ))) * KM_PER_MILE
 
     if max_km < 25:
         return 12
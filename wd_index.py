@@ -0,0 +1,229 @@
+import bisect
+import gzip
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import fitz
+
+from GlobalUtils.openai_uploading import sha256
+
+INDEX_VERSION = 1
+BBOX_MATCH_WINDOW = 16  # how many unmatched text-dict lines to look ahead when assigning bboxes
+
+
+def _union_bbox(bboxes: list[list[float]]) -> list[float]:
+    return [
+        min(b[0] for b in bboxes),
+        min(b[1] for b in bboxes),
+        max(b[2] for b in bboxes),
+        max(b[3] for b in bboxes),
+    ]
+
+
+def _match_line_bboxes(text_lines: list[str], dict_lines: list[tuple[str, list[float]]]) -> list[Optional[list[float]]]:
+    """Assign a bbox to each line of `page.get_text(sort=True)` output.
+
+    The sorted plain text re-spaces columns and inserts blank lines, so its lines don't map 1:1 onto the lines of
+    `page.get_text('dict')`. Each text line is matched to the (whitespace-stripped) dict lines it contains, looking
+    ahead a small window from the first unmatched dict line. Blank or unmatched lines get None."""
+    used = [False] * len(dict_lines)
+    start = 0
+    bboxes = []
+    for line in text_lines:
+        remaining = ''.join(line.split())
+        if not remaining:
+            bboxes.append(None)
+            continue
+        matched = []
+        for k in range(start, min(len(dict_lines), start + BBOX_MATCH_WINDOW)):
+            if used[k]:
+                continue
+            piece, bbox = dict_lines[k]
+            if piece and piece in remaining:
+                remaining = remaining.replace(piece, '', 1)
+                used[k] = True
+                matched.append(bbox)
+                if not remaining:
+                    break
+        while start < len(dict_lines) and used[start]:
+            start += 1
+        bboxes.append(_union_bbox(matched) if matched else None)
+    return bboxes
+
+
+def _extract_page(page: fitz.Page) -> tuple[list[str], list[Optional[list[float]]]]:
+    """Extract the sorted text lines of a page, and the bbox of each line."""
+    text_lines = page.get_text(sort=True).strip().splitlines()
+    dict_lines = []
+    for block in page.get_text('dict', sort=True)['blocks']:
+        if block['type'] != 0:  # skip image blocks
+            continue
+        for line in block['lines']:
+            line_text = ''.join(''.join(span['text'] for span in line['spans']).split())
+            dict_lines.append((line_text, list(line['bbox'])))
+    dict_lines.sort(key=lambda item: (round((item[1][1] + item[1][3]) / 2 / 3), item[1][0]))  # rows (3pt tolerance), then x
+    return text_lines, _match_line_bboxes(text_lines, dict_lines)
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int):
+    """Process pool worker - each worker opens its own handle, since fitz documents can't be shared across processes."""
+    with fitz.open(pdf_path) as doc:
+        return [_extract_page(doc[page_index]) for page_index in range(start, stop)]
+
+
+class WageDeterminationIndex:
+    """Text index of a wage determination PDF, keyed by the file's SHA-256 digest.
+
+    Holds the sorted text lines of each page, the hex-numbered text sent to the models, the global line offset at
+    which each page starts, and the bbox (PDF coordinates) of each line. Line numbers are global across pages and
+    0-indexed, matching the hex numbers in `numbered_text`."""
+    def __init__(self, digest: str, page_lines: list[list[str]], line_bboxes: list[list[Optional[list[float]]]]):
+        self.digest = digest
+        self.page_lines = page_lines
+        self.line_bboxes = line_bboxes
+
+        self.page_line_offsets = [0]
+        for lines in page_lines:
+            self.page_line_offsets.append(self.page_line_offsets[-1] + len(lines))
+
+        self.lines = [line for lines in page_lines for line in lines]
+        self.text = ''.join(line + '\n' for line in self.lines)
+        self.numbered_text = ''.join(f'{hex(line_no)}:{line}\n' for line_no, line in enumerate(self.lines))
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_lines)
+
+    @property
+    def line_count(self) -> int:
+        return self.page_line_offsets[-1]
+
+    @property
+    def page_lengths(self) -> list[int]:
+        return [len(lines) for lines in self.page_lines]
+
+    def page_text(self, page: int) -> str:
+        return '\n'.join(self.page_lines[page])
+
+    def line_page(self, line: int) -> int:
+        """Get the page containing a global line number."""
+        if line < 0 or line >= self.line_count:
+            raise IndexError(f'Line {line} out of range. Index has {self.line_count} lines.')
+        return bisect.bisect_right(self.page_line_offsets, line) - 1
+
+    def lines_page_numbers(self, lines: list[int]) -> dict[int, list[int]]:
+        """Get the pages corresponding to the given global line numbers.
+
+        Returns a dict mapping page # to the (page-local) lines to highlight on that page. Out of range lines are
+        dropped."""
+        pages = dict()
+        for line in sorted(lines):
+            if line < 0 or line >= self.line_count:
+                continue
+            page = self.line_page(line)
+            pages.setdefault(page, []).append(line - self.page_line_offsets[page])
+        return pages
+
+    def numbered_lines_text(self, lines: list[int], gap_marker: str = '[...]') -> str:
+        """Get the hex-numbered text of a subset of lines, keeping their original line numbers. Runs of omitted lines
+        are replaced by a single `gap_marker` line."""
+        text_lines = []
+        previous_line = -1
+        for line in sorted(set(lines)):
+            if line != previous_line + 1:
+                text_lines.append(gap_marker)
+            text_lines.append(f'{hex(line)}:{self.lines[line]}')
+            previous_line = line
+        if previous_line != self.line_count - 1:
+            text_lines.append(gap_marker)
+        return ''.join(text_line + '\n' for text_line in text_lines)
+
+    def line_bbox(self, line: int) -> Optional[list[float]]:
+        page = self.line_page(line)
+        return self.line_bboxes[page][line - self.page_line_offsets[page]]
+
+    def page_line_bboxes(self, page: int, page_lines: list[int]) -> list[Optional[list[float]]]:
+        """Get the bboxes (PDF coordinates of the unrotated page) of page-local lines, as returned by
+        lines_page_numbers. Lines that couldn't be matched to the text layer get None."""
+        return [self.line_bboxes[page][line] for line in page_lines]
+
+    @classmethod
+    def from_pdf(cls, pdf_path: str, digest: Optional[str] = None, parallel_page_threshold: int = 100, max_workers: Optional[int] = None):
+        """Build the index from a PDF. Documents with at least `parallel_page_threshold` pages are extracted in
+        parallel, in page ranges across a process pool."""
+        if digest is None:
+            digest = sha256(Path(pdf_path))
+        with fitz.open(pdf_path) as doc:
+            page_count = len(doc)
+            if page_count < parallel_page_threshold:
+                pages = [_extract_page(page) for page in doc]
+        if page_count >= parallel_page_threshold:
+            max_workers = max_workers or min(os.cpu_count() or 1, 8)
+            chunk_size = -(-page_count // max_workers)
+            ranges = [(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+            # spawned, not forked - the app has threads (event loop, thread pools) that fork would copy mid-flight
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                chunks = pool.map(_extract_page_range, [pdf_path] * len(ranges), *zip(*ranges))
+                pages = [page for chunk in chunks for page in chunk]
+        return cls(
+            digest=digest,
+            page_lines=[text_lines for text_lines, bboxes in pages],
+            line_bboxes=[bboxes for text_lines, bboxes in pages],
+        )
+
+    def save(self, cache_dir: str):
+        cache_path = Path(cache_dir) / f'{self.digest}.json.gz'
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'digest': self.digest, 'page_lines': self.page_lines, 'line_bboxes': self.line_bboxes}, f)
+        os.replace(tmp_path, cache_path)  # atomic, so concurrent readers never see a partial file
+
+    @classmethod
+    def load(cls, cache_dir: str, digest: str):
+        """Load a persisted index, or return None if there isn't a usable one."""
+        cache_path = Path(cache_dir) / f'{digest}.json.gz'
+        if not cache_path.exists():
+            return None
+        try:
+            with gzip.open(cache_path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f'Ignoring unreadable wage determination index {cache_path}: {e}')
+            return None
+        if data.get('version') != INDEX_VERSION or data.get('digest') != digest:
+            return None
+        return cls(digest=digest, page_lines=data['page_lines'], line_bboxes=data['line_bboxes'])
+
+
+_indexes: dict[str, WageDeterminationIndex] = {}
+_index_locks: dict[str, threading.Lock] = {}
+_index_locks_guard = threading.Lock()
+
+
+def get_wage_determination_index(pdf_path: str, cache_dir: Optional[str] = None, digest: Optional[str] = None) -> WageDeterminationIndex:
+    """Get the index for a wage determination PDF, building it at most once per process.
+
+    Indexes are shared by every checker and session in the process, and persisted to `cache_dir` (if given) so they
+    survive restarts. Concurrent callers for the same document wait on the first build rather than repeating it."""
+    if digest is None:
+        digest = sha256(Path(pdf_path))
+    if digest in _indexes:
+        return _indexes[digest]
+    with _index_locks_guard:
+        lock = _index_locks.setdefault(digest, threading.Lock())
+    with lock:
+        if digest in _indexes:
+            return _indexes[digest]
+        index = WageDeterminationIndex.load(cache_dir, digest) if cache_dir is not None else None
+        if index is None:
+            index = WageDeterminationIndex.from_pdf(pdf_path, digest=digest)
+            if cache_dir is not None:
+                index.save(cache_dir)
+        _indexes[digest] = index
+    return index
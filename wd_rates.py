@@ -0,0 +1,250 @@
+import re
+from typing import Optional
+
+import numpy as np
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process as rapidfuzz_default_process
+
+from wd_index import WageDeterminationIndex
+
+# e.g. "  ELEC0068-001 06/01/2023" or "SUCO2015-007 11/30/2015"
+RATE_IDENTIFIER_PATTERN = re.compile(r'^\s*([A-Z]{4}\d{4}-\d{3})\s+(\d{1,2}/\d{1,2}/\d{4})\s*$')
+# e.g. "ELECTRICIAN......................$ 41.75            15.73" or "     Group 1.....$ 33.62 **   31%+6.83"
+RATE_LINE_PATTERN = re.compile(r'^(?P<label>.*?)\.{2,}\s*\$\s*(?P<base>\d[\d,]*\.\d+)\s*(?:\*\*)?\s*(?P<fringe>\S.*?)?\s*$')
+GROUP_LABEL_PATTERN = re.compile(r'^(group|grp|zone|area|class|level|region|district|tier)\b|^\(?\d+[a-z]?\)|^[a-z]\)', re.IGNORECASE)
+FRINGE_NUMBER_PATTERN = re.compile(r'^\d[\d,]*\.\d+$')
+MODIFICATION_HEADER_PATTERN = re.compile(r'^\s*Modification\s+Number\s+Publication\s+Date', re.IGNORECASE)
+MODIFICATION_LINE_PATTERN = re.compile(r'^\s*(\d+)\s+(\d{1,2}/\d{1,2}/\d{4})\s*$')
+SECTION_BREAK_PATTERN = re.compile(r'^\s*-{10,}\s*$')
+RATES_HEADER_PATTERN = re.compile(r'^\s*Rates\s+Fringes\s*$', re.IGNORECASE)
+MAX_PENDING_LINES = 3  # classification names wrap over at most a few lines - anything longer is footnote text
+
+
+def normalize_classification(text: str) -> str:
+    return ' '.join(rapidfuzz_default_process(text).split())
+
+
+def _parse_fringe(fringe_text: str) -> float:
+    """Parse a plain fringe amount. Percentage/footnoted fringes (e.g. '31%+6.83', '5.20+a') are returned as NaN, and
+    are kept verbatim in the table's `fringe_text` column."""
+    fringe_text = fringe_text.strip()
+    if FRINGE_NUMBER_PATTERN.match(fringe_text):
+        return float(fringe_text.replace(',', ''))
+    return np.nan
+
+
+class RateCheckResult:
+    """Result of checking reported Davis-Bacon rates against a WageRateTable. All attributes are arrays aligned with
+    the checked rows.
+
+    `matched` is False where no table row scored above the cutoff - those rows can't be checked locally, and are
+    reported as ok. Fringes that aren't plain amounts in the table are likewise reported as ok."""
+    def __init__(self, rows, scores, matched, expected_base_rates, expected_fringe_rates, base_ok, fringe_ok):
+        self.rows = rows
+        self.scores = scores
+        self.matched = matched
+        self.expected_base_rates = expected_base_rates
+        self.expected_fringe_rates = expected_fringe_rates
+        self.base_ok = base_ok
+        self.fringe_ok = fringe_ok
+
+    @property
+    def ok(self) -> np.ndarray:
+        return self.base_ok & self.fringe_ok
+
+
+class WageRateTable:
+    """Columnar table of the rates in a wage determination, parsed from its extracted text.
+
+    Each row is one classification (and group/zone, where the WD breaks a classification down), with its base rate,
+    fringe, the rate identifier and effective date of the section it was found in, and the global line number of the
+    rate line (matching the hex line numbers of WageDeterminationIndex.numbered_text)."""
+    def __init__(
+            self,
+            classification: np.ndarray,
+            group: np.ndarray,
+            base_rate: np.ndarray,
+            fringe_rate: np.ndarray,
+            fringe_text: np.ndarray,
+            rate_identifier: np.ndarray,
+            effective_date: np.ndarray,
+            line_number: np.ndarray,
+            modification_number: Optional[int] = None
+    ):
+        self.classification = classification
+        self.group = group
+        self.base_rate = base_rate
+        self.fringe_rate = fringe_rate
+        self.fringe_text = fringe_text
+        self.rate_identifier = rate_identifier
+        self.effective_date = effective_date
+        self.line_number = line_number
+        self.modification_number = modification_number
+
+        self._keys = [
+            normalize_classification(f'{classification} {group}')
+            for classification, group in zip(self.classification, self.group)
+        ]
+
+    def __len__(self):
+        return len(self.base_rate)
+
+    @property
+    def total_rate(self) -> np.ndarray:
+        return self.base_rate + self.fringe_rate
+
+    @classmethod
+    def from_lines(cls, lines: list[str]):
+        """Parse the rate table from the WD's text lines (without hex line numbers)."""
+        rows = []
+        modification_number = None
+        rate_identifier, effective_date = '', ''
+        class_heading, group_heading = '', ''
+        pending = []  # non-rate lines since the last rate line - the start of a wrapped classification name
+        in_modifications = False
+        for line_no, line in enumerate(lines):
+            stripped = line.strip()
+            if in_modifications:
+                modification_match = MODIFICATION_LINE_PATTERN.match(line)
+                if modification_match:
+                    modification_number = int(modification_match.group(1))
+                    continue
+                if not stripped:
+                    continue
+                in_modifications = False
+            if MODIFICATION_HEADER_PATTERN.match(line):
+                in_modifications = True
+                continue
+            identifier_match = RATE_IDENTIFIER_PATTERN.match(line)
+            if identifier_match:
+                rate_identifier, effective_date = identifier_match.groups()
+                class_heading, group_heading, pending = '', '', []
+                continue
+            if SECTION_BREAK_PATTERN.match(line):
+                rate_identifier, effective_date = '', ''
+                class_heading, group_heading, pending = '', '', []
+                continue
+            if not stripped or RATES_HEADER_PATTERN.match(line) or not rate_identifier:
+                continue
+
+            rate_match = RATE_LINE_PATTERN.match(line)
+            if rate_match is None:
+                if stripped.endswith(':'):
+                    heading = stripped.rstrip(':').strip()
+                    if GROUP_LABEL_PATTERN.match(heading) and class_heading:
+                        group_heading = heading
+                    else:
+                        class_heading, group_heading = ' '.join(pending + [heading]), ''
+                    pending = []
+                else:
+                    pending = (pending + [stripped])[-MAX_PENDING_LINES:]
+                continue
+
+            label = rate_match.group('label').strip()
+            if (not label or GROUP_LABEL_PATTERN.match(label)) and class_heading:
+                classification = class_heading
+                group = ' '.join(part for part in [group_heading, label] if part)
+            else:
+                classification = ' '.join(pending + [label])
+                group = ''
+            fringe_text = (rate_match.group('fringe') or '').strip()
+            rows.append((
+                classification,
+                group,
+                float(rate_match.group('base').replace(',', '')),
+                _parse_fringe(fringe_text),
+                fringe_text,
+                rate_identifier,
+                effective_date,
+                line_no
+            ))
+            pending = []
+
+        columns = list(zip(*rows)) if rows else [[]] * 8
+        return cls(
+            classification=np.array(columns[0], dtype=object),
+            group=np.array(columns[1], dtype=object),
+            base_rate=np.array(columns[2], dtype=np.float64),
+            fringe_rate=np.array(columns[3], dtype=np.float64),
+            fringe_text=np.array(columns[4], dtype=object),
+            rate_identifier=np.array(columns[5], dtype=object),
+            effective_date=np.array(columns[6], dtype=object),
+            line_number=np.array(columns[7], dtype=np.int64),
+            modification_number=modification_number
+        )
+
+    @classmethod
+    def from_index(cls, wd_index: WageDeterminationIndex):
+        return cls.from_lines(wd_index.lines)
+
+    def match_rows(self, classifications: list[str], score_cutoff: float = 90.) -> tuple[np.ndarray, np.ndarray]:
+        """Match classification names (e.g. as reported by the models) to table rows.
+
+        Returns (rows, scores) - the best matching row index for each name (-1 where no row scores at least
+        `score_cutoff`), and its score."""
+        if len(classifications) == 0 or len(self) == 0:
+            return np.full(len(classifications), -1, dtype=np.int64), np.zeros(len(classifications))
+        scores = process.cdist(
+            [normalize_classification(classification) for classification in classifications],
+            self._keys,
+            scorer=fuzz.ratio,
+            workers=-1
+        )
+        rows = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(classifications)), rows]
+        rows = np.where(best_scores >= score_cutoff, rows, -1)
+        return rows, best_scores
+
+    def lookup(self, classification: str, score_cutoff: float = 90.) -> Optional[int]:
+        """Get the row index best matching a classification name, or None if there's no good match."""
+        row = self.match_rows([classification], score_cutoff=score_cutoff)[0][0]
+        return None if row < 0 else int(row)
+
+    def check_rates(
+            self,
+            classifications: list[str],
+            base_rates,
+            fringe_rates,
+            tolerance: float = 0.01,
+            score_cutoff: float = 90.
+    ) -> RateCheckResult:
+        """Check reported base and fringe rates against the table, for many rows at once."""
+        rows, scores = self.match_rows(classifications, score_cutoff=score_cutoff)
+        matched = rows >= 0
+        expected_base_rates = np.full(len(rows), np.nan)
+        expected_fringe_rates = np.full(len(rows), np.nan)
+        expected_base_rates[matched] = self.base_rate[rows[matched]]
+        expected_fringe_rates[matched] = self.fringe_rate[rows[matched]]
+        base_rates = np.asarray(base_rates, dtype=np.float64)
+        fringe_rates = np.asarray(fringe_rates, dtype=np.float64)
+        base_ok = ~matched | np.isclose(base_rates, expected_base_rates, rtol=0., atol=tolerance)
+        fringe_ok = ~matched | np.isnan(expected_fringe_rates) | np.isclose(fringe_rates, expected_fringe_rates, rtol=0., atol=tolerance)
+        return RateCheckResult(
+            rows=rows,
+            scores=scores,
+            matched=matched,
+            expected_base_rates=expected_base_rates,
+            expected_fringe_rates=expected_fringe_rates,
+            base_ok=base_ok,
+            fringe_ok=fringe_ok
+        )
+
+    def check_wage_checks(self, wage_checks: list, tolerance: float = 0.01, score_cutoff: float = 90.) -> RateCheckResult:
+        """Check the Davis-Bacon base and fringe rates reported in a list of EmployeeWageCheck against the table."""
+        return self.check_rates(
+            classifications=[wage_check.davis_bacon_classification for wage_check in wage_checks],
+            base_rates=[wage_check.davis_bacon_base_rate for wage_check in wage_checks],
+            fringe_rates=[wage_check.davis_bacon_fringe_rate for wage_check in wage_checks],
+            tolerance=tolerance,
+            score_cutoff=score_cutoff
+        )
+
+
+_rate_tables: dict[str, WageRateTable] = {}
+
+
+def get_wage_rate_table(wd_index: WageDeterminationIndex) -> WageRateTable:
+    """Get the rate table for an indexed wage determination, parsing it at most once per process."""
+    if wd_index.digest not in _rate_tables:
+        _rate_tables[wd_index.digest] = WageRateTable.from_index(wd_index)
+    return _rate_tables[wd_index.digest]
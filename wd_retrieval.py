@@ -0,0 +1,121 @@
+import bisect
+import re
+from typing import Optional
+
+from rapidfuzz import fuzz, process
+
+from wd_index import WageDeterminationIndex
+from wd_rates import WageRateTable, RATE_IDENTIFIER_PATTERN, SECTION_BREAK_PATTERN
+
+WORD_PATTERN = re.compile(r'[a-z]{3,}')
+ABBREVIATION_PATTERN = re.compile(r'\b([a-z]{3})\.')  # 3-letter words written as abbreviations, e.g. 'Lab.'
+MIN_PREFIX_CHARS = 4  # shorter payroll words only prefix-match a trade when written as an abbreviation
+# words in classification names that don't identify a trade
+CLASSIFICATION_STOPWORDS = {
+    'and', 'the', 'for', 'with', 'only', 'work', 'general', 'common', 'other', 'all', 'including', 'includes',
+    'excluding', 'excludes', 'except', 'type', 'types', 'group', 'zone', 'area', 'class', 'level', 'when', 'such',
+    'heavy', 'highway', 'building', 'residential', 'construction', 'job', 'site',
+}
+# payroll words that would otherwise prefix-match a trade
+PAYROLL_STOPWORDS = {'the', 'and', 'for', 'pay', 'net', 'tax', 'fed', 'fica', 'total', 'rate', 'hours', 'week', 'date'}
+
+
+def get_wd_sections(wd_index: WageDeterminationIndex) -> list[tuple[int, int]]:
+    """Get the (start, stop) global line spans of the rate sections of a WD - each runs from a rate identifier line
+    (e.g. 'ELEC0068-001 06/01/2023') up to the next section break or rate identifier."""
+    sections = []
+    start = None
+    for line_no, line in enumerate(wd_index.lines):
+        if RATE_IDENTIFIER_PATTERN.match(line):
+            if start is not None:
+                sections.append((start, line_no))
+            start = line_no
+        elif start is not None and SECTION_BREAK_PATTERN.match(line):
+            sections.append((start, line_no))
+            start = None
+    if start is not None:
+        sections.append((start, wd_index.line_count))
+    return sections
+
+
+def _classification_keywords(classification: str) -> set[str]:
+    return {word for word in WORD_PATTERN.findall(classification.lower()) if word not in CLASSIFICATION_STOPWORDS}
+
+
+def _payroll_words(payroll_text: str) -> list[str]:
+    return sorted({word for word in WORD_PATTERN.findall(payroll_text.lower()) if word not in PAYROLL_STOPWORDS})
+
+
+def _payroll_prefixes(payroll_text: str, payroll_words: list[str]) -> list[str]:
+    """Get the payroll words that may be abbreviated trade titles - words of at least MIN_PREFIX_CHARS letters, or
+    shorter ones followed by a period. Every 3-letter word would otherwise prefix-match some classification."""
+    abbreviations = {word for word in ABBREVIATION_PATTERN.findall(payroll_text.lower()) if word not in PAYROLL_STOPWORDS}
+    return [word for word in payroll_words if len(word) >= MIN_PREFIX_CHARS or word in abbreviations]
+
+
+def select_wd_lines(
+        wd_index: WageDeterminationIndex,
+        rate_table: WageRateTable,
+        payroll_text: str,
+        keyword_score_cutoff: float = 85.
+) -> Optional[list[int]]:
+    """Select the WD lines relevant to a payroll - every line outside the rate sections (header, footnotes, group
+    definitions etc.), plus the rate sections with a classification matching a word in the payroll's OCR text.
+
+    A classification keyword matches a payroll word if they're fuzzy-equal (OCR misreads, plurals), or if the payroll
+    word is a prefix of it (title abbreviations such as 'Carp', 'Oper', or 'Lab.' - 3-letter prefixes only count when
+    followed by a period). Returns None if no rate section matched.
+    """
+    sections = get_wd_sections(wd_index)
+    if not sections or len(rate_table) == 0:
+        return None
+
+    section_starts = [start for start, stop in sections]
+    section_keywords = [set() for _ in sections]
+    for classification, line_number in zip(rate_table.classification, rate_table.line_number):
+        section_ind = bisect.bisect_right(section_starts, int(line_number)) - 1
+        if section_ind >= 0 and line_number < sections[section_ind][1]:
+            section_keywords[section_ind] |= _classification_keywords(classification)
+
+    keywords = sorted(set().union(*section_keywords))
+    payroll_words = _payroll_words(payroll_text)
+    if not keywords or not payroll_words:
+        return None
+    scores = process.cdist(keywords, payroll_words, scorer=fuzz.ratio, workers=-1)
+    matched_keywords = {keyword for keyword, best_score in zip(keywords, scores.max(axis=1)) if best_score >= keyword_score_cutoff}
+    for word in _payroll_prefixes(payroll_text, payroll_words):
+        matched_keywords.update(keyword for keyword in keywords if keyword.startswith(word))
+
+    selected_sections = [section for section, kws in zip(sections, section_keywords) if kws & matched_keywords]
+    if not selected_sections:
+        return None
+
+    in_section = [False] * wd_index.line_count
+    for start, stop in sections:
+        for line_no in range(start, stop):
+            in_section[line_no] = True
+    selected_lines = [line_no for line_no in range(wd_index.line_count) if not in_section[line_no]]
+    for start, stop in selected_sections:
+        selected_lines.extend(range(start, stop))
+    return sorted(selected_lines)
+
+
+def get_relevant_wd_text(
+        wd_index: WageDeterminationIndex,
+        rate_table: WageRateTable,
+        payroll_text: Optional[str],
+        min_lines: int = 400,
+        max_fraction: float = 0.8
+) -> Optional[str]:
+    """Get the hex-numbered WD text, cut down to the sections relevant to a payroll. Lines keep their original hex
+    numbers, so citations still resolve against the full document.
+
+    Returns None (i.e. use the full text) for short WDs, when there's no payroll text to match against, when nothing
+    matched, or when the relevant sections make up most of the WD anyway."""
+    if payroll_text is None or wd_index.line_count < min_lines:
+        return None
+    selected_lines = select_wd_lines(wd_index, rate_table, payroll_text)
+    if selected_lines is None or len(selected_lines) > max_fraction * wd_index.line_count:
+        return None
+    print(f'Sending {len(selected_lines)}/{wd_index.line_count} wage determination lines relevant to the payroll.')
+    return wd_index.numbered_lines_text(selected_lines)